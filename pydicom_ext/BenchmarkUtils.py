@@ -0,0 +1,514 @@
+#-*- coding:utf-8 -*-
+"""
+    BenchmarkUtils
+
+    Copyright (c) 2017 Tetsuya Shinaji
+
+    This software is released under the MIT License.
+
+    http://opensource.org/licenses/mit-license.php
+
+    Reproducible benchmarks for pydicom_ext. Synthetic data sets are
+    generated with Utils.convert_npy_to_dicom in a number of layouts,
+    and the reading and conversion functions are timed on them. The
+    results are written as JSON, so that they can be compared between
+    versions (see compare_results). The import time of the package and
+    of each module is measured in new processes (see time_imports).
+
+    usage:
+        python -m pydicom_ext.BenchmarkUtils --output results.json
+        python -m pydicom_ext.BenchmarkUtils --output new.json \\
+            --baseline results.json
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import subprocess
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+import pydicom
+from pydicom_ext import __version__ as pydicom_ext_version
+from pydicom_ext import pydicom_series
+from pydicom_ext import Utils
+from pydicom_ext.ConcFormatUtils import ConcFormatHeaderManager
+
+LAYOUTS = ('single_file', 'multi_file', 'gated', 'multi_series')
+IMPORT_MODULES = ('pydicom_ext', 'pydicom_ext.pydicom_series',
+                  'pydicom_ext.Utils', 'pydicom_ext.VtkDataUtils',
+                  'pydicom_ext.ConcFormatUtils',
+                  'pydicom_ext.SeriesIndexUtils', 'pydicom_ext.ScanUtils',
+                  'pydicom_ext.BenchmarkUtils')
+# Slow to import dependencies, that should only be imported when used
+HEAVY_MODULES = ('matplotlib', 'vtk', 'asyncio', 'pydicom', 'numpy')
+
+
+def generate_series(root: str,
+                    layout: str = 'multi_file',
+                    shape: Tuple[int, int, int] = (64, 128, 128),
+                    n_series: int = 4,
+                    n_frames: int = 4,
+                    seed: int = 0,
+                    rle_lossless: bool = False) -> List[str]:
+    """
+    generate a synthetic dicom data set
+    :param root: output directory (created if it does not exist)
+    :param layout: 'single_file' (one multi-frame file),
+                   'multi_file' (a file per slice),
+                   'gated' (n_frames volumes in one series) or
+                   'multi_series' (n_series volumes in their own series)
+    :param shape: shape of a volume (slices, rows, columns)
+    :param n_series: number of series of the multi_series layout
+    :param n_frames: number of time frames of the gated layout
+    :param seed: seed of the random image data and of the UIDs
+    :param rle_lossless: if True, the pixel data is compressed with
+                         RLE Lossless
+    :return: list of the generated files
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f'Unknown layout: {layout}')
+    os.makedirs(root, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    n_volumes = {'gated': n_frames, 'multi_series': n_series}.get(layout, 1)
+
+    files = []
+    instance = 0
+    for volume_idx in range(n_volumes):
+        npy_array = _make_volume(rng, shape)
+        fname = os.path.join(root, f'{layout}_{volume_idx:03d}.dcm')
+        if layout == 'single_file':
+            Utils.convert_npy_to_dicom(npy_array, fname,
+                                       single_file_mode=True,
+                                       rle_lossless=rle_lossless)
+            volume_files = [fname]
+        else:
+            Utils.convert_npy_to_dicom(npy_array, fname,
+                                       single_file_mode=False,
+                                       rle_lossless=rle_lossless)
+            volume_files = [fname.replace('.dcm', f'_{slice_idx:06d}.dcm')
+                            for slice_idx in range(shape[0])]
+
+        # convert_npy_to_dicom derives the UIDs from the current time,
+        # so the UIDs are set here to make the data set reproducible
+        series_idx = volume_idx if layout == 'multi_series' else 0
+        series_uid = f'333.333.0.0.0.{seed}.{series_idx + 1}'
+        frame_idx = volume_idx if layout == 'gated' else None
+        if layout != 'gated':
+            instance = 0
+        for f in volume_files:
+            instance += 1
+            _complete_file(f, series_uid, instance, frame_idx, n_frames)
+        files.extend(volume_files)
+    return files
+
+
+def _make_volume(rng: np.random.RandomState,
+                 shape: Tuple[int, int, int]) -> np.ndarray:
+    """
+    make a volume with a smooth background and noise
+    :param rng: random number generator
+    :param shape: shape of the volume (slices, rows, columns)
+    :return: volume
+    """
+    z, y, x = np.meshgrid(*[np.linspace(-1, 1, n) for n in shape],
+                          indexing='ij')
+    background = 1000. * np.exp(-(x ** 2 + y ** 2 + z ** 2) * 2)
+    return background + rng.normal(0, 50, shape)
+
+
+def _complete_file(filename: str, series_uid: str, instance: int,
+                   frame_idx: Optional[int], n_frames: int):
+    """
+    set the UIDs of a generated file, and the tags that
+    convert_dicom_to_npy requires
+    :param filename: filename
+    :param series_uid: SeriesInstanceUID
+    :param instance: InstanceNumber (1 based)
+    :param frame_idx: time frame index of the gated layout, or None
+    :param n_frames: number of time frames of the gated layout
+    """
+    dcm = pydicom.read_file(filename)
+    dcm.SeriesInstanceUID = series_uid
+    dcm.SOPInstanceUID = f'{series_uid}.{instance}'
+    dcm.file_meta.MediaStorageSOPInstanceUID = dcm.SOPInstanceUID
+    dcm.InstanceNumber = instance
+    dcm.AcquisitionDate = dcm.ContentDate
+    dcm.PatientOrientation = ['L', 'P']
+    dcm.PatientPosition = 'HFS'
+    slope = float(dcm.RescaleSlope)
+    intercept = float(dcm.RescaleIntercept)
+    dcm.WindowCenter = intercept + slope * (2 ** 15)
+    dcm.WindowWidth = slope * (2 ** 16 - 1)
+    if frame_idx is not None:
+        dcm.NumberOfTemporalPositions = n_frames
+        dcm.TemporalPositionIndex = frame_idx + 1
+        dcm.TriggerTime = frame_idx * 100.
+    dcm.save_as(filename, write_like_original=False)
+
+
+def _write_conc_header(filename: str, n_frames: int):
+    """
+    write a synthetic header in the format of ConcFormatHeaderManager
+    :param filename: filename
+    :param n_frames: number of frames
+    """
+    lines = ['# synthetic header', 'model 2000', 'x_dimension 128',
+             'y_dimension 128', 'z_dimension 64', 'pixel_size 0.1',
+             'total_frames ' + str(n_frames), 'end_of_header']
+    for frame in range(n_frames):
+        lines += ['# frame header', f'frame {frame}',
+                  f'frame_start {frame * 60}', 'frame_duration 60',
+                  'scale_factor 1.5',
+                  f'singles {frame} 100 200 300', 'end_of_header']
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def _time_call(func: Callable, repeat: int) -> Tuple[List[float], Dict]:
+    """
+    time a function, and record the metrics of pydicom_series
+    :param func: function without arguments
+    :param repeat: number of calls
+    :return: durations of the calls, metrics summary of the last call
+    """
+    repeat = max(repeat, 1)
+    times = []
+    recorder = None
+    for i in range(repeat):
+        if i == repeat - 1:
+            recorder = pydicom_series.MetricsRecorder()
+            pydicom_series.add_metrics_hook(recorder)
+        try:
+            t0 = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - t0)
+        finally:
+            if recorder is not None:
+                pydicom_series.remove_metrics_hook(recorder)
+    return times, recorder.summary()
+
+
+def _make_result(name: str, layout: str, times: List[float],
+                 metrics: Dict, files: int = 0, nbytes: int = 0) -> Dict:
+    """
+    make a benchmark result
+    :param name: benchmark name
+    :param layout: data set layout
+    :param times: durations of the calls
+    :param metrics: metrics summary
+    :param files: number of files per call
+    :param nbytes: number of bytes per call
+    :return: result
+    """
+    median = float(np.median(times))
+    return {
+        'name': name,
+        'layout': layout,
+        'times': times,
+        'min': min(times),
+        'median': median,
+        'mean': float(np.mean(times)),
+        'files': files,
+        'bytes': nbytes,
+        'files_per_second': files / median if median > 0 else 0.,
+        'mb_per_second': nbytes / median / 1e6 if median > 0 else 0.,
+        'metrics': metrics,
+    }
+
+
+def run_benchmarks(root: Optional[str] = None,
+                   layouts: Tuple[str, ...] = LAYOUTS,
+                   shape: Tuple[int, int, int] = (64, 128, 128),
+                   n_series: int = 4,
+                   n_frames: int = 4,
+                   repeat: int = 3,
+                   workers: int = 4,
+                   seed: int = 0,
+                   rle_lossless: bool = False,
+                   imports: bool = True) -> Dict:
+    """
+    generate the synthetic data sets and run the benchmarks on them
+    :param root: directory for the data sets, a temporary directory is
+                 used (and removed) if None
+    :param layouts: layouts of the data sets (see generate_series)
+    :param shape: shape of a volume (slices, rows, columns)
+    :param n_series: number of series of the multi_series layout
+    :param n_frames: number of time frames of the gated layout
+    :param repeat: number of timed calls per benchmark
+    :param workers: number of workers for the concurrent benchmarks
+    :param seed: seed of the data sets
+    :param rle_lossless: if True, the data sets are compressed with
+                         RLE Lossless
+    :param imports: if True, the import times are measured as well
+    :return: results (see save_results)
+    """
+    tmp_root = None
+    if root is None:
+        root = tmp_root = tempfile.mkdtemp(prefix='pydicom_ext_benchmark_')
+    volume_cache = pydicom_series.get_volume_cache()
+    pydicom_series.set_volume_cache(None)
+    results = []
+    try:
+        for layout in layouts:
+            results.extend(_run_layout(
+                os.path.join(root, layout), layout, shape, n_series,
+                n_frames, repeat, workers, seed, rle_lossless))
+        results.extend(_run_format_utils(root, shape, n_frames, repeat))
+        if imports:
+            results.extend(time_imports(IMPORT_MODULES, repeat))
+    finally:
+        pydicom_series.set_volume_cache(volume_cache)
+        if tmp_root is not None:
+            shutil.rmtree(tmp_root, ignore_errors=True)
+
+    return {
+        'version': pydicom_ext_version,
+        'created': datetime.now().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'pydicom': pydicom.__version__,
+        },
+        'config': {
+            'layouts': list(layouts),
+            'shape': list(shape),
+            'n_series': n_series,
+            'n_frames': n_frames,
+            'repeat': repeat,
+            'workers': workers,
+            'seed': seed,
+            'rle_lossless': rle_lossless,
+            'imports': imports,
+        },
+        'results': results,
+    }
+
+
+def _run_layout(root: str, layout: str, shape: Tuple[int, int, int],
+                n_series: int, n_frames: int, repeat: int, workers: int,
+                seed: int, rle_lossless: bool) -> List[Dict]:
+    """
+    run the benchmarks on a data set
+    :return: results
+    """
+    results = []
+    t0 = time.perf_counter()
+    files = generate_series(root, layout, shape, n_series, n_frames, seed,
+                            rle_lossless)
+    nbytes = sum(os.path.getsize(f) for f in files)
+    results.append(_make_result('convert_npy_to_dicom', layout,
+                                [time.perf_counter() - t0], {},
+                                len(files), nbytes))
+
+    def bench(name, func, n_files=len(files), n_bytes=nbytes):
+        times, metrics = _time_call(func, repeat)
+        results.append(_make_result(name, layout, times, metrics,
+                                    n_files, n_bytes))
+
+    bench('read_files', lambda: pydicom_series.read_files(root))
+    bench('read_files_header_only', lambda: pydicom_series.read_files(
+        root, headerOnly=True, workers=workers))
+    bench('read_files_compact', lambda: pydicom_series.read_files(
+        root, compact=True, workers=workers))
+    if layout == 'gated':
+        bench('read_files_temporal', lambda: pydicom_series.read_files(
+            root, headerOnly=True, workers=workers, temporal=True))
+
+    series = pydicom_series.read_files(root, headerOnly=True)
+    bench('get_pixel_array',
+          lambda: [s.get_pixel_array() for s in series])
+    bench('get_pixel_array_workers',
+          lambda: [s.get_pixel_array(workers=workers) for s in series])
+    bench('convert_dicom_to_npy',
+          lambda: Utils.convert_dicom_to_npy(series[0]),
+          len(series[0]._datasets), 0)
+    dcm = pydicom.read_file(files[0])
+    bench('convert_dataset_to_json',
+          lambda: Utils.convert_dataset_to_json(dcm), 1,
+          os.path.getsize(files[0]))
+    return results
+
+
+def _run_format_utils(root: str, shape: Tuple[int, int, int],
+                      n_frames: int, repeat: int) -> List[Dict]:
+    """
+    run the benchmarks of the vtk and conc format utilities
+    :return: results
+    """
+    results = []
+    header = os.path.join(root, 'header.hdr')
+    _write_conc_header(header, n_frames)
+
+    def conc_roundtrip():
+        manager = ConcFormatHeaderManager(header)
+        manager.save_hdr(os.path.join(root, 'header_copy.hdr'))
+
+    times, metrics = _time_call(conc_roundtrip, repeat)
+    results.append(_make_result('conc_header_roundtrip', 'conc', times,
+                                metrics, 1, os.path.getsize(header)))
+
+    from pydicom_ext import VtkDataUtils
+    if not VtkDataUtils.have_vtk():
+        print('Warning: vtk is not available, skipping the vtk benchmark')
+        return results
+    npy_img = _make_volume(np.random.RandomState(0), shape).astype(
+        np.float32)
+    vtk_file = os.path.join(root, 'volume.vtk')
+
+    def vtk_roundtrip():
+        VtkDataUtils.save_npy_as_vtk_data(vtk_file, [0, 0, 0], [1, 1, 1],
+                                          npy_img)
+        VtkDataUtils.load_vtk_file(vtk_file)
+
+    times, metrics = _time_call(vtk_roundtrip, repeat)
+    results.append(_make_result('vtk_roundtrip', 'vtk', times, metrics,
+                                1, npy_img.nbytes))
+    return results
+
+
+def time_imports(modules: Tuple[str, ...] = IMPORT_MODULES,
+                 repeat: int = 3) -> List[Dict]:
+    """
+    time the import of each module in a new python process
+    :param modules: names of the modules
+    :param repeat: number of imports per module
+    :return: results, with the heavy dependencies (see HEAVY_MODULES)
+             that the import loaded as metrics
+    """
+    env = dict(os.environ)
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [package_root] + [p for p in [env.get('PYTHONPATH')] if p])
+    results = []
+    for module in modules:
+        code = (f'import sys, time\n'
+                f't0 = time.perf_counter()\n'
+                f'import {module}\n'
+                f'print(time.perf_counter() - t0)\n'
+                f'print(" ".join(m for m in {HEAVY_MODULES!r} '
+                f'if m in sys.modules))\n')
+        times = []
+        loaded = []
+        for i in range(max(repeat, 1)):
+            output = subprocess.run([sys.executable, '-c', code], env=env,
+                                    stdout=subprocess.PIPE, check=True,
+                                    universal_newlines=True).stdout
+            lines = output.splitlines()
+            times.append(float(lines[0]))
+            loaded = lines[1].split() if len(lines) > 1 else []
+        results.append(_make_result(f'import {module}', 'import', times,
+                                    {'loaded': loaded}))
+    return results
+
+
+def save_results(results: Dict, filename: str):
+    """
+    save benchmark results as json
+    :param results: results of run_benchmarks
+    :param filename: filename
+    """
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(filename: str) -> Dict:
+    """
+    load benchmark results
+    :param filename: filename
+    :return: results
+    """
+    with open(filename) as f:
+        return json.load(f)
+
+
+def compare_results(baseline: Dict, current: Dict,
+                    threshold: float = 0.2) -> List[Dict]:
+    """
+    compare the median times of two benchmark runs
+    :param baseline: results of the reference run
+    :param current: results of the new run
+    :param threshold: relative slowdown that is reported as a regression
+    :return: list of regressions, with the name, layout, baseline and
+             current median and the ratio of the medians
+    """
+    reference = {(r['name'], r['layout']): r['median']
+                 for r in baseline['results']}
+    regressions = []
+    for r in current['results']:
+        base = reference.get((r['name'], r['layout']))
+        if not base:
+            continue
+        ratio = r['median'] / base
+        if ratio > 1. + threshold:
+            regressions.append({'name': r['name'], 'layout': r['layout'],
+                                'baseline': base, 'current': r['median'],
+                                'ratio': ratio})
+    return regressions
+
+
+def _print_results(results: Dict):
+    """
+    print a table of the results
+    :param results: results of run_benchmarks
+    """
+    print(f"{'benchmark':<40}{'layout':<14}{'median [s]':>12}"
+          f"{'files/s':>12}{'MB/s':>10}")
+    for r in results['results']:
+        print(f"{r['name']:<40}{r['layout']:<14}{r['median']:>12.4f}"
+              f"{r['files_per_second']:>12.1f}{r['mb_per_second']:>10.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark pydicom_ext on synthetic dicom data')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='json file for the results')
+    parser.add_argument('--root', default=None,
+                        help='directory for the data sets '
+                             '(default: a temporary directory)')
+    parser.add_argument('--layouts', nargs='+', default=list(LAYOUTS),
+                        choices=LAYOUTS)
+    parser.add_argument('--shape', nargs=3, type=int, default=[64, 128, 128],
+                        metavar=('SLICES', 'ROWS', 'COLUMNS'))
+    parser.add_argument('--series', type=int, default=4,
+                        help='number of series of the multi_series layout')
+    parser.add_argument('--frames', type=int, default=4,
+                        help='number of time frames of the gated layout')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rle', action='store_true',
+                        help='compress the data sets with RLE Lossless')
+    parser.add_argument('--skip-imports', action='store_true',
+                        help='do not measure the import times')
+    parser.add_argument('--baseline', default=None,
+                        help='json file of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.root, tuple(args.layouts),
+                             tuple(args.shape), args.series, args.frames,
+                             args.repeat, args.workers, args.seed, args.rle,
+                             not args.skip_imports)
+    save_results(results, args.output)
+    _print_results(results)
+    if args.baseline is not None:
+        baseline = load_results(args.baseline)
+        if baseline['config'] != results['config']:
+            print('Warning: the baseline was run with another configuration')
+        regressions = compare_results(baseline, results, args.threshold)
+        for r in regressions:
+            print(f"Regression: {r['name']} ({r['layout']}) "
+                  f"{r['baseline']:.4f} s -> {r['current']:.4f} s")
+        sys.exit(1 if regressions else 0)
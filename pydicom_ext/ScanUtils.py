@@ -0,0 +1,412 @@
+#-*- coding:utf-8 -*-
+"""
+    ScanUtils
+
+    Copyright (c) 2017 Tetsuya Shinaji
+
+    This software is released under the MIT License.
+
+    http://opensource.org/licenses/mit-license.php
+
+    Command line tool to scan directories of dicom files. The series
+    that are found are written to a JSON or CSV manifest, optionally
+    converted to npy or vtk files, and the throughput of the scan and
+    the conversion is printed.
+
+    Large archives can be scanned in two phases on many machines: each
+    machine scans a shard of the files into a per-file manifest, and the
+    shards are merged into the same series as a scan on a single machine.
+
+    usage:
+        pydicom_ext_scan /data/archive1 /data/archive2 --workers 8 \\
+            --manifest series.json
+        pydicom_ext_scan /data/archive --convert npy --output /data/npy
+        python -m pydicom_ext.ScanUtils /data/archive --manifest series.csv
+
+        pydicom_ext_scan /data/archive --shard 0 2 --save-shard 0.json.gz
+        pydicom_ext_scan /data/archive --shard 1 2 --save-shard 1.json.gz
+        pydicom_ext_scan 0.json.gz 1.json.gz --merge --manifest series.json
+
+"""
+
+import os
+import csv
+import sys
+import gzip
+import json
+import time
+import argparse
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from pydicom_ext import pydicom_series
+from pydicom_ext.SeriesIndexUtils import dataset_to_json, dataset_from_json
+
+MANIFEST_FIELDS = ('suid', 'shape', 'sampling', 'n_files', 'nbytes', 'files')
+SHARD_VERSION = 2
+
+
+def scan(roots: Sequence[str],
+         workers: int = 4,
+         backend: str = 'thread',
+         index: Optional[str] = None,
+         compact: bool = False,
+         temporal: bool = False) -> Tuple[List, Dict]:
+    """
+    scan the dicom files in one or many directories (header-only)
+    :param roots: directories or files
+    :param workers: number of workers that parse the files
+    :param backend: 'thread' or 'process'
+    :param index: filename of a persistent index (see SeriesIndexUtils)
+    :param compact: if True, keep the slices as SliceRecords
+    :param temporal: if True, read gated and dynamic data as 4D series
+    :return: list of DicomSeries, scan statistics
+    """
+    recorder = pydicom_series.MetricsRecorder()
+    pydicom_series.add_metrics_hook(recorder)
+    t0 = time.perf_counter()
+    try:
+        series = pydicom_series.read_files(list(roots), workers=workers,
+                                           backend=backend, headerOnly=True,
+                                           index=index, compact=compact,
+                                           temporal=temporal)
+    finally:
+        pydicom_series.remove_metrics_hook(recorder)
+    seconds = time.perf_counter() - t0
+    summary = recorder.summary()
+    n_files = summary.get('scan', {}).get('files', 0)
+    stats = {
+        'files': n_files,
+        'series': len(series),
+        'header_bytes': summary.get('scan', {}).get('bytesRead', 0),
+        'seconds': seconds,
+        'files_per_second': n_files / seconds if seconds > 0 else 0.,
+        'metrics': summary,
+    }
+    return series, stats
+
+
+def series_manifest(series: List) -> List[Dict]:
+    """
+    make the manifest of the series
+    :param series: list of DicomSeries
+    :return: list of entries with the suid, shape, sampling, number of
+             files, total size in bytes and files of each series
+    """
+    manifest = []
+    for s in series:
+        files = s.filenames
+        manifest.append({
+            'suid': s.suid,
+            'shape': list(s.shape) if s.shape is not None else None,
+            'sampling': [float(v) for v in s.sampling]
+            if s.sampling is not None else None,
+            'n_files': len(files),
+            'nbytes': sum(os.path.getsize(f) for f in files),
+            'files': files,
+        })
+    return manifest
+
+
+def save_manifest(manifest: List[Dict], filename: str):
+    """
+    save the manifest as csv if the filename ends with .csv, else as json
+    (in the csv file, the shape, sampling and files are separated by ';')
+    :param manifest: result of series_manifest
+    :param filename: filename
+    """
+    if not filename.lower().endswith('.csv'):
+        with open(filename, 'w') as f:
+            json.dump({'series': manifest}, f, indent=2)
+        return
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, MANIFEST_FIELDS)
+        writer.writeheader()
+        for entry in manifest:
+            row = dict(entry)
+            for key in ('shape', 'sampling', 'files'):
+                if row[key] is not None:
+                    row[key] = ';'.join(str(v) for v in row[key])
+            writer.writerow(row)
+
+
+def convert_series(series: List,
+                   output: str,
+                   fmt: str = 'npy',
+                   workers: int = 4) -> Dict:
+    """
+    convert the series to npy or vtk files named by their suid (with
+    a number appended if a suid has several series, e.g. gated data)
+    :param series: list of DicomSeries
+    :param output: output directory
+    :param fmt: 'npy' or 'vtk' (4D series are not converted to vtk)
+    :param workers: number of workers that decode the slices
+    :return: conversion statistics
+    """
+    if fmt == 'vtk':
+        from pydicom_ext import VtkDataUtils
+        if not VtkDataUtils.have_vtk():
+            raise ImportError('vtk is required to convert to vtk files')
+    os.makedirs(output, exist_ok=True)
+    n_series = 0
+    n_bytes = 0
+    suids = [s.suid for s in series]
+    t0 = time.perf_counter()
+    for i, s in enumerate(series):
+        if fmt == 'vtk' and s.timing is not None:
+            print(f'Warning: skipping 4D series {s.suid} (vtk)')
+            continue
+        img = s.get_pixel_array(workers=workers)
+        name = s.suid
+        if suids.count(s.suid) > 1:
+            name += f'_{suids[:i].count(s.suid):03d}'
+        filename = os.path.join(output, f'{name}.{fmt}')
+        if fmt == 'npy':
+            np.save(filename, img)
+        else:
+            if img.ndim == 2:
+                img = img[np.newaxis]
+            origin = [float(v) for v in s.info.ImagePositionPatient]
+            spacing = [float(v) for v in s.sampling[::-1]]
+            spacing += [1.] * (3 - len(spacing))
+            VtkDataUtils.save_npy_as_vtk_data(filename, origin, spacing,
+                                              img)
+        n_series += 1
+        n_bytes += img.nbytes
+    seconds = time.perf_counter() - t0
+    return {
+        'series': n_series,
+        'array_bytes': n_bytes,
+        'seconds': seconds,
+        'mb_per_second': n_bytes / seconds / 1e6 if seconds > 0 else 0.,
+    }
+
+
+def scan_shard(roots: Sequence[str],
+               shard: int = 0,
+               n_shards: int = 1,
+               workers: int = 4,
+               backend: str = 'thread',
+               tags: Optional[List[str]] = None,
+               force: bool = False) -> Dict:
+    """
+    scan a shard of the files into a per-file manifest (header-only), to
+    be merged with the other shards by merge_shards. The files are listed
+    as read_files lists them and split in n_shards contiguous parts, so
+    all machines must see the files under the same paths. Alternatively,
+    each machine scans other roots with n_shards=1.
+    :param roots: directories or files
+    :param shard: index of the shard to scan
+    :param n_shards: number of shards
+    :param workers: number of workers that parse the files
+    :param backend: 'thread' or 'process'
+    :param tags: extra tags to read (see read_files)
+    :param force: read files without a dicom preamble
+    :return: shard manifest, with the header-only dataset of each dicom
+             file (None for other files) and the errors
+    """
+    if not 0 <= shard < n_shards:
+        raise ValueError('The shard must be in [0, n_shards).')
+    files = pydicom_series.list_files(list(roots))
+    files = files[len(files) * shard // n_shards:
+                  len(files) * (shard + 1) // n_shards]
+    results = pydicom_series.read_headers(files, force, workers, backend,
+                                          tags)
+    entries = []
+    for filename, (dcm, why) in zip(files, results):
+        entries.append({
+            'filename': filename,
+            'dataset': None if dcm is None else dataset_to_json(dcm),
+            'error': why,
+        })
+    return {'version': SHARD_VERSION, 'shard': shard, 'n_shards': n_shards,
+            'tags': list(tags or []), 'files': entries}
+
+
+def save_shard(shard: Dict, filename: str):
+    """
+    save a shard manifest as json (compressed if the filename ends with .gz)
+    :param shard: result of scan_shard
+    :param filename: filename
+    """
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'wt') as f:
+        json.dump(shard, f)
+
+
+def load_shard(filename: str) -> Dict:
+    """
+    load a shard manifest
+    :param filename: filename
+    :return: shard manifest
+    """
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rt') as f:
+        shard = json.load(f)
+    if shard.get('version') != SHARD_VERSION:
+        raise ValueError(f'{filename} is not a shard manifest of version '
+                         f'{SHARD_VERSION}')
+    return shard
+
+
+def merge_shards(shards: List[Dict],
+                 compact: bool = False,
+                 temporal: bool = False,
+                 show_progress=False) -> List:
+    """
+    merge shard manifests into series: the files of all shards are grouped
+    by SeriesInstanceUID, and the series are split and finished once. The
+    series are the same as those of read_files(roots, headerOnly=True) on
+    a single machine, if the shards cover all files.
+    :param shards: results of scan_shard (or load_shard)
+    :param compact: if True, keep the slices as SliceRecords
+    :param temporal: if True, read gated and dynamic data as 4D series
+    :param show_progress: progress callback (see read_files)
+    :return: list of DicomSeries
+    """
+    if not shards:
+        return []
+    tags = shards[0]['tags']
+    if any(shard['tags'] != tags for shard in shards):
+        raise ValueError('The shards were scanned with different tags.')
+    # The files of a split are merged in the order of the listing
+    shards = sorted(shards, key=lambda shard: shard['shard'])
+    n_shards = shards[0]['n_shards']
+    if n_shards > 1 and [shard['shard'] for shard in shards] != \
+            list(range(n_shards)):
+        print(f'Warning: not all {n_shards} shards are merged')
+
+    results = ((entry['filename'],
+                None if entry['dataset'] is None else
+                dataset_from_json(entry['dataset'], entry['filename']),
+                entry['error'])
+               for shard in shards for entry in shard['files'])
+    collection = pydicom_series.SeriesCollection(
+        show_progress, headerOnly=True, tags=tags, compact=compact,
+        temporal=temporal)
+    collection.add_results(results)
+    return collection.series
+
+
+def _print_stats(scan_stats: Dict, convert_stats: Optional[Dict] = None):
+    """
+    print the throughput of the scan and the conversion
+    :param scan_stats: statistics of scan (or of merging shards)
+    :param convert_stats: statistics of convert_series
+    """
+    action = scan_stats.get('action', 'scanned')
+    print(f"{action} {scan_stats['files']} files "
+          f"({scan_stats['series']} series) in "
+          f"{scan_stats['seconds']:.2f} s: "
+          f"{scan_stats['files_per_second']:.1f} files/s, "
+          f"{scan_stats['header_bytes'] / 1e6:.1f} MB of headers")
+    if convert_stats is not None:
+        print(f"converted {convert_stats['series']} series "
+              f"({convert_stats['array_bytes'] / 1e6:.1f} MB) in "
+              f"{convert_stats['seconds']:.2f} s: "
+              f"{convert_stats['mb_per_second']:.1f} MB/s")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    entry point of the pydicom_ext_scan command
+    :param argv: command line arguments (default: sys.argv[1:])
+    :return: exit code
+    """
+    parser = argparse.ArgumentParser(
+        description='Scan directories of dicom files, write a manifest of '
+                    'the series and optionally convert them')
+    parser.add_argument('roots', nargs='+',
+                        help='directories or files to scan '
+                             '(shard manifests with --merge)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--backend', default='thread',
+                        choices=('thread', 'process'))
+    parser.add_argument('--index', default=None,
+                        help='persistent index, to skip unchanged files')
+    parser.add_argument('--compact', action='store_true',
+                        help='keep the slices as compact records')
+    parser.add_argument('--temporal', action='store_true',
+                        help='read gated and dynamic data as 4D series')
+    parser.add_argument('--manifest', default=None,
+                        help='json or csv file for the series manifest')
+    parser.add_argument('--convert', default=None, choices=('npy', 'vtk'),
+                        help='convert the series to npy or vtk files')
+    parser.add_argument('--output', default='.',
+                        help='directory for the converted files')
+    parser.add_argument('--metrics', action='store_true',
+                        help='print the metrics of each phase')
+    parser.add_argument('--shard', nargs=2, type=int, default=(0, 1),
+                        metavar=('INDEX', 'COUNT'),
+                        help='scan only a shard of the files '
+                             '(with --save-shard)')
+    parser.add_argument('--save-shard', default=None,
+                        help='write the per-file manifest of the shard '
+                             'to this file, to merge it later')
+    parser.add_argument('--merge', action='store_true',
+                        help='merge the shard manifests given as roots')
+    args = parser.parse_args(argv)
+    if args.convert == 'vtk':
+        from pydicom_ext import VtkDataUtils
+        if not VtkDataUtils.have_vtk():
+            print('Error: vtk is required to convert to vtk files')
+            return 1
+    if tuple(args.shard) != (0, 1) and args.save_shard is None:
+        parser.error('--shard requires --save-shard')
+
+    if args.save_shard is not None:
+        t0 = time.perf_counter()
+        shard = scan_shard(args.roots, args.shard[0], args.shard[1],
+                           args.workers, args.backend)
+        save_shard(shard, args.save_shard)
+        seconds = time.perf_counter() - t0
+        n_files = len(shard['files'])
+        print(f"scanned shard {args.shard[0]} of {args.shard[1]}: "
+              f"{n_files} files in {seconds:.2f} s: "
+              f"{n_files / seconds if seconds > 0 else 0.:.1f} files/s")
+        return 0
+
+    if args.merge:
+        recorder = pydicom_series.MetricsRecorder()
+        pydicom_series.add_metrics_hook(recorder)
+        t0 = time.perf_counter()
+        try:
+            shards = [load_shard(filename) for filename in args.roots]
+            series = merge_shards(shards, args.compact, args.temporal)
+        finally:
+            pydicom_series.remove_metrics_hook(recorder)
+        seconds = time.perf_counter() - t0
+        n_files = sum(len(shard['files']) for shard in shards)
+        scan_stats = {
+            'action': 'merged', 'files': n_files, 'series': len(series),
+            'header_bytes': 0,
+            'seconds': seconds,
+            'files_per_second': n_files / seconds if seconds > 0 else 0.,
+            'metrics': recorder.summary(),
+        }
+    else:
+        series, scan_stats = scan(args.roots, args.workers, args.backend,
+                                  args.index, args.compact, args.temporal)
+    if args.manifest is not None:
+        save_manifest(series_manifest(series), args.manifest)
+    convert_stats = None
+    if args.convert is not None:
+        recorder = pydicom_series.MetricsRecorder()
+        pydicom_series.add_metrics_hook(recorder)
+        try:
+            convert_stats = convert_series(series, args.output,
+                                           args.convert, args.workers)
+        finally:
+            pydicom_series.remove_metrics_hook(recorder)
+        convert_stats['metrics'] = recorder.summary()
+    _print_stats(scan_stats, convert_stats)
+    if args.metrics:
+        for name, stats in (('scan', scan_stats), ('convert', convert_stats)):
+            if stats is None:
+                continue
+            for phase, totals in sorted(stats['metrics'].items()):
+                print(f'{name} {phase}: {json.dumps(totals, sort_keys=True)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
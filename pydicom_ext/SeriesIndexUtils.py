@@ -0,0 +1,212 @@
+#-*- coding:utf-8 -*-
+"""
+    SeriesIndexUtils
+
+    Copyright (c) 2017 Tetsuya Shinaji
+
+    This software is released under the MIT License.
+
+    http://opensource.org/licenses/mit-license.php
+
+    Persistent header index for pydicom_series.read_files. The grouping
+    and geometry tags of each scanned file are stored in a SQLite file,
+    keyed by path, size and modification time, so that repeated scans of
+    the same directories only parse new or changed files.
+
+"""
+
+import os
+import json
+import base64
+import sqlite3
+from typing import Dict, List, Optional
+from pydicom.dataset import Dataset
+from pydicom.multival import MultiValue
+from pydicom.sequence import Sequence
+
+# version of the json format of the datasets, stored entries of another
+# version are removed
+JSON_VERSION = 2
+
+
+class SeriesIndex:
+
+    def __init__(self, filename: str):
+        """
+        open (or create) an index file
+        :param filename: filename of the SQLite index
+        """
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, tags TEXT)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta ("
+            "key TEXT PRIMARY KEY, value TEXT)")
+        self.connection.commit()
+
+    def close(self):
+        """
+        close the index file
+        """
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def set_tags(self, tags: List[str]):
+        """
+        set the tags that are stored for each file. If these differ from
+        the tags of the stored entries, or the entries are of another
+        JSON_VERSION, all entries are removed.
+        :param tags: list of tag keywords
+        """
+        value = json.dumps({'version': JSON_VERSION, 'tags': list(tags)})
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'tags'").fetchone()
+        if row is not None and row[0] == value:
+            return
+        self.connection.execute("DELETE FROM files")
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta VALUES ('tags', ?)", (value,))
+        self.connection.commit()
+
+    def lookup(self, files: List[str]) -> Dict[str, Optional[Dataset]]:
+        """
+        get the stored entries of the files that have not changed since
+        they were stored
+        :param files: list of filenames
+        :return: dict of filename to header-only dataset, or to None for
+                 a file that is known not to be a dicom file
+        """
+        entries = {}
+        for path, size, mtime, tags in self.connection.execute(
+                "SELECT path, size, mtime, tags FROM files"):
+            entries[path] = (size, mtime, tags)
+
+        found = {}
+        for filename in files:
+            entry = entries.get(os.path.abspath(filename))
+            if entry is None:
+                continue
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            size, mtime, tags = entry
+            if st.st_size != size or st.st_mtime_ns != mtime:
+                continue
+            found[filename] = (None if tags is None else
+                               dataset_from_json(json.loads(tags), filename))
+        return found
+
+    def store(self, filename: str, dcm: Optional[Dataset]):
+        """
+        store the header-only dataset of a file. Call commit() to write
+        the stored entries to disk.
+        :param filename: filename
+        :param dcm: header-only dataset, or None for a non-dicom file
+        """
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return
+        tags = None
+        if dcm is not None:
+            tags = json.dumps(dataset_to_json(dcm))
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+            (os.path.abspath(filename), st.st_size, st.st_mtime_ns, tags))
+
+    def commit(self):
+        """
+        write the stored entries to disk
+        """
+        self.connection.commit()
+
+
+def _json_value(value):
+    """
+    convert a data element value to a json compatible value, binary values
+    (OB, OW, UN) to a dict with their base64 encoding
+    """
+    if isinstance(value, (list, tuple, MultiValue)):
+        return [_json_value(v) for v in value]
+    elif isinstance(value, (int, float)):
+        return value
+    elif isinstance(value, bytes):
+        return {'base64': base64.b64encode(value).decode('ascii')}
+    return str(value)
+
+
+def _value_from_json(value):
+    """
+    convert a value made by _json_value back to a data element value
+    """
+    if isinstance(value, list):
+        return [_value_from_json(v) for v in value]
+    elif isinstance(value, dict):
+        return base64.b64decode(value['base64'])
+    return value
+
+
+def dataset_to_json(dcm: Dataset) -> dict:
+    """
+    convert the (header-only) dataset to a dict with the elements as a
+    list of [tag, VR, value], the transfer syntax and the location of the
+    pixel data in the file
+    """
+    file_meta = getattr(dcm, 'file_meta', None)
+    return {
+        "elements": _elements_to_json(dcm),
+        "TransferSyntaxUID": None if file_meta is None else
+        file_meta.get('TransferSyntaxUID'),
+        "pixelDataLocation": getattr(dcm, '_pixelDataLocation', None),
+    }
+
+
+def _elements_to_json(dcm: Dataset) -> list:
+    """
+    convert the elements of the dataset to a list of [tag, VR, value],
+    with the value of a sequence as a list of such lists for its items
+    """
+    return [[int(elem.tag), elem.VR,
+             [_elements_to_json(item) for item in elem.value]
+             if elem.VR == 'SQ' else _json_value(elem.value)]
+            for elem in dcm]
+
+
+def _elements_from_json(dcm: Dataset, elements: list):
+    """
+    add the elements made by _elements_to_json to the dataset
+    """
+    for tag, VR, value in elements:
+        if VR == 'SQ':
+            items = []
+            for item_elements in value:
+                item = Dataset()
+                _elements_from_json(item, item_elements)
+                items.append(item)
+            value = Sequence(items)
+        else:
+            value = _value_from_json(value)
+        dcm.add_new(tag, VR, value)
+
+
+def dataset_from_json(data: dict, filename: str) -> Dataset:
+    """
+    convert a dict made by dataset_to_json to a header-only dataset
+    """
+    dcm = Dataset()
+    _elements_from_json(dcm, data["elements"])
+    if data["TransferSyntaxUID"] is not None:
+        dcm.file_meta = Dataset()
+        dcm.file_meta.TransferSyntaxUID = data["TransferSyntaxUID"]
+    if data["pixelDataLocation"] is not None:
+        dcm._pixelDataLocation = tuple(data["pixelDataLocation"])
+    dcm.filename = filename
+    return dcm
@@ -13,7 +13,6 @@
 """
 
 import numpy as np
-from matplotlib import pyplot as plt
 from pydicom_ext import __version__ as pydicom_ext_version
 from pydicom_ext import pydicom_series
 from pydicom.dataset import Dataset, FileDataset
@@ -21,6 +20,7 @@ from pydicom.sequence import Sequence
 from pydicom.multival import MultiValue
 from pydicom.tag import BaseTag
 from pydicom.compat import in_py2
+from pydicom.uid import RLELossless
 if not in_py2:
     from pydicom.valuerep import PersonName3 as PersonName
 else:
@@ -79,11 +79,29 @@ def convert_dataset_to_json(dcm: Dataset):
     return data
 
 
+def _set_pixel_data(dcm: Dataset, uint16_img: np.ndarray,
+                    rle_lossless: bool):
+    """
+    set the pixel data of a dataset
+    :param dcm: dataset
+    :param uint16_img: image data
+    :param rle_lossless: if True, the data is compressed with RLE Lossless
+    """
+    if not rle_lossless:
+        dcm.PixelData = uint16_img.tobytes()
+        return
+    dcm.PixelData = pydicom_series.encapsulate_frames(
+        pydicom_series.encode_rle(uint16_img))
+    dcm[pydicom_series.pixelDataTag].VR = 'OB'
+    dcm[pydicom_series.pixelDataTag].is_undefined_length = True
+
+
 def convert_npy_to_dicom(npy_array, fname=None,
                          slice_thickness=None,
                          pixel_spacing=None,
                          spacing_between_slices=None,
-                         single_file_mode=True
+                         single_file_mode=True,
+                         rle_lossless=False
                          ):
     """
     convert npy array to dicom
@@ -93,6 +111,8 @@ def convert_npy_to_dicom(npy_array, fname=None,
     :param spacing_between_slices: spacing between slices
     :param pixel_spacing: pixel spacing
     :param single_file_mode: if False, slice by slice dicom files are generated
+    :param rle_lossless: if True, the pixel data is compressed with
+                         RLE Lossless
     :return:  dcm
     """
     uint16_img = np.array(npy_array).astype(float)
@@ -122,6 +142,10 @@ def convert_npy_to_dicom(npy_array, fname=None,
     file_meta.ImplementationClassUID = '0.0.0.0'
     file_meta.FileMetaInformationGroupLength = 140
     dcm = FileDataset(fname, {}, file_meta=file_meta, preamble=b'\0' * 128)
+    if rle_lossless:
+        file_meta.TransferSyntaxUID = RLELossless
+        dcm.is_little_endian = True
+        dcm.is_implicit_VR = False
 
     dcm.Modality = 'OT'
     if single_file_mode:
@@ -185,7 +209,7 @@ def convert_npy_to_dicom(npy_array, fname=None,
         dcm.PixelSpacing = [ps, ps]
 
     if single_file_mode:
-        dcm.PixelData = uint16_img.tostring()
+        _set_pixel_data(dcm, uint16_img, rle_lossless)
         dcm.StudyInstanceUID = f'333.333.0.0.0.{now}'
         dcm.SeriesInstanceUID = f'333.333.0.0.0.{now}.3333'
         dcm.FrameOfReferenceUID = dcm.StudyInstanceUID
@@ -206,7 +230,7 @@ def convert_npy_to_dicom(npy_array, fname=None,
         dcms = []
         for slice_idx in range(uint16_img.shape[0]):
             dcm.SOPInstanceUID = f'333.333.0.0.0.{now}.{slice_idx:06d}'
-            dcm.PixelData = uint16_img[slice_idx].tostring()
+            _set_pixel_data(dcm, uint16_img[slice_idx], rle_lossless)
             dcm.StudyInstanceUID = f'333.333.0.0.0.{now}'
             dcm.SeriesInstanceUID = f'333.333.0.0.0.{now}.3333'
             dcm.FrameOfReferenceUID = dcm.StudyInstanceUID
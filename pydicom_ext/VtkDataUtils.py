@@ -10,37 +10,83 @@
     
 """
 
+import sys
+import importlib.util
 import numpy as np
-from matplotlib import pyplot as plt
-import vtk
 from typing import List, Tuple
-from vtk.util import numpy_support
 
-npy_dtype_to_vtk_dtype = {
+# vtk is slow to import, it is imported by _import_vtk on first use
+vtk = None
+numpy_support = None
 
-    np.dtype(np.uint8): vtk.VTK_UNSIGNED_CHAR,
-    np.dtype(np.uint16): vtk.VTK_UNSIGNED_SHORT,
-    np.dtype(np.uint32): vtk.VTK_UNSIGNED_INT,
-    np.dtype(np.uint64): vtk.VTK_UNSIGNED_LONG_LONG,
-    np.dtype(np.uint): vtk.VTK_UNSIGNED_LONG_LONG,
-    np.dtype(np.int8): vtk.VTK_CHAR,
-    np.dtype(np.int16): vtk.VTK_SHORT,
-    np.dtype(np.int32): vtk.VTK_INT,
-    np.dtype(np.int64): vtk.VTK_LONG_LONG,
-    np.dtype(np.int): vtk.VTK_LONG_LONG,
-    np.dtype(np.float32): vtk.VTK_FLOAT,
-    np.dtype(np.float64): vtk.VTK_DOUBLE,
-    np.dtype(np.float): vtk.VTK_DOUBLE,
 
-}
+def _import_vtk():
+    """
+    import vtk and vtk.util.numpy_support, if not done yet
+    """
+    global vtk, numpy_support
+    if numpy_support is None:
+        import vtk as vtk_module
+        from vtk.util import numpy_support as numpy_support_module
+        vtk = vtk_module
+        numpy_support = numpy_support_module
+
+
+def have_vtk() -> bool:
+    """
+    check whether vtk is installed, without importing it
+    :return: True if vtk can be imported
+    """
+    return importlib.util.find_spec('vtk') is not None
 
 
-def load_vtk_file(filename: str) -> Tuple[np.ndarray, vtk.vtkStructuredPoints]:
+def _get_npy_dtype_to_vtk_dtype() -> dict:
+    """
+    get npy_dtype_to_vtk_dtype, the vtk array type of each numpy dtype
+    """
+    global npy_dtype_to_vtk_dtype
+    if 'npy_dtype_to_vtk_dtype' in globals():
+        return npy_dtype_to_vtk_dtype
+    _import_vtk()
+    npy_dtype_to_vtk_dtype = {
+
+        np.dtype(np.uint8): vtk.VTK_UNSIGNED_CHAR,
+        np.dtype(np.uint16): vtk.VTK_UNSIGNED_SHORT,
+        np.dtype(np.uint32): vtk.VTK_UNSIGNED_INT,
+        np.dtype(np.uint64): vtk.VTK_UNSIGNED_LONG_LONG,
+        np.dtype(np.uint): vtk.VTK_UNSIGNED_LONG_LONG,
+        np.dtype(np.int8): vtk.VTK_CHAR,
+        np.dtype(np.int16): vtk.VTK_SHORT,
+        np.dtype(np.int32): vtk.VTK_INT,
+        np.dtype(np.int64): vtk.VTK_LONG_LONG,
+        np.dtype(int): vtk.VTK_LONG_LONG,
+        np.dtype(np.float32): vtk.VTK_FLOAT,
+        np.dtype(np.float64): vtk.VTK_DOUBLE,
+        np.dtype(float): vtk.VTK_DOUBLE,
+
+    }
+    return npy_dtype_to_vtk_dtype
+
+
+if sys.version_info < (3, 7):
+    # Without vtk, the module can be imported, but the table is missing
+    if have_vtk():
+        _get_npy_dtype_to_vtk_dtype()
+else:
+    def __getattr__(name):
+        if name == 'npy_dtype_to_vtk_dtype':
+            return _get_npy_dtype_to_vtk_dtype()
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def load_vtk_file(filename: str) -> Tuple[np.ndarray,
+                                          'vtk.vtkStructuredPoints']:
     """
 
     :param filename: filename
     :return: img(npy format), img(vtk format)
     """
+    _import_vtk()
     reader = vtk.vtkStructuredPointsReader()
     reader.SetFileName(filename)
     reader.Update()
@@ -51,8 +97,8 @@ def load_vtk_file(filename: str) -> Tuple[np.ndarray, vtk.vtkStructuredPoints]:
 
 def load_vtp_as_vtk_image(
         poly_data_fname: str,
-        ref_vtk_img: vtk.vtkImageData,
-        roi_value: int=255) -> Tuple[np.ndarray, vtk.vtkStructuredPoints]:
+        ref_vtk_img: 'vtk.vtkImageData',
+        roi_value: int=255) -> Tuple[np.ndarray, 'vtk.vtkStructuredPoints']:
     """
     load  vtk poly data file as vtk image data
     :param poly_data_fname: filename
@@ -60,6 +106,7 @@ def load_vtp_as_vtk_image(
     :param roi_value: roi value
     :return: img(npy format), img(vtk format)
     """
+    _import_vtk()
 
     reader = vtk.vtkXMLPolyDataReader()
     reader.SetFileName(poly_data_fname)
@@ -114,6 +161,7 @@ def save_npy_as_vtk_data(filename:str,
     :param vti_mode: if True, save with vti format
     :return:
     """
+    _import_vtk()
     vtk_img = vtk.vtkImageData()
     vtk_img.SetSpacing(spacing)
     vtk_img.SetOrigin(origin)
@@ -121,7 +169,7 @@ def save_npy_as_vtk_data(filename:str,
     vtk_img.GetPointData().SetScalars(numpy_support.numpy_to_vtk(
         npy_img.flatten(),
         deep=True,
-        array_type=npy_dtype_to_vtk_dtype[npy_img.dtype]
+        array_type=_get_npy_dtype_to_vtk_dtype()[npy_img.dtype]
     ))
     vtk_img.SetExtent([
         0, npy_img.shape[2]-1,
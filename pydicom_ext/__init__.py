@@ -6,4 +6,16 @@
     http://opensource.org/licenses/mit-license.php
 """
 __version__ = "0.6.1"
-from . import pydicom_series
+
+# The submodules are imported on first use, so that importing the package
+# (e.g. for __version__) does not import pydicom, numpy or vtk
+import sys
+
+if sys.version_info < (3, 7):
+    from . import pydicom_series
+else:
+    def __getattr__(name):
+        if name == 'pydicom_series':
+            import importlib
+            return importlib.import_module(f'{__name__}.{name}')
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
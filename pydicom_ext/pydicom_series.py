@@ -36,14 +36,26 @@ from __future__ import print_function
 # - Full loading of data, warm: 3 sec
 # - Deferred loading of data, cold: 9 sec
 # - Deferred loading of data, warm: 3 sec
+# (Reproducible timings on synthetic data can be obtained with
+# python -m pydicom_ext.BenchmarkUtils, see BenchmarkUtils.)
 
+import io
 import os
+import sys
 import time
 import gc
+import struct
+import threading
+from collections import OrderedDict, deque
+# (asyncio and the process pool are slow to import, and are imported when
+# they are used)
+from concurrent.futures import ThreadPoolExecutor, CancelledError, as_completed
 
 import pydicom
-from pydicom.sequence import Sequence
 from pydicom import compat
+from pydicom.multival import MultiValue
+from pydicom.uid import (ExplicitVRLittleEndian, ImplicitVRLittleEndian,
+                         RLELossless)
 
 # Try importing numpy
 try:
@@ -131,100 +143,1529 @@ def _progressCallback(progress):
         _progressBar.Update(progress)
 
 
-def _listFiles(files, path):
-    """List all files in the directory, recursively. """
+# Metrics hooks, see add_metrics_hook
+_metricsHooks = []
+_peakArrayBytes = [0]
 
-    for item in os.listdir(path):
-        item = os.path.join(path, item)
-        if os.path.isdir(item):
-            _listFiles(files, item)
+
+def add_metrics_hook(hook):
+    """ add_metrics_hook(hook)
+
+    Add a callable that receives an event (a dict) for each phase of the
+    work of this module, for monitoring. Each event has the keys "phase"
+    and "duration" (in seconds), plus keys that depend on the phase:
+
+      * scan: reading the files in read_files, iter_series, SeriesCollection
+        or async_read_files. Keys: files, filesPerSecond, bytesRead (the
+        bytes before the pixel data, where known).
+      * split: grouping the datasets in series. Keys: groups, series.
+      * finish: evaluating the series. Keys: series.
+      * cache: a lookup in the volume cache. Keys: hit, hits, misses, nbytes.
+      * decode: reading and decoding the slices in get_pixel_array or
+        iter_slabs. Keys: slices, bytesRead (of the stored pixel data,
+        where known), decodeTime (a dict with the time per transfer syntax), arrayBytes,
+        peakArrayBytes (the largest arrayBytes so far in this process).
+      * rescale: rescaling a volume. Keys: dtype, arrayBytes.
+
+    Nothing is measured while no hooks are added. The hooks are called
+    in the thread that does the work.
+    """
+    _metricsHooks.append(hook)
+
+
+def remove_metrics_hook(hook):
+    """ remove_metrics_hook(hook)
+
+    Remove a hook that was added with add_metrics_hook.
+    """
+    _metricsHooks.remove(hook)
+
+
+def _emitEvent(phase, duration, **fields):
+    """ _emitEvent(phase, duration, **fields)
+    Send an event to the metrics hooks.
+    """
+    event = dict(phase=phase, duration=duration, **fields)
+    for hook in list(_metricsHooks):
+        hook(event)
+
+
+class MetricsRecorder(object):
+    """ MetricsRecorder()
+    A metrics hook (see add_metrics_hook) that keeps the events, and can
+    summarize them per phase.
+    """
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    # Fields that are a running value, rather than an amount per event
+    _gauges = ('filesPerSecond', 'peakArrayBytes', 'hits', 'misses',
+               'nbytes')
+
+    def summary(self):
+        """ summary()
+        Get a dict with for each phase the number of events, the total
+        duration and the totals of the numeric fields of its events (for
+        the running values like peakArrayBytes, the maximum).
+        """
+        summary = {}
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            totals = summary.setdefault(event['phase'], {'count': 0})
+            totals['count'] += 1
+            for key, value in event.items():
+                if not isinstance(value, (int, float)):
+                    continue
+                elif key in self._gauges:
+                    totals[key] = max(totals.get(key, 0), value)
+                else:
+                    totals[key] = totals.get(key, 0) + value
+        return summary
+
+
+class _DecodeStats(object):
+    """ _DecodeStats()
+    Gathers the decode metrics of the slices of a volume, which may be
+    decoded in several threads.
+    """
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.slices = 0
+        self.bytesRead = 0
+        self.decodeTime = {}
+        self._lock = threading.Lock()
+
+    def add(self, ds, duration):
+        """ add(ds, duration)
+        Add a decoded slice.
+        """
+        nbytes = _getStoredSize(ds)
+        transferSyntax = str(_getTransferSyntax(ds))
+        with self._lock:
+            self.slices += 1
+            if nbytes is not None:
+                self.bytesRead += nbytes
+            self.decodeTime[transferSyntax] = \
+                self.decodeTime.get(transferSyntax, 0.0) + duration
+
+    def emit(self, vol):
+        """ emit(vol)
+        Send the decode event for the volume.
+        """
+        _peakArrayBytes[0] = max(_peakArrayBytes[0], vol.nbytes)
+        _emitEvent('decode', time.perf_counter() - self.t0,
+                   slices=self.slices, bytesRead=self.bytesRead,
+                   decodeTime=self.decodeTime, arrayBytes=vol.nbytes,
+                   peakArrayBytes=_peakArrayBytes[0])
+
+
+def _getHeaderSize(ds):
+    """ _getHeaderSize(ds)
+    Get the number of bytes before the pixel data in the file of the
+    dataset (for metrics), or 0 if it is not known.
+    """
+    if ds is None:
+        return 0
+    try:
+        location = _getPixelDataLocation(ds)
+    except (KeyError, AttributeError):
+        return 0
+    return 0 if location is None else location[0]
+
+
+def _emitScanEvent(t0, files, bytesRead):
+    """ _emitScanEvent(t0, files, bytesRead)
+    Send the scan event for files read since t0.
+    """
+    duration = time.perf_counter() - t0
+    _emitEvent('scan', duration, files=files, bytesRead=bytesRead,
+               filesPerSecond=files / duration if duration > 0 else 0.0)
+
+
+def _getStoredSize(ds):
+    """ _getStoredSize(ds)
+    Get the size of the stored pixel data of the dataset (for metrics),
+    or None if it is not known, e.g. for header-only datasets with
+    encapsulated pixel data of undefined length.
+    """
+    location = _getPixelDataLocation(ds)
+    if location is not None and location[1] != _undefinedLength:
+        return location[1]
+    if not _isHeaderOnly(ds):
+        # Pixel data that was read holds the stored bytes
+        value = getattr(_getRawPixelDataElement(ds), 'value', None)
+        if isinstance(value, bytes):
+            return len(value)
+    return None
+
+
+def _listFiles(files, path, listed=None):
+    """List all files in the directory, recursively. If the dict "listed"
+    is given, it maps the directories that were listed to their mtime and
+    subdirectories. Directories that did not change since they were
+    listed are not listed again, only their subdirectories are visited.
+    """
+
+    if listed is not None:
+        mtime = os.stat(path).st_mtime_ns
+        if path in listed and listed[path][0] == mtime:
+            for subdir in listed[path][1]:
+                _listFiles(files, subdir, listed)
+            return
+
+    subdirs = []
+    for entry in _scanDir(path):
+        if entry.is_dir():
+            subdirs.append(entry.path)
+            _listFiles(files, entry.path, listed)
+        else:
+            files.append(entry.path)
+
+    # A directory that changed just now may change again within the
+    # resolution of its mtime, so it is listed again next time
+    if listed is not None and time.time() - mtime * 1e-9 > 2.0:
+        listed[path] = mtime, subdirs
+
+
+def _scanDir(path):
+    """ _scanDir(path)
+    Get the entries of the directory. If the read-ahead scheduler
+    reorders reads (see set_read_ahead), they are sorted by inode, which
+    usually follows the placement of the files on disk better than the
+    order of the listing.
+    """
+    with os.scandir(path) as entries:
+        entries = list(entries)
+    scheduler = _readAhead
+    if scheduler is not None and scheduler.reorder:
+        entries.sort(key=_getInode)
+    return entries
+
+
+def _getInode(entry):
+    """ _getInode(entry)
+    Get the inode number of the directory entry, or 0 if it is unknown.
+    """
+    try:
+        return entry.inode()
+    except OSError:
+        return 0
+
+
+def _readFile(filename, deferSize, force, tags=None, ahead=None):
+    """ _readFile(filename, deferSize, force, tags=None, ahead=None)
+    Read the dicom file for read_files. Returns a tuple (dcm, message).
+    If the file is skipped, dcm is None and message is None for a
+    non-dicom file or a string describing the error otherwise. This
+    function never raises, so it can be run in a worker thread or process.
+    If tags is given, only these tags are read and reading stops before
+    the pixel data (header-only mode). If ahead is given, that file is
+    prefetched first by the read-ahead scheduler.
+    """
+    if ahead is not None and _readAhead is not None:
+        _readAhead.advise_file(ahead, tags is not None)
+    try:
+        if tags is None:
+            dcm = pydicom.read_file(filename, deferSize, force=force)
         else:
-            files.append(item)
+            dcm = _readHeaderOnly(filename, force, tags)
+    except pydicom.filereader.InvalidDicomError:
+        return None, None  # skip non-dicom file
+    except Exception as why:
+        return None, str(why)
+    return dcm, None
+
+
+def _createExecutor(workers, backend):
+    """ _createExecutor(workers, backend)
+    Create an executor with the given number of workers. The backend
+    is either 'thread' or 'process'.
+    """
+    if backend == 'thread':
+        return ThreadPoolExecutor(workers)
+    elif backend == 'process':
+        from concurrent.futures import ProcessPoolExecutor
+        return ProcessPoolExecutor(workers)
+    else:
+        raise ValueError("The backend must be 'thread' or 'process'.")
+
+
+def _iterReadFiles(files, deferSize, force, workers, backend, tags=None):
+    """ _iterReadFiles(files, deferSize, force, workers, backend, tags=None)
+    Read the given files and yield a (dcm, message) tuple for each
+    file, in the order of the files list. If workers is larger than one,
+    the files are parsed concurrently using the given backend, with at
+    most two pending tasks per worker. While a file is read, the
+    read-ahead scheduler prefetches the files that follow it.
+    """
+    ahead = [None] * len(files)
+    scheduler = _readAhead
+    if scheduler is not None and scheduler.depth:
+        headerOnly = tags is not None
+        for filename in files[:scheduler.depth]:
+            scheduler.advise_file(filename, headerOnly)
+        ahead = files[scheduler.depth:] + [None] * scheduler.depth
+
+    if not workers or workers < 2 or len(files) < 2:
+        for filename, aheadFile in zip(files, ahead):
+            yield _readFile(filename, deferSize, force, tags, aheadFile)
+        return
+
+    # The results are obtained in the order of the files, so that the
+    # series are built deterministically. Only a window of tasks is
+    # submitted, so that the datasets do not pile up in the executor
+    # when they are consumed more slowly than they are read.
+    chunksize = 1
+    if backend == 'process':
+        chunksize = max(1, min(64, len(files) // (4 * workers)))
+    pending = deque()
+    with _createExecutor(workers, backend) as executor:
+        try:
+            for i in range(0, len(files), chunksize):
+                pending.append(executor.submit(
+                    _readFiles, files[i:i + chunksize], deferSize, force,
+                    tags, ahead[i:i + chunksize]))
+                if len(pending) < 2 * workers:
+                    continue
+                for result in pending.popleft().result():
+                    yield result
+            while pending:
+                for result in pending.popleft().result():
+                    yield result
+        finally:
+            # Do not wait for the tasks that are not needed anymore
+            for future in pending:
+                future.cancel()
+
+
+def _readFiles(files, deferSize, force, tags, ahead):
+    """ _readFiles(files, deferSize, force, tags, ahead)
+    Read a chunk of files for _iterReadFiles. Returns the list of
+    (dcm, message) tuples of the files.
+    """
+    return [_readFile(filename, deferSize, force, tags, aheadFile)
+            for filename, aheadFile in zip(files, ahead)]
+
+
+def _iterIndexedReadFiles(files, index, force, workers, backend, tags):
+    """ _iterIndexedReadFiles(files, index, force, workers, backend, tags)
+    Like _iterReadFiles in header-only mode, but the datasets of files
+    that have not changed since they were stored in the index are obtained
+    from the index. The other files are read and stored in the index.
+    """
+    index.set_tags(tags)
+    found = index.lookup(files)
 
+    # Read the new and changed files
+    missing = [filename for filename in files if filename not in found]
+    results = _iterReadFiles(missing, None, force, workers, backend, tags)
 
-def _splitSerieIfRequired(serie, series):
-    """ _splitSerieIfRequired(serie, series)
-    Split the serie in multiple series if this is required.
+    try:
+        for filename in files:
+            if filename in found:
+                yield found[filename], None
+            else:
+                dcm, why = next(results)
+                if why is None:
+                    index.store(filename, dcm)
+                yield dcm, why
+    finally:
+        index.commit()
+
+
+def _getPositions(datasets):
+    """ _getPositions(datasets)
+    Get the ImagePositionPatient of the datasets as an (n, 3) float
+    array, or None if a dataset does not have it.
+    """
+    try:
+        return np.array([[float(v) for v in ds.ImagePositionPatient]
+                         for ds in datasets], np.float64).reshape(-1, 3)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _getSliceNormal(ds):
+    """ _getSliceNormal(ds)
+    Get the unit normal of the image plane of the dataset, from its
+    ImageOrientationPatient. If that is not available or invalid, the
+    z axis is used.
+    """
+    try:
+        orientation = np.array([float(v) for v in ds.ImageOrientationPatient])
+        normal = np.cross(orientation[:3], orientation[3:6])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        normal = np.zeros(3)
+    length = np.sqrt(np.sum(normal ** 2))
+    if not length:
+        return np.array([0.0, 0.0, 1.0])
+    return normal / length
+
+
+def _getSplitIndices(distances):
+    """ _getSplitIndices(distances)
+    Get the indices at which a new series starts, given the distances
+    between successive slices (distances[i] is the distance between
+    slice i and i + 1), and the indices after which a file is missing.
+
+    A new series starts where the distance is more than 2.1 times the
+    previous distance of the same series; the first distance of a new
+    series is always accepted. A file is deemed missing where the distance
+    is more than 1.5 times the previous distance.
+    """
+
+    # Candidates: a distance that is too large relative to the previous
+    previous = np.concatenate([[0.0], distances[:-1]])
+    candidates = (previous > 0) & (distances > 2.1 * previous)
+
+    # A candidate directly after a split compares to no previous distance,
+    # so of a run of successive candidates only every other one splits
+    split = np.zeros(len(distances), bool)
+    for i in np.flatnonzero(candidates):
+        split[i] = not (i > 0 and split[i - 1])
+
+    # Missing files, not directly after a split
+    afterSplit = np.concatenate([[False], split[:-1]])
+    missing = ((previous > 0) & (distances > 1.5 * previous) &
+               ~split & ~afterSplit)
+
+    return np.flatnonzero(split) + 1, np.flatnonzero(missing)
+
+
+def _splitSerieIfRequired(serie):
+    """ _splitSerieIfRequired(serie)
+    Split the serie in multiple series if this is required, and return
+    the list of resulting series (a single series if it is not split).
+    The resulting series have their own list of datasets, so that they
+    do not change when datasets are appended to the serie later.
     The choice is based on examing the image position relative to
     the previous image. If it differs too much, it is assumed
     that there is a new dataset. This can happen for example in
     unspitted gated CT data.
+
+    The positions are projected onto the slice normal, and the gaps are
+    found in the distances between these (in the order of the instance
+    numbers) at once. The slices of each resulting series are then
+    sorted by their position along the normal, in the direction of the
+    instance numbers.
     """
 
     # Sort the original list and get local name
     serie._sort()
     L = serie._datasets
 
-    # Init previous slice
-    ds1 = L[0]
-
     # Check whether we can do this
-    if "ImagePositionPatient" not in ds1:
-        return
+    positions = _getPositions(L)
+    if positions is None:
+        newSerie = DicomSeries(serie.suid, serie._showProgress)
+        newSerie._datasets = list(L)
+        return [newSerie]
+
+    # Get the distances between successive slices along the normal
+    projections = positions.dot(_getSliceNormal(L[0]))
+    starts = _getSplitIndices(np.abs(np.diff(projections)))[0]
+
+    # Create the series, with the slices sorted along the normal
+    bounds = [0] + list(starts) + [len(L)]
+    series = []
+    for i0, i1 in zip(bounds[:-1], bounds[1:]):
+        order = _getSliceOrder(projections[i0:i1]) + i0
+        newSerie = DicomSeries(serie.suid, serie._showProgress)
+        newSerie._datasets = [L[i] for i in order]
+        series.append(newSerie)
+
+        # Test missing files, now that the slices are sorted
+        gaps, missing = _getSplitIndices(
+            np.abs(np.diff(projections[order])))
+        for i in sorted(set(gaps - 1) | set(missing)):
+            print('Warning: missing file after "%s"' % L[order[i]].filename)
+    return series
+
+
+def _getTemporalSerie(serie):
+    """ _getTemporalSerie(serie)
+    Get a 4D series of the datasets of the serie, grouped in time frames
+    by the first of the temporalTags that all datasets have. The slices
+    of each time frame are sorted along the slice normal, and all time
+    frames must have the same number of slices. Returns None if the
+    datasets cannot be grouped in this way, or form a single time frame.
+    """
 
-    # Initialize a list of new lists
-    L2 = [[ds1]]
+    # Sort the original list and get local name
+    serie._sort()
+    L = serie._datasets
+    positions = _getPositions(L)
+    if positions is None:
+        return None
+
+    # Get the time frame of each slice
+    for tag in temporalTags:
+        if all(tag in ds for ds in L):
+            keys = np.array([float(ds.get(tag)) for ds in L])
+            break
+    else:
+        return None
+    values, frames = np.unique(keys, return_inverse=True)
+    counts = np.bincount(frames)
+    if len(values) < 2 or np.any(counts != counts[0]):
+        return None
+
+    # Sort the slices by time frame, then along the normal
+    projections = positions.dot(_getSliceNormal(L[0]))
+    order = np.argsort(frames, kind='mergesort')
+    nz = counts[0]
+    for i in range(0, len(order), nz):
+        frame = order[i:i + nz]
+        order[i:i + nz] = frame[_getSliceOrder(projections[frame])]
+
+    # Make the timing table from the first slice of each time frame
+    timing = np.zeros(len(values), [(name, np.float64) for name in
+                                    ['Time'] + temporalTags +
+                                    ['ActualFrameDuration']])
+    timing['Time'] = values
+    for i in range(len(values)):
+        ds = L[order[i * nz]]
+        for name in timing.dtype.names[1:]:
+            value = ds.get(name)
+            timing[name][i] = np.nan if value in (None, '') else float(value)
+
+    newSerie = DicomSeries(serie.suid, serie._showProgress)
+    newSerie._datasets = [L[i] for i in order]
+    newSerie._timing = timing
+    return newSerie
+
+
+def _getSliceOrder(projections):
+    """ _getSliceOrder(projections)
+    Get the order of the slices (given in the order of their instance
+    numbers) along the normal, ascending if the last slice is not before
+    the first, descending otherwise. Slices at the same position keep the
+    order of their instance numbers.
+    """
+    if len(projections) and projections[-1] < projections[0]:
+        return np.argsort(-projections, kind='mergesort')
+    return np.argsort(projections, kind='mergesort')
 
-    # Init slice distance estimate
-    distance = 0
 
-    for index in range(1, len(L)):
+pixelDataTag = pydicom.tag.Tag(0x7fe0, 0x0010)
 
-        # Get current slice
-        ds2 = L[index]
+# The tags that are read in header-only mode. These are all that is
+# needed to group, sort and split the series, to set shape and sampling,
+# and to read and rescale native pixel data straight from the file. For
+# enhanced multi-frame files, the geometry of the frames is in the
+# functional groups, and the photometric tags are needed to decode a frame.
+discoveryTags = ['SeriesInstanceUID', 'InstanceNumber',
+                 'ImagePositionPatient', 'ImageOrientationPatient',
+                 'Rows', 'Columns', 'PixelSpacing',
+                 'BitsAllocated', 'PixelRepresentation', 'SamplesPerPixel',
+                 'BitsStored', 'NumberOfFrames',
+                 'RescaleSlope', 'RescaleIntercept',
+                 'PhotometricInterpretation', 'PlanarConfiguration',
+                 'PerFrameFunctionalGroupsSequence',
+                 'SharedFunctionalGroupsSequence',
+                 'TemporalPositionIndex', 'TriggerTime',
+                 'FrameReferenceTime', 'ActualFrameDuration']
+
+# The tags that identify the time frame of a slice in 4D mode, in order
+# of preference
+temporalTags = ['TemporalPositionIndex', 'TriggerTime', 'FrameReferenceTime']
+
+# The functional groups and tags that describe the geometry and rescaling
+# of a frame of an enhanced multi-frame file
+frameGroupTags = [('PlanePositionSequence', 'ImagePositionPatient'),
+                  ('PlaneOrientationSequence', 'ImageOrientationPatient'),
+                  ('PixelMeasuresSequence', 'PixelSpacing'),
+                  ('PixelValueTransformationSequence', 'RescaleSlope'),
+                  ('PixelValueTransformationSequence', 'RescaleIntercept'),
+                  ('FrameContentSequence', 'TemporalPositionIndex')]
+
+# The tags needed to decode a frame on its own
+frameHeaderTags = ['Rows', 'Columns', 'BitsAllocated', 'BitsStored',
+                   'HighBit', 'PixelRepresentation', 'SamplesPerPixel',
+                   'PhotometricInterpretation', 'PlanarConfiguration']
+
+# The tags that are the same for the slices of a series, which are taken
+# from a single file for a DICOMDIR series whose records lack them
+seriesTags = ['Rows', 'Columns', 'PixelSpacing', 'ImageOrientationPatient',
+              'BitsAllocated', 'BitsStored', 'PixelRepresentation',
+              'SamplesPerPixel', 'PhotometricInterpretation',
+              'PlanarConfiguration']
+
+# The transfer syntaxes of which the pixel data can be read as is
+nativeTransferSyntaxes = [ImplicitVRLittleEndian, ExplicitVRLittleEndian]
+
+
+def _readPixelDataLocation(fp, ds):
+    """ _readPixelDataLocation(fp, ds)
+    Read the header of the pixel data element at the current position of
+    the file, and return the (offset, length) of its value in the file.
+    Returns None if there is no pixel data element at this position.
+    """
+    header = fp.read(8)
+    if len(header) < 8:
+        return None
+    endian = '<' if ds.is_little_endian else '>'
+    if struct.unpack(endian + 'HH', header[:4]) != (0x7fe0, 0x0010):
+        return None
+    if ds.is_implicit_VR:
+        length = struct.unpack(endian + 'L', header[4:])[0]
+    elif header[4:6] in (b'OB', b'OW', b'OF', b'OD', b'OL', b'UN'):
+        length = struct.unpack(endian + 'L', fp.read(4))[0]
+    else:
+        length = struct.unpack(endian + 'H', header[6:])[0]
+    return fp.tell(), length
 
-        # Get positions
-        pos1 = float(ds1.ImagePositionPatient[2])
-        pos2 = float(ds2.ImagePositionPatient[2])
 
-        # Get distances
-        newDist = abs(pos1 - pos2)
-        # deltaDist = abs(firstPos-pos2)
+def _readHeaderOnly(filename, force, tags=None):
+    """ _readHeaderOnly(filename, force, tags=None)
+    Read the dataset up to the pixel data, optionally only the given tags.
+    The location of the pixel data in the file is stored on the dataset,
+    so that it can later be read without parsing the header again.
+    """
+    with open(filename, 'rb') as fp:
+        ds = pydicom.read_file(fp, stop_before_pixels=True, force=force,
+                               specific_tags=tags)
+        ds._pixelDataLocation = _readPixelDataLocation(fp, ds)
+    return ds
+
+
+class SliceRecord(object):
+    """ SliceRecord(ds)
+    A compact record of a slice, made from a header-only dataset. It holds
+    the filename, the transfer syntax, the location of the pixel data in
+    the file and the tags needed to sort, split and load the series, and
+    takes a fraction of the memory of a dataset. It can be used as a
+    header-only dataset for these tags; the full header is read from the
+    file when it is needed.
+    """
 
-        # If the distance deviates more than 2x from what we've seen,
-        # we can agree it's a new dataset.
-        if distance and newDist > 2.1 * distance:
-            L2.append([])
-            distance = 0
+    __slots__ = ('filename', 'TransferSyntaxUID', '_pixelDataLocation',
+                 'InstanceNumber', 'ImagePositionPatient',
+                 'ImageOrientationPatient', 'Rows', 'Columns', 'PixelSpacing',
+                 'BitsAllocated', 'BitsStored', 'PixelRepresentation',
+                 'SamplesPerPixel', 'PhotometricInterpretation',
+                 'PlanarConfiguration', 'NumberOfFrames', 'RescaleSlope',
+                 'RescaleIntercept', 'TemporalPositionIndex', 'TriggerTime',
+                 'FrameReferenceTime', 'ActualFrameDuration')
+
+    # The tags held by a record, and the type of their (multi) value
+    _tags = {'InstanceNumber': int, 'ImagePositionPatient': float,
+             'ImageOrientationPatient': float, 'Rows': int, 'Columns': int,
+             'PixelSpacing': float, 'BitsAllocated': int, 'BitsStored': int,
+             'PixelRepresentation': int, 'SamplesPerPixel': int,
+             'PhotometricInterpretation': str, 'PlanarConfiguration': int,
+             'NumberOfFrames': int, 'RescaleSlope': float,
+             'RescaleIntercept': float, 'TemporalPositionIndex': int,
+             'TriggerTime': float, 'FrameReferenceTime': float,
+             'ActualFrameDuration': float}
+
+    def __init__(self, ds):
+        self.filename = ds.filename
+        self.TransferSyntaxUID = _getTransferSyntax(ds)
+        self._pixelDataLocation = _getPixelDataLocation(ds)
+        for name in self._tags:
+            self._setTag(name, ds.get(name))
+
+    def _setTag(self, name, value):
+        """ _setTag(name, value)
+        Set the value of the tag, converted to its type. Empty values
+        are skipped.
+        """
+        if value is None or value == '':
+            return
+        type_ = self._tags[name]
+        if isinstance(value, (list, tuple, MultiValue)):
+            value = tuple(type_(v) for v in value)
         else:
-            # Test missing file
-            if distance and newDist > 1.5 * distance:
-                print('Warning: missing file after "%s"' % ds1.filename)
-            distance = newDist
+            value = type_(value)
+        setattr(self, name, value)
 
-        # Add to last list
-        L2[-1].append(ds2)
+    def __contains__(self, name):
+        return name in self._tags and hasattr(self, name)
 
-        # Store previous
-        ds1 = ds2
+    def get(self, name, default=None):
+        """ get(name, default=None)
+        Get the value of the tag, or default if the record does not hold it.
+        """
+        if name in self:
+            return getattr(self, name)
+        return default
 
-    # Split if we should
-    if len(L2) > 1:
+    def __repr__(self):
+        return "<SliceRecord of %s>" % self.filename
+
+
+class FrameRecord(SliceRecord):
+    """ FrameRecord(ds, frameIndex, location, header)
+    A SliceRecord for a frame of an enhanced multi-frame dataset. The
+    geometry and rescale parameters are taken from the Per-Frame and
+    Shared Functional Groups. The location is that of the pixel data of
+    the frame in the file (for encapsulated data, the items holding its
+    fragments), or None if the frame cannot be read on its own. The
+    header is a dataset with the frameHeaderTags of the file, which is
+    shared by the records of its frames.
+    """
 
-        # At what position are we now?
-        i = series.index(serie)
+    __slots__ = ('frameIndex', '_header')
+
+    def __init__(self, ds, frameIndex, location, header):
+        SliceRecord.__init__(self, ds)
+        if hasattr(self, 'NumberOfFrames'):
+            del self.NumberOfFrames
+        self.frameIndex = frameIndex
+        self._pixelDataLocation = location
+        self._header = header
+        groups = _getFrameGroups(ds, frameIndex)
+        for sequenceName, name in frameGroupTags:
+            for group in groups:
+                if sequenceName in group and len(group.get(sequenceName)):
+                    item = group.get(sequenceName)[0]
+                    if name in item:
+                        self._setTag(name, item.get(name))
+                        break
 
-        # Create new series
-        series2insert = []
-        for L in L2:
-            newSerie = DicomSeries(serie.suid, serie._showProgress)
-            newSerie._datasets = Sequence(L)
-            series2insert.append(newSerie)
+    def __repr__(self):
+        return "<FrameRecord of frame %i of %s>" % (self.frameIndex,
+                                                    self.filename)
 
-        # Insert series and remove self
-        for newSerie in reversed(series2insert):
-            series.insert(i, newSerie)
-        series.remove(serie)
 
+# The tags of the items and the sequence delimiter of encapsulated data
+_itemTag = (0xfffe, 0xe000)
+_sequenceDelimiterTag = (0xfffe, 0xe0dd)
+_undefinedLength = 0xffffffff
 
-pixelDataTag = pydicom.tag.Tag(0x7fe0, 0x0010)
 
+def _getFrameGroups(ds, frameIndex):
+    """ _getFrameGroups(ds, frameIndex)
+    Get the functional groups that apply to the frame: its item of the
+    Per-Frame Functional Groups Sequence, then the Shared Functional
+    Groups.
+    """
+    groups = []
+    perFrame = ds.get('PerFrameFunctionalGroupsSequence')
+    if perFrame is not None and frameIndex < len(perFrame):
+        groups.append(perFrame[frameIndex])
+    shared = ds.get('SharedFunctionalGroupsSequence')
+    if shared:
+        groups.append(shared[0])
+    return groups
+
+
+def _readItemHeader(fp):
+    """ _readItemHeader(fp)
+    Read the header of an item of encapsulated data, and return its
+    (tag, length), or None at the end of the file.
+    """
+    header = fp.read(8)
+    if len(header) < 8:
+        return None
+    group, element, length = struct.unpack('<HHL', header)
+    return (group, element), length
+
+
+def _readFrameLocations(filename, location, nframes):
+    """ _readFrameLocations(filename, location, nframes)
+    Read the locations (offset, length) of the frames in encapsulated
+    pixel data at the given location in the file. The location of a frame
+    covers the items of its fragments. The Basic Offset Table is used if
+    it is present, otherwise there should be one fragment per frame.
+    Returns None if the frames cannot be located.
+    """
+    with open(filename, 'rb') as fp:
+        fp.seek(location[0])
+
+        # Read the Basic Offset Table
+        header = _readItemHeader(fp)
+        if header is None or header[0] != _itemTag:
+            return None
+        table = np.frombuffer(fp.read(header[1]), '<u4')
+        first = fp.tell()
+
+        # Find the items, only up to the last frame if we have the table
+        items = []
+        if len(table) == nframes:
+            fp.seek(first + int(table[-1]))
+        while True:
+            offset = fp.tell()
+            header = _readItemHeader(fp)
+            if header is None or header[0] != _itemTag:
+                break
+            items.append((offset, 8 + header[1]))
+            fp.seek(header[1], 1)
+
+    # Get the frames
+    if len(table) == nframes:
+        if not items:
+            return None
+        end = items[-1][0] + items[-1][1]
+        starts = [first + int(offset) for offset in table] + [end]
+        return [(starts[i], starts[i + 1] - starts[i])
+                for i in range(nframes)]
+    elif len(table) == 0 and len(items) == nframes:
+        return items
+    return None
+
+
+def _getFrameRecords(ds):
+    """ _getFrameRecords(ds)
+    Get a FrameRecord for each frame of an enhanced multi-frame dataset.
+    Returns None if the dataset is not an enhanced multi-frame dataset,
+    or if the frames have no position.
+    """
+    nframes = int(ds.get('NumberOfFrames') or 1)
+    if nframes < 2:
+        return None
+
+    # The functional groups may not have been read in header-only mode
+    if 'PerFrameFunctionalGroupsSequence' not in ds and _isHeaderOnly(ds):
+        groups = pydicom.read_file(
+            ds.filename, stop_before_pixels=True, force=True,
+            specific_tags=['PerFrameFunctionalGroupsSequence',
+                           'SharedFunctionalGroupsSequence'])
+        if 'PerFrameFunctionalGroupsSequence' not in groups:
+            return None
+        ds.PerFrameFunctionalGroupsSequence = \
+            groups.PerFrameFunctionalGroupsSequence
+        if 'SharedFunctionalGroupsSequence' in groups:
+            ds.SharedFunctionalGroupsSequence = \
+                groups.SharedFunctionalGroupsSequence
+    if 'PerFrameFunctionalGroupsSequence' not in ds:
+        return None
+
+    # Get the location of the pixel data (of the whole element)
+    location = _getPixelDataLocation(ds)
+    if location is None:
+        location = _readHeaderOnly(ds.filename, True)._pixelDataLocation
+
+    # Get the locations of the frames
+    locations = [None] * nframes
+    transferSyntax = _getTransferSyntax(ds)
+    if location is None:
+        pass
+    elif transferSyntax in nativeTransferSyntaxes:
+        bits = int(ds.get('BitsAllocated') or 0)
+        if bits and bits % 8 == 0:
+            frameBytes = (int(ds.Rows) * int(ds.Columns) * (bits // 8) *
+                          int(ds.get('SamplesPerPixel') or 1))
+            locations = [(location[0] + i * frameBytes, frameBytes)
+                         for i in range(nframes)]
+    elif location[1] == _undefinedLength:
+        locations = (_readFrameLocations(ds.filename, location, nframes) or
+                     locations)
+
+    # Get the header to decode the frames with
+    header = pydicom.dataset.Dataset()
+    for name in frameHeaderTags:
+        if name in ds:
+            setattr(header, name, ds.get(name))
+    header.file_meta = pydicom.dataset.Dataset()
+    header.file_meta.TransferSyntaxUID = transferSyntax
+
+    records = [FrameRecord(ds, i, locations[i], header)
+               for i in range(nframes)]
+    if not all('ImagePositionPatient' in record for record in records):
+        return None
+    return records
+
+
+class FileHandlePool(object):
+    """ FileHandlePool(maxHandles=16)
+
+    A bounded pool of open (read-only) file handles, which is used to
+    read pixel data at the offsets that were found when the files were
+    scanned. The data is read with positional reads (os.pread where
+    available), so reading a slice takes a single read, without opening
+    the file, seeking or parsing its header again. When more than
+    maxHandles files are open, the least recently used handles are
+    closed; handles that are in use by another thread are closed when
+    they are released. The handles can be shared by threads.
+    """
+
+    def __init__(self, maxHandles=16):
+        self.maxHandles = max(1, int(maxHandles))
+        self.opens = 0
+        self.reads = 0
+        # filename -> [handle, users, lock, discarded]
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._handles)
+
+    def read(self, filename, offset, size):
+        """ read(filename, offset, size)
+        Read size bytes at the offset in the file. Returns fewer bytes
+        at the end of the file.
+        """
+        buffer = bytearray(size)
+        nbytes = self.readinto(filename, buffer, offset)
+        return bytes(buffer[:nbytes]) if nbytes < size else bytes(buffer)
+
+    def readinto(self, filename, buffer, offset):
+        """ readinto(filename, buffer, offset)
+        Read bytes at the offset in the file into the buffer (e.g. a
+        contiguous numpy array). Returns the number of bytes read.
+        """
+        entry = self._acquire(filename)
+        try:
+            self.reads += 1
+            view = memoryview(buffer).cast('B')
+            if entry[2] is None:
+                return _preadInto(entry[0], view, offset)
+            with entry[2]:
+                entry[0].seek(offset)
+                return entry[0].readinto(view)
+        finally:
+            self._release(entry)
+
+    def advise(self, filename, offset=0, size=0):
+        """ advise(filename, offset=0, size=0)
+        Ask the kernel to prefetch size bytes (0 for the rest of the file)
+        at the offset in the file, using posix_fadvise. The file is kept
+        open, so that the read that follows does not need to open it.
+        """
+        entry = self._acquire(filename)
+        try:
+            fd = entry[0] if entry[2] is None else entry[0].fileno()
+            os.posix_fadvise(fd, offset, size, os.POSIX_FADV_WILLNEED)
+        finally:
+            self._release(entry)
+
+    def discard(self, filename):
+        """ discard(filename)
+        Close the handle of the file (e.g. because it was replaced).
+        """
+        with self._lock:
+            entry = self._handles.pop(filename, None)
+            if entry is not None:
+                self._discard(entry)
+
+    def clear(self):
+        """ clear()
+        Close all handles.
+        """
+        with self._lock:
+            for entry in self._handles.values():
+                self._discard(entry)
+            self._handles.clear()
+
+    def _acquire(self, filename):
+        """ _acquire(filename)
+        Get the entry of the file, opening it if needed, and mark it
+        as in use.
+        """
+        with self._lock:
+            entry = self._handles.get(filename)
+            if entry is not None:
+                self._handles.move_to_end(filename)
+                entry[1] += 1
+                return entry
+
+        # Open outside the lock, this may be slow
+        if hasattr(os, 'pread'):
+            flags = os.O_RDONLY | getattr(os, 'O_BINARY', 0)
+            entry = [os.open(filename, flags), 1, None, False]
+        else:
+            entry = [open(filename, 'rb'), 1, threading.Lock(), False]
+
+        with self._lock:
+            self.opens += 1
+            existing = self._handles.get(filename)
+            if existing is not None:
+                # Opened by another thread in the meantime
+                _closeHandle(entry[0])
+                existing[1] += 1
+                return existing
+            self._handles[filename] = entry
+            self._evict()
+        return entry
+
+    def _release(self, entry):
+        """ _release(entry)
+        Mark the entry as no longer in use by the caller.
+        """
+        with self._lock:
+            entry[1] -= 1
+            if entry[3] and entry[1] == 0:
+                _closeHandle(entry[0])
+            self._evict()
+
+    def _discard(self, entry):
+        """ _discard(entry)
+        Close the handle of a removed entry, or when it is released.
+        """
+        entry[3] = True
+        if entry[1] == 0:
+            _closeHandle(entry[0])
+
+    def _evict(self):
+        """ _evict()
+        Close the least recently used handles that are not in use, until
+        at most maxHandles files are open.
+        """
+        excess = len(self._handles) - self.maxHandles
+        for filename in list(self._handles):
+            if excess <= 0:
+                break
+            if self._handles[filename][1] == 0:
+                self._discard(self._handles.pop(filename))
+                excess -= 1
+
+
+def _closeHandle(handle):
+    """ _closeHandle(handle)
+    Close a handle of the FileHandlePool (a file descriptor or object).
+    """
+    if isinstance(handle, int):
+        os.close(handle)
+    else:
+        handle.close()
 
-def _getPixelDataFromDataset(ds):
-    """ Get the pixel data from the given dataset. If the data
-    was deferred, make it deferred again, so that memory is
-    preserved. Also applies RescaleSlope and RescaleIntercept
-    if available. """
+
+def _preadInto(fd, view, offset):
+    """ _preadInto(fd, view, offset)
+    Read into the memoryview at the offset in the file, with positional
+    reads, until it is full or the end of the file. Returns the number
+    of bytes read.
+    """
+    nbytes = 0
+    while nbytes < len(view):
+        if hasattr(os, 'preadv'):
+            n = os.preadv(fd, [view[nbytes:]], offset + nbytes)
+        else:
+            data = os.pread(fd, len(view) - nbytes, offset + nbytes)
+            n = len(data)
+            view[nbytes:nbytes + n] = data
+        if n == 0:
+            break
+        nbytes += n
+    return nbytes
+
+
+_fileHandles = FileHandlePool()
+
+
+def set_file_handle_pool(maxHandles):
+    """ set_file_handle_pool(maxHandles)
+
+    Set the number of files that are kept open to read pixel data from
+    (see FileHandlePool), 16 by default. If maxHandles is None or 0,
+    the files are opened for each read. Returns the pool (or None).
+    """
+    global _fileHandles
+    if _fileHandles is not None:
+        _fileHandles.clear()
+    _fileHandles = None
+    if maxHandles:
+        _fileHandles = FileHandlePool(maxHandles)
+    return _fileHandles
+
+
+class ReadAheadScheduler(object):
+    """ ReadAheadScheduler(depth=8, reorder=True)
+
+    Schedules the reads of files and slices, for storage on which reads
+    are slow and seeks are expensive (network file systems, spinning
+    disks). If reorder is True, the files of a directory are scanned in
+    inode order, and get_pixel_array() reads the slices by directory,
+    inode and offset instead of in slice order (the result is the same).
+    While a file or slice is read and decoded, the kernel is asked to
+    prefetch the next depth files or slices (posix_fadvise WILLNEED),
+    so that the device is kept busy. A depth of 0 disables prefetching,
+    which is not available on all platforms (e.g. on Windows). When the
+    file handle pool is enabled, a depth larger than its maxHandles
+    makes files be opened twice.
+    """
+
+    # The number of bytes to prefetch of a file that is read header-only
+    headerBytes = 1 << 16
+
+    def __init__(self, depth=8, reorder=True):
+        self.depth = max(0, int(depth))
+        self.reorder = bool(reorder)
+        self.advised = 0
+
+    def advise(self, filename, offset=0, size=0):
+        """ advise(filename, offset=0, size=0)
+        Ask the kernel to prefetch size bytes (0 for the rest of the file)
+        at the offset in the file. Returns whether the advice was given.
+        """
+        if not self.depth or not hasattr(os, 'posix_fadvise'):
+            return False
+        try:
+            pool = _fileHandles
+            if pool is not None:
+                pool.advise(filename, offset, size)
+            else:
+                fd = os.open(filename, os.O_RDONLY)
+                try:
+                    os.posix_fadvise(fd, offset, size,
+                                     os.POSIX_FADV_WILLNEED)
+                finally:
+                    os.close(fd)
+        except (OSError, TypeError):
+            return False
+        self.advised += 1
+        return True
+
+    def advise_file(self, filename, headerOnly=False):
+        """ advise_file(filename, headerOnly=False)
+        Prefetch a file that is about to be scanned; only its first
+        headerBytes if it is read header-only.
+        """
+        return self.advise(filename, 0, self.headerBytes if headerOnly else 0)
+
+    def advise_slice(self, ds):
+        """ advise_slice(ds)
+        Prefetch the pixel data of the dataset (or record), if it must be
+        read from its file at a known offset.
+        """
+        location = _getReadLocation(ds)
+        if location is None:
+            return False
+        size = location[1]
+        if size == _undefinedLength:
+            size = _getSizeHint(ds)
+        return self.advise(ds.filename, location[0], size)
+
+    def schedule(self, datasets, indices):
+        """ schedule(datasets, indices)
+        Get the order in which to read the slices at the given indices of
+        the datasets, and prefetch the first depth of them. Call ahead()
+        before reading each slice of the order.
+        """
+        indices = list(indices)
+        if self.reorder:
+            inodes = {}
+            indices.sort(key=lambda z: _getLocality(datasets[z], inodes))
+        for z in indices[:self.depth]:
+            self.advise_slice(datasets[z])
+        return indices
+
+    def ahead(self, datasets, order, k):
+        """ ahead(datasets, order, k)
+        Prefetch the slice that is depth slices after the k-th slice of
+        the order (see schedule), when about to read the k-th slice.
+        """
+        if self.depth and k + self.depth < len(order):
+            self.advise_slice(datasets[order[k + self.depth]])
+
+
+def _getReadLocation(ds):
+    """ _getReadLocation(ds)
+    Get the (offset, length) of the pixel data of the dataset in its file,
+    if the data must be read from the file (i.e. it is not in memory).
+    """
+    if not _isHeaderOnly(ds):
+        if getattr(_getRawPixelDataElement(ds), 'value', None) is not None:
+            return None
+    return _getPixelDataLocation(ds)
+
+
+def _getLocality(ds, inodes):
+    """ _getLocality(ds, inodes)
+    Get a key to sort slices by their location on disk: the directory,
+    inode and offset of their pixel data. The inodes of the files are
+    cached in the given dict.
+    """
+    filename = getattr(ds, 'filename', None)
+    if not isinstance(filename, compat.string_types):
+        return '', 0, 0
+    inode = inodes.get(filename)
+    if inode is None:
+        try:
+            inode = inodes[filename] = os.stat(filename).st_ino
+        except OSError:
+            inode = inodes[filename] = 0
+    location = _getPixelDataLocation(ds)
+    offset = location[0] if location is not None else 0
+    return os.path.dirname(filename), inode, offset
+
+
+_readAhead = ReadAheadScheduler()
+
+
+def set_read_ahead(depth, reorder=True):
+    """ set_read_ahead(depth, reorder=True)
+
+    Set the number of files or slices that are prefetched while reading
+    (see ReadAheadScheduler), 8 by default, and whether reads are
+    reordered by their location on disk. If depth is None, reads are
+    neither prefetched nor reordered. Returns the scheduler (or None).
+    """
+    global _readAhead
+    _readAhead = None
+    if depth is not None:
+        _readAhead = ReadAheadScheduler(depth, reorder)
+    return _readAhead
+
+
+def _readAt(filename, offset, size):
+    """ _readAt(filename, offset, size)
+    Read size bytes at the offset in the file, using the file handle
+    pool if it is enabled.
+    """
+    pool = _fileHandles
+    if pool is not None:
+        return pool.read(filename, offset, size)
+    with open(filename, 'rb') as fp:
+        fp.seek(offset)
+        return fp.read(size)
+
+
+def _readIntoAt(filename, buffer, offset):
+    """ _readIntoAt(filename, buffer, offset)
+    Read into the buffer at the offset in the file, using the file
+    handle pool if it is enabled. Returns the number of bytes read.
+    """
+    pool = _fileHandles
+    if pool is not None:
+        return pool.readinto(filename, buffer, offset)
+    with open(filename, 'rb') as fp:
+        fp.seek(offset)
+        return fp.readinto(buffer)
+
+
+def _readEncapsulatedValue(filename, offset, sizeHint=0):
+    """ _readEncapsulatedValue(filename, offset, sizeHint=0)
+    Read the value of an encapsulated pixel data element (of undefined
+    length) at the offset in the file: its items, without the sequence
+    delimiter. A block of sizeHint bytes is read at once, which usually
+    holds the whole value (and a read past the end of the file returns
+    less); beyond it, the item headers are followed to find the end.
+    """
+    data = _readAt(filename, offset, sizeHint) if sizeHint else b''
+    end = 0
+    while True:
+        if end + 8 <= len(data):
+            header = data[end:end + 8]
+        elif len(data) < sizeHint:
+            break  # the end of the file
+        else:
+            header = _readAt(filename, offset + end, 8)
+            if len(header) < 8:
+                break
+        group, element, length = struct.unpack('<HHL', header)
+        if (group, element) != _itemTag:
+            break
+        end += 8 + length
+    if end <= len(data):
+        return data[:end]
+    return _readAt(filename, offset, end)
+
+
+def _getPixelDataValue(ds):
+    """ _getPixelDataValue(ds)
+    Read the value of the pixel data of a header-only or deferred
+    dataset (or record) from its file, at the location that was found
+    when it was scanned. Returns None if the location is not known.
+    """
+    location = _getPixelDataLocation(ds)
+    if location is None:
+        return None
+    if location[1] == _undefinedLength:
+        return _readEncapsulatedValue(ds.filename, location[0],
+                                      _getSizeHint(ds))
+    return _readAt(ds.filename, location[0], location[1])
+
+
+def _getSizeHint(ds):
+    """ _getSizeHint(ds)
+    Get a size in bytes that usually holds the encapsulated pixel data of
+    the dataset (or record): the size of the decoded data, with room for
+    the item headers and for data that does not compress (as RLE adds a
+    byte per 128 bytes).
+    """
+    try:
+        nbytes = (int(ds.get('Rows')) * int(ds.get('Columns')) *
+                  int(ds.get('SamplesPerPixel') or 1) *
+                  ((int(ds.get('BitsAllocated')) + 7) // 8))
+    except (TypeError, ValueError):
+        return 0
+    nframes = int(ds.get('NumberOfFrames') or 1)
+    return nframes * (nbytes + nbytes // 64 + 128) + 1024
+
+
+def _decodeFrame(record):
+    """ _decodeFrame(record)
+    Decode the pixel data of the frame of the FrameRecord using pydicom.
+    Only the data of the frame is read from the file. If the frame cannot
+    be read on its own, all frames are decoded.
+    """
+
+    # Decode all frames and take the one we need
+    location = record._pixelDataLocation
+    if location is None:
+        ds = pydicom.read_file(record.filename, force=True)
+        return np.array(ds.pixel_array[record.frameIndex])
+
+    # Read the data of the frame
+    data = _readAt(record.filename, location[0], location[1])
+    transferSyntax = record._header.file_meta.TransferSyntaxUID
+    if transferSyntax not in nativeTransferSyntaxes:
+        # Encapsulate the fragments, with an empty Basic Offset Table
+        data = struct.pack('<HHL', _itemTag[0], _itemTag[1], 0) + data
+    return _decodeValue(record._header, transferSyntax, data, 1)
+
+
+def _decodeValue(header, transferSyntax, data, nframes):
+    """ _decodeValue(header, transferSyntax, data, nframes)
+    Decode the value of a pixel data element using pydicom, in a new
+    dataset with the given header (a dataset with the frameHeaderTags).
+    """
+    ds = pydicom.dataset.Dataset()
+    ds.update(header)
+    ds.file_meta = pydicom.dataset.Dataset()
+    ds.file_meta.TransferSyntaxUID = transferSyntax
+    ds.is_little_endian = True
+    ds.is_implicit_VR = transferSyntax == ImplicitVRLittleEndian
+    ds.NumberOfFrames = nframes
+    ds.add_new(pixelDataTag, 'OB', data)
+    return np.array(ds.pixel_array)
+
+
+def _getDecodeHeader(ds):
+    """ _getDecodeHeader(ds)
+    Get a dataset with the frameHeaderTags of the dataset (or record),
+    or None if it lacks one that is needed to decode the pixel data.
+    """
+    header = pydicom.dataset.Dataset()
+    for name in frameHeaderTags:
+        value = ds.get(name)
+        if value is not None:
+            setattr(header, name, value)
+    required = ['Rows', 'Columns', 'BitsAllocated', 'PixelRepresentation',
+                'PhotometricInterpretation']
+    if not all(name in header for name in required):
+        return None
+    return header
+
+
+def _getFrameIndex(ds):
+    """ _getFrameIndex(ds)
+    Get the index of the frame of a FrameRecord, 0 for other datasets.
+    """
+    if isinstance(ds, FrameRecord):
+        return ds.frameIndex
+    return 0
+
+
+def _getTransferSyntax(ds):
+    """ _getTransferSyntax(ds)
+    Get the TransferSyntaxUID of a dataset or SliceRecord, or None if
+    it is not known.
+    """
+    if isinstance(ds, SliceRecord):
+        return ds.TransferSyntaxUID
+    file_meta = getattr(ds, 'file_meta', None)
+    if file_meta is None:
+        return None
+    return file_meta.get('TransferSyntaxUID')
+
+
+def _getRawPixelDataElement(ds):
+    """ _getRawPixelDataElement(ds)
+    Get the pixel data element without reading deferred data.
+    """
+    if isinstance(ds, dict):
+        return dict.__getitem__(ds, pixelDataTag)
+    return ds._dict[pixelDataTag]  # pydicom >= 1.2
+
+
+def _getPixelDataLocation(ds):
+    """ _getPixelDataLocation(ds)
+    Get the (offset, length) of the pixel data in the file of the dataset,
+    if it is known. This is the case for header-only datasets and for
+    deferred pixel data.
+    """
+    location = getattr(ds, '_pixelDataLocation', None)
+    if location is None and not _isHeaderOnly(ds):
+        el = _getRawPixelDataElement(ds)
+        if getattr(el, 'value_tell', None) is not None:
+            location = el.value_tell, el.length
+    return location
+
+
+def _getNativeFormat(ds):
+    """ _getNativeFormat(ds)
+    Get the (dtype, shape) of the pixel data if it can be read as is,
+    i.e. for a single frame, single sample image with 8, 16 or 32 bits
+    per pixel in a native (uncompressed little endian) transfer syntax.
+    Returns None otherwise.
+    """
+    try:
+        if _getTransferSyntax(ds) not in nativeTransferSyntaxes:
+            return None
+        bits = ds.BitsAllocated
+        signed = ds.PixelRepresentation
+        shape = ds.Rows, ds.Columns
+    except AttributeError:
+        return None
+    if ds.get('SamplesPerPixel', 1) != 1:
+        return None
+    if int(ds.get('NumberOfFrames') or 1) > 1:
+        return None
+    if bits not in (8, 16, 32):
+        return None
+    dtype = np.dtype('<%s%i' % ('i' if signed else 'u', bits // 8))
+    return dtype, shape
+
+
+def _cropSlice(data, rows, cols):
+    """ _cropSlice(data, rows, cols)
+    Crop the 2D data to the given slices of rows and columns (None means
+    all rows or columns).
+    """
+    if rows is not None:
+        data = data[rows]
+    if cols is not None:
+        data = data[:, cols]
+    return data
+
+
+def _readNativePixelData(ds, out=None, rows=None, cols=None):
+    """ _readNativePixelData(ds, out=None, rows=None, cols=None)
+    Read the pixel data of a dataset with a native transfer syntax, without
+    going through the pixel handlers of pydicom. Data that is not in memory
+    is read from the file with a single readinto(). If rows and/or cols
+    (slice objects) are given, only that part of the image is returned,
+    and only the rows that are needed are read. If out is given and has
+    the right dtype and shape, the data is read into it. Returns None if
+    the data cannot be read in this way.
+    """
+
+    # Can we do this?
+    nativeFormat = _getNativeFormat(ds)
+    if nativeFormat is None:
+        return None
+    dtype, shape = nativeFormat
+    rowBytes = dtype.itemsize * shape[1]
+    nbytes = rowBytes * shape[0]
+
+    # Get the block of rows to read
+    rowRange = range(shape[0])
+    if rows is not None:
+        rowRange = rowRange[rows]
+        if len(rowRange) == 0:
+            return None
+        first = min(rowRange[0], rowRange[-1])
+        last = max(rowRange[0], rowRange[-1])
+        # The rows to take from the block (the first row of the range is
+        # the first row of the block if the step is positive, else the last)
+        rows = slice(None, None, rowRange.step)
+    else:
+        first, last = 0, shape[0] - 1
+    blockShape = last - first + 1, shape[1]
+    blockBytes = rowBytes * blockShape[0]
+
+    # Read straight into out, if we can
+    block = out
+    cropped = rows is not None or cols is not None
+    if (cropped or out is None or out.dtype != dtype or
+            out.shape != blockShape or not out.flags.c_contiguous):
+        block = np.empty(blockShape, dtype)
+
+    # Use the data that is in memory
+    value = None
+    if not _isHeaderOnly(ds):
+        value = _getRawPixelDataElement(ds).value
+    if value is not None:
+        if len(value) not in (nbytes, nbytes + 1):  # may be padded
+            return None
+        block[...] = np.frombuffer(value, dtype, blockBytes // dtype.itemsize,
+                                   first * rowBytes).reshape(blockShape)
+
+    # Read from the file
+    else:
+        location = _getPixelDataLocation(ds)
+        if location is None or location[1] not in (nbytes, nbytes + 1):
+            return None
+        offset = location[0] + first * rowBytes
+        if _readIntoAt(ds.filename, block, offset) != blockBytes:
+            return None
+
+    # Crop
+    if not cropped:
+        return block
+    data = _cropSlice(block, rows, cols)
+    if out is not None and out.shape == data.shape:
+        out[...] = data
+        return out
+    return data
+
+
+def _isHeaderOnly(ds):
+    """ _isHeaderOnly(ds)
+    Whether the dataset was read in header-only mode, i.e. without
+    (deferred) pixel data and possibly with only a subset of the tags.
+    """
+    return pixelDataTag not in ds
+
+
+def _readHeader(ds):
+    """ _readHeader(ds)
+    Read the full header (all tags but the pixel data) of the file
+    that the given header-only dataset was read from.
+    """
+    # The file was read before, so we know it is a dicom file
+    return pydicom.read_file(ds.filename, stop_before_pixels=True, force=True)
+
+
+def _decodeAtLocation(ds):
+    """ _decodeAtLocation(ds)
+    Decode the pixel data of a header-only or deferred dataset (or
+    record) using pydicom, reading just the value of the element from
+    the file. Returns None if this cannot be done, e.g. because the
+    location or a tag needed to decode the data is not known.
+    """
+    if not _isHeaderOnly(ds) and \
+            _getRawPixelDataElement(ds).value is not None:
+        return None  # the data is in memory
+    transferSyntax = _getTransferSyntax(ds)
+    if transferSyntax is None:
+        return None
+    transferSyntax = pydicom.uid.UID(transferSyntax)
+    if not transferSyntax.is_little_endian or transferSyntax.is_deflated:
+        return None
+    header = _getDecodeHeader(ds)
+    if header is None:
+        return None
+    value = _getPixelDataValue(ds)
+    if value is None:
+        return None
+    try:
+        return _decodeValue(header, transferSyntax, value,
+                            int(ds.get('NumberOfFrames') or 1))
+    except Exception:
+        return None  # let pydicom decode the whole file
+
+
+def _decodePixelData(ds):
+    """ _decodePixelData(ds)
+    Decode the pixel data of the dataset using pydicom. If the data
+    was deferred, make it deferred again, so that memory is preserved.
+    """
+
+    # Decode just the frame of a multi-frame file
+    if isinstance(ds, FrameRecord):
+        return _decodeFrame(ds)
+
+    # Read the data at its known location, without parsing the file again
+    data = _decodeAtLocation(ds)
+    if data is not None:
+        return data
+
+    # A header-only dataset has no pixel data, read the file now
+    if _isHeaderOnly(ds):
+        ds = pydicom.read_file(ds.filename, force=True)
 
     # Get original element
     el = dict.__getitem__(ds, pixelDataTag)
@@ -236,79 +1677,806 @@ def _getPixelDataFromDataset(ds):
     dict.__setitem__(ds, pixelDataTag, el)
     del ds._pixel_array
 
-    # Obtain slope and offset
-    slope = 1
-    offset = 0
-    needFloats = False
-    needApplySlopeOffset = False
-    if 'RescaleSlope' in ds:
-        needApplySlopeOffset = True
-        slope = ds.RescaleSlope
-    if 'RescaleIntercept' in ds:
-        needApplySlopeOffset = True
-        offset = ds.RescaleIntercept
-    if int(slope) != slope or int(offset) != offset:
-        needFloats = True
-    if not needFloats:
-        slope, offset = int(slope), int(offset)
-
-    # Apply slope and offset
-    if needApplySlopeOffset:
-
-        # Maybe we need to change the datatype?
-        if data.dtype in [np.float32, np.float64]:
-            pass
-        elif needFloats:
-            data = data.astype(np.float32)
+    return data
+
+
+# Decoders of encapsulated pixel data, by transfer syntax, see
+# register_decoder
+_decoders = {}
+
+# The number of decoded bytes that decode_rle processes at once, which
+# bounds the memory of the index arrays
+_rleBatchBytes = 1 << 22
+
+
+def register_decoder(transferSyntax, decoder):
+    """ register_decoder(transferSyntax, decoder)
+
+    Register a decoder for the pixel data of the given (encapsulated)
+    transfer syntax, which get_pixel_array and iter_slabs then use
+    instead of the pixel handlers of pydicom. The decoder is called as
+    decoder(frames, ds), with frames a list with the encoded data of
+    the frames (their fragments joined), and ds a dataset with the
+    Rows, Columns, BitsAllocated, SamplesPerPixel and
+    PixelRepresentation of the image. It returns an array of shape
+    (frames, rows, columns) or (frames, rows, columns, samples), or None
+    to leave the decoding to pydicom. A decoder of None removes the
+    decoder of the transfer syntax. Returns the previous decoder (or None).
+
+    A decoder for RLE Lossless (see decode_rle) is registered by default.
+    """
+    previous = _decoders.pop(transferSyntax, None)
+    if decoder is not None:
+        _decoders[transferSyntax] = decoder
+    return previous
+
+
+def get_decoder(transferSyntax):
+    """ get_decoder(transferSyntax)
+
+    Get the decoder registered for the transfer syntax, or None.
+    """
+    return _decoders.get(transferSyntax)
+
+
+def _readItems(fp):
+    """ _readItems(fp)
+    Read the items of encapsulated data from the file object, up to the
+    sequence delimiter or the end of the data. Returns a list with the
+    value of each item.
+    """
+    items = []
+    while True:
+        header = _readItemHeader(fp)
+        if header is None or header[0] != _itemTag:
+            break
+        value = fp.read(header[1])
+        if len(value) < header[1]:
+            break
+        items.append(value)
+    return items
+
+
+def _getEncodedFrames(ds):
+    """ _getEncodedFrames(ds)
+    Get the encoded data of the frames of a dataset (or record) with
+    encapsulated pixel data, as a list with the fragments of each frame
+    joined. For a FrameRecord this is just its frame. Returns None if the
+    frames cannot be told apart.
+    """
+
+    # The items of a frame (without the Basic Offset Table)
+    if isinstance(ds, FrameRecord):
+        location = ds._pixelDataLocation
+        if location is None:
+            return None
+        data = _readAt(ds.filename, location[0], location[1])
+        return [b''.join(_readItems(io.BytesIO(data)))]
+
+    # The items of the whole element, from memory or from the file
+    value = None
+    if not _isHeaderOnly(ds):
+        value = _getRawPixelDataElement(ds).value
+    if value is None:
+        value = _getPixelDataValue(ds)
+        if value is None:
+            return None
+    items = _readItems(io.BytesIO(value))
+    if not items:
+        return None
+    table, fragments = np.frombuffer(items[0], '<u4'), items[1:]
+
+    # Gather the fragments of the frames
+    nframes = int(ds.get('NumberOfFrames') or 1)
+    if nframes == 1:
+        return [b''.join(fragments)]
+    elif len(fragments) == nframes:
+        return fragments
+    elif len(table) == nframes:
+        # The offsets are those of the items, relative to the first item
+        sizes = [8 + len(fragment) for fragment in fragments]
+        offsets = np.cumsum([0] + sizes[:-1])
+        frames = np.searchsorted(table, offsets, 'right') - 1
+        return [b''.join(fragment for fragment, frame
+                         in zip(fragments, frames) if frame == i)
+                for i in range(nframes)]
+    return None
+
+
+def _decodeRegistered(ds):
+    """ _decodeRegistered(ds)
+    Decode the pixel data of the dataset (or record) with the decoder
+    registered for its transfer syntax. Returns None if there is no such
+    decoder, or if it cannot decode the data.
+    """
+    decoder = _decoders.get(_getTransferSyntax(ds))
+    if decoder is None:
+        return None
+    frames = _getEncodedFrames(ds)
+    if frames is None:
+        return None
+    header = ds._header if isinstance(ds, FrameRecord) else ds
+    data = decoder(frames, header)
+    if data is None:
+        return None
+    if isinstance(ds, FrameRecord) or len(frames) == 1:
+        return data[0]
+    return data
+
+
+def _getRleSegments(frames, nsegments):
+    """ _getRleSegments(frames, nsegments)
+    Get the RLE segments of the frames, as a buffer with all segments
+    and arrays with the start and end of each segment in the buffer.
+    """
+    segments = []
+    for frame in frames:
+        header = struct.unpack('<16L', frame[:64])
+        if header[0] != nsegments:
+            raise ValueError('Unexpected number of RLE segments: %i '
+                             'instead of %i.' % (header[0], nsegments))
+        offsets = list(header[1:nsegments + 1]) + [len(frame)]
+        segments.extend(frame[offsets[i]:offsets[i + 1]]
+                        for i in range(nsegments))
+    buffer = np.frombuffer(b''.join(segments), np.uint8)
+    ends = np.cumsum([len(segment) for segment in segments])
+    starts = ends - [len(segment) for segment in segments]
+    return buffer, starts, ends
+
+
+# The distance from the header of an RLE (PackBits) run to the next,
+# by the value of the header
+_rleSteps = [code + 2 if code < 128 else 1 if code == 128 else 2
+             for code in range(256)]
+
+
+def _getRleHeaders(buffer, starts, ends):
+    """ _getRleHeaders(buffer, starts, ends)
+    Get the positions of the headers of the (PackBits) runs in the RLE
+    segments buffer[starts[i]:ends[i]]. The position of a header depends
+    on all headers before it, so this is a loop over the runs (a run
+    covers up to 128 bytes); the work per byte is left to NumPy.
+    """
+    data = buffer.tobytes()
+    steps = _rleSteps
+    headers = []
+    append = headers.append
+    for pos, end in zip(starts.tolist(), ends.tolist()):
+        while pos < end:
+            append(pos)
+            pos += steps[data[pos]]
+    return np.array(headers, np.intp)
+
+
+def _decodeRleSegments(buffer, starts, ends, length):
+    """ _decodeRleSegments(buffer, starts, ends, length)
+    Decode the RLE segments buffer[starts[i]:ends[i]] in one go. Returns
+    an array of shape (segments, length). Raises ValueError if a segment
+    decodes to fewer bytes; extra bytes (e.g. padding) are dropped.
+    """
+    headers = _getRleHeaders(buffer, starts, ends)
+    codes = buffer[headers]
+    segments = np.searchsorted(starts, headers, 'right') - 1
+
+    # The bytes up to the next header (or the end of the segment)
+    spans = np.minimum(np.r_[headers[1:], len(buffer)], ends[segments])
+    spans -= headers
+    literal = codes < 128
+    replicate = (codes > 128) & (spans > 1)
+    runs = np.where(literal, np.minimum(codes + 1, spans - 1), 0)
+    runs[replicate] = 257 - codes[replicate].astype(np.intp)
+
+    # The number of times each byte is in the output: once for the bytes
+    # of a literal run, 257 - header for the byte of a replicate run
+    counts = np.repeat(literal.view(np.uint8), spans)
+    counts[headers] = 0
+    counts[headers[replicate] + 1] = runs[replicate]
+    data = np.repeat(buffer, counts)
+
+    # Take the first length bytes of each segment
+    sizes = np.bincount(segments, runs, len(starts)).astype(np.intp)
+    if (sizes < length).any():
+        raise ValueError('An RLE segment decodes to fewer bytes than '
+                         'expected.')
+    elif (sizes == length).all():
+        return data.reshape(len(starts), length)
+    offsets = np.cumsum(sizes) - sizes
+    keep = (offsets.reshape(-1, 1) + np.arange(length)).ravel()
+    return data[keep].reshape(len(starts), length)
+
+
+def decode_rle(frames, rows, columns, bitsAllocated=16, samplesPerPixel=1,
+               signed=False):
+    """ decode_rle(frames, rows, columns, bitsAllocated=16,
+                   samplesPerPixel=1, signed=False)
+
+    Decode RLE Lossless frames (a list with the encoded data of each
+    frame, see encode_rle). The segments of all frames are decoded
+    together with NumPy, in batches of a few MB. Returns an array of
+    shape (frames, rows, columns), or (frames, rows, columns, samples)
+    if samplesPerPixel is larger than one.
+    """
+    if bitsAllocated not in (8, 16, 32, 64):
+        raise ValueError('Cannot decode RLE data with %i bits allocated.'
+                         % bitsAllocated)
+    nbytes = bitsAllocated // 8
+    nsegments = samplesPerPixel * nbytes
+    length = rows * columns
+    dtype = np.dtype('<%s%i' % ('i' if signed else 'u', nbytes))
+    batch = max(1, _rleBatchBytes // max(1, length * nsegments))
+
+    planes = []
+    for i in range(0, len(frames), batch):
+        segments = _getRleSegments(frames[i:i + batch], nsegments)
+        planes.append(_decodeRleSegments(*segments, length=length))
+    planes = np.concatenate(planes).reshape(
+        len(frames), samplesPerPixel, nbytes, length)
+
+    # The segments hold the most significant byte first
+    data = np.ascontiguousarray(planes[:, :, ::-1].transpose(0, 3, 1, 2))
+    data = data.view(dtype).reshape(len(frames), rows, columns,
+                                    samplesPerPixel)
+    if samplesPerPixel == 1:
+        data = data[..., 0]
+    return data
+
+
+def _decodeRle(frames, ds):
+    """ _decodeRle(frames, ds)
+    The registered decoder for RLE Lossless, see decode_rle. Leaves
+    other bit depths to pydicom.
+    """
+    bits = int(ds.get('BitsAllocated') or 0)
+    if bits not in (8, 16, 32, 64):
+        return None
+    return decode_rle(frames, int(ds.get('Rows')), int(ds.get('Columns')),
+                      bits, int(ds.get('SamplesPerPixel') or 1),
+                      bool(ds.get('PixelRepresentation')))
+
+
+def _encodeRleSegment(data):
+    """ _encodeRleSegment(data)
+    Encode a byte plane (a uint8 array) as an RLE (PackBits) segment.
+    Runs of two or more equal bytes become replicate runs, the other
+    bytes are gathered in literal runs, each of at most 128 bytes.
+    """
+    n = len(data)
+    starts = np.flatnonzero(np.r_[True, data[1:] != data[:-1]])
+    lengths = np.diff(np.r_[starts, n])
+
+    # Split the runs in chunks of at most 128 bytes
+    nchunks = (lengths + 127) // 128
+    chunkRuns = np.repeat(np.arange(len(starts)), nchunks)
+    chunkIndex = (np.arange(len(chunkRuns)) -
+                  np.repeat(np.cumsum(nchunks) - nchunks, nchunks))
+    chunkStarts = starts[chunkRuns] + 128 * chunkIndex
+    chunkLengths = np.minimum(lengths[chunkRuns] - 128 * chunkIndex, 128)
+
+    # Gather the chunks of one byte in literal runs of at most 128 bytes
+    literal = chunkLengths == 1
+    headers = 257 - chunkLengths
+    first = np.zeros(len(literal), bool)
+    literals = np.flatnonzero(literal)
+    if len(literals):
+        stretchStart = np.r_[True, np.diff(literals) > 1]
+        stretches = np.cumsum(stretchStart) - 1
+        index = (np.arange(len(literals)) -
+                 np.flatnonzero(stretchStart)[stretches])
+        first[literals] = index % 128 == 0
+        packets = np.cumsum(first[literals]) - 1
+        headers[literals] = np.bincount(packets)[packets] - 1
+
+    # Each chunk gives its header (if it starts a run) and its byte
+    hasHeader = ~literal | first
+    sizes = 1 + hasHeader
+    positions = np.cumsum(sizes) - sizes
+    out = np.zeros(int(sizes.sum()) + int(sizes.sum()) % 2, np.uint8)
+    out[positions[hasHeader]] = headers[hasHeader]
+    out[positions + hasHeader] = data[chunkStarts]
+    return out.tobytes()
+
+
+def encode_rle(data, samplesPerPixel=1):
+    """ encode_rle(data, samplesPerPixel=1)
+
+    Encode image data with RLE Lossless. The data is an array of shape
+    (rows, columns) or (frames, rows, columns), with an extra last axis
+    for the samples if samplesPerPixel is larger than one, and an
+    integer dtype of 8, 16, 32 or 64 bits. Returns a list with the
+    encoded data of each frame, which can be encapsulated in a dataset
+    with encapsulate_frames, and decoded with decode_rle.
+    """
+    data = np.asarray(data)
+    ndim = 2 if samplesPerPixel == 1 else 3
+    if data.ndim == ndim:
+        data = data[np.newaxis]
+    if data.ndim != ndim + 1 or data.dtype.kind not in 'iu':
+        raise ValueError('Cannot encode data of shape %s and dtype %s.'
+                         % (data.shape, data.dtype))
+    nbytes = data.dtype.itemsize
+    if samplesPerPixel * nbytes > 15:
+        raise ValueError('RLE data can hold at most 15 segments.')
+
+    # The byte planes, with the most significant byte first
+    planes = data.astype(data.dtype.newbyteorder('>')).view(np.uint8)
+    planes = planes.reshape(len(data), -1, samplesPerPixel, nbytes)
+
+    frames = []
+    for plane in planes:
+        segments = [_encodeRleSegment(plane[:, i, j])
+                    for i in range(samplesPerPixel) for j in range(nbytes)]
+        offsets = np.cumsum([64] + [len(segment)
+                                    for segment in segments[:-1]])
+        header = struct.pack('<16L', len(segments), *(
+            list(offsets) + [0] * (15 - len(segments))))
+        frames.append(header + b''.join(segments))
+    return frames
+
+
+def encapsulate_frames(frames):
+    """ encapsulate_frames(frames)
+
+    Encapsulate encoded frames (e.g. from encode_rle) as the value of a
+    pixel data element: a Basic Offset Table, and an item per frame. The
+    element should have VR OB and an undefined length.
+    """
+    items = []
+    for frame in frames:
+        if len(frame) % 2:
+            frame += b'\x00'
+        items.append(struct.pack('<HHL', _itemTag[0], _itemTag[1],
+                                 len(frame)) + frame)
+    offsets = np.cumsum([0] + [len(item) for item in items[:-1]])
+    table = offsets.astype('<u4').tobytes() if len(frames) > 1 else b''
+    return (struct.pack('<HHL', _itemTag[0], _itemTag[1], len(table)) +
+            table + b''.join(items))
+
+
+register_decoder(RLELossless, _decodeRle)
+
+
+def _getPixelDataFromDataset(ds, out=None, rows=None, cols=None):
+    """ Get the pixel data from the given dataset. If the data
+    was deferred, make it deferred again, so that memory is
+    preserved. The stored values are returned, the rescaling is
+    applied for the whole series (see _getRescale).
+
+    Native pixel data is read straight from the file, and into out if
+    given (see _readNativePixelData), so the returned array may be out.
+    Encapsulated pixel data is decoded with the registered decoder of
+    its transfer syntax if there is one (see register_decoder), and
+    with pydicom otherwise. If rows and/or cols are given, the data is
+    cropped to these slices.
+    """
+
+    # Get data
+    data = _readNativePixelData(ds, out, rows, cols)
+    if data is None:
+        data = _decodeRegistered(ds)
+        if data is None:
+            data = _decodePixelData(ds)
+        data = _cropSlice(data, rows, cols)
+    return data
+
+
+def _completeDataset(ds):
+    """ _completeDataset(ds)
+    Header-only datasets from the index or a DICOMDIR may lack the
+    location and format of the pixel data and the rescale parameters.
+    Return a header-only dataset read from the file for these, and the
+    given dataset otherwise.
+    """
+    if isinstance(ds, FrameRecord):
+        return ds
+    if _isHeaderOnly(ds) and _getPixelDataLocation(ds) is None:
+        return _readHeaderOnly(ds.filename, True)
+    return ds
+
+
+def _getRescale(datasets):
+    """ _getRescale(datasets)
+    Get the RescaleSlope and RescaleIntercept of the datasets as two
+    float arrays, with 1 and 0 for datasets that do not have them.
+    """
+    slopes = np.ones(len(datasets), np.float64)
+    offsets = np.zeros(len(datasets), np.float64)
+    for i, ds in enumerate(datasets):
+        if 'RescaleSlope' in ds:
+            slopes[i] = float(ds.RescaleSlope)
+        if 'RescaleIntercept' in ds:
+            offsets[i] = float(ds.RescaleIntercept)
+    return slopes, offsets
+
+
+def _getRescaleDtype(ds, dtype, slopes, offsets):
+    """ _getRescaleDtype(ds, dtype, slopes, offsets)
+    Choose the dtype of the rescaled data of a series, given its first
+    dataset, the dtype of the stored values and the rescale parameters
+    of all slices. The range of the stored values follows from
+    BitsStored, so that no pass over the data is needed.
+    """
+
+    # No need to change the datatype?
+    if np.all(slopes == 1) and np.all(offsets == 0):
+        return dtype
+    elif dtype.kind == 'f':
+        return dtype
+    elif np.any(slopes != np.round(slopes)) or \
+            np.any(offsets != np.round(offsets)):
+        return np.dtype(np.float32)
+
+    # Determine range of the stored values
+    info = np.iinfo(dtype)
+    minVal, maxVal = info.min, info.max
+    bits = ds.get('BitsStored')
+    if bits and 0 < int(bits) < info.bits:
+        bits = int(bits)
+        if dtype.kind == 'i':
+            minVal, maxVal = -2**(bits - 1), 2**(bits - 1) - 1
         else:
-            # Determine required range
-            minReq, maxReq = data.min(), data.max()
-            minReq = min(
-                [minReq, minReq * slope + offset, maxReq * slope + offset])
-            maxReq = max(
-                [maxReq, minReq * slope + offset, maxReq * slope + offset])
-
-            # Determine required datatype from that
-            dtype = None
-            if minReq < 0:
-                # Signed integer type
-                maxReq = max([-minReq, maxReq])
-                if maxReq < 2**7:
-                    dtype = np.int8
-                elif maxReq < 2**15:
-                    dtype = np.int16
-                elif maxReq < 2**31:
-                    dtype = np.int32
-                else:
-                    dtype = np.float32
+            minVal, maxVal = 0, 2**bits - 1
+
+    # Determine required range, the data is multiplied in place first
+    values = np.concatenate([
+        [minVal, maxVal], minVal * slopes, maxVal * slopes,
+        minVal * slopes + offsets, maxVal * slopes + offsets])
+    minReq, maxReq = values.min(), values.max()
+
+    # Determine required datatype from that
+    if minReq < 0:
+        candidates = [np.int8, np.int16, np.int32]
+    else:
+        candidates = [np.uint8, np.uint16, np.uint32]
+    for candidate in candidates:
+        info = np.iinfo(candidate)
+        if info.min <= minReq and maxReq <= info.max:
+            return np.dtype(candidate)
+    return np.dtype(np.float32)
+
+
+def _applyRescale(data, slopes, offsets, dtype):
+    """ _applyRescale(data, slopes, offsets, dtype)
+    Apply the slopes and offsets (one per slice along the first axis)
+    to the stored values, in place after changing the datatype to dtype
+    if needed. Returns the rescaled data.
+    """
+
+    # Change datatype
+    if data.dtype != dtype:
+        data = data.astype(dtype)
+
+    # Apply slope and offset, as scalars if the same for all slices
+    slopes, offsets = slopes.astype(dtype), offsets.astype(dtype)
+    if np.all(slopes == slopes[0]) and np.all(offsets == offsets[0]):
+        slopes, offsets = slopes[0], offsets[0]
+    else:
+        shape = (len(slopes),) + (1,) * (data.ndim - 1)
+        slopes, offsets = slopes.reshape(shape), offsets.reshape(shape)
+    if np.any(slopes != 1):
+        data *= slopes
+    if np.any(offsets != 0):
+        data += offsets
+    return data
+
+
+def _iterFiles(path):
+    """ _iterFiles(path)
+    Generator that yields the files in the directory, recursively. The
+    files in a directory are yielded before those in its subdirectories.
+    """
+    dirs = []
+    for entry in _scanDir(path):
+        if entry.is_dir():
+            dirs.append(entry.path)
+        else:
+            yield entry.path
+    for item in dirs:
+        for filename in _iterFiles(item):
+            yield filename
+
+
+def _gatherFiles(path, listed=None):
+    """ _gatherFiles(path, listed=None)
+    Get the list of files for the given path, which is a directory
+    or a list of files or directories. Directories are listed recursively
+    (see _listFiles for listed).
+    """
+
+    # Init list of files
+    files = []
+
+    # Obtain data from the given path
+    if isinstance(path, compat.string_types):
+        # Make dir nice
+        basedir = os.path.abspath(path)
+        # Check whether it exists
+        if not os.path.isdir(basedir):
+            raise ValueError('The given path is not a valid directory.')
+        # Find files recursively
+        _listFiles(files, basedir, listed)
+
+    elif isinstance(path, (tuple, list)):
+        # Iterate over all elements, which can be files or directories
+        for p in path:
+            if os.path.isdir(p):
+                _listFiles(files, os.path.abspath(p), listed)
+            elif os.path.isfile(p):
+                files.append(p)
             else:
-                # Unsigned integer type
-                if maxReq < 2**8:
-                    dtype = np.uint8
-                elif maxReq < 2**16:
-                    dtype = np.uint16
-                elif maxReq < 2**32:
-                    dtype = np.uint32
-                else:
-                    dtype = np.float32
+                print("Warning, the path '%s' is not valid." % p)
+    else:
+        raise ValueError('The path argument must be a string or list.')
 
-            # Change datatype
-            if dtype != data.dtype:
-                data = data.astype(dtype)
+    return files
+
+
+def _fillVolume(vol, datasets, showProgress, workers=None, executor=None,
+                start=1, rows=None, cols=None, slopes=None, offsets=None,
+                stats=None):
+    """ _fillVolume(vol, datasets, showProgress, workers=None, executor=None,
+                    start=1, rows=None, cols=None, slopes=None, offsets=None,
+                    stats=None)
+    Decode the datasets into the slices of the volume, starting at the
+    given slice (by default the first slice should be filled already).
+    If workers is larger than one, or an executor is given, the slices
+    are decoded concurrently. The slices are cropped to rows and cols.
+    If slopes and offsets are given, each slice is rescaled in the dtype
+    of the volume. If stats (a _DecodeStats) is given, the slices are
+    added to it. The read-ahead scheduler sets the order in which the
+    slices are read, and prefetches the slices that follow.
+    """
+    ll = len(datasets)
+    order = range(start, ll)
+    scheduler = _readAhead
+    if scheduler is not None:
+        order = scheduler.schedule(datasets, order)
+
+    def fill(k):
+        # Native data is read straight into the volume
+        z = order[k]
+        if scheduler is not None:
+            scheduler.ahead(datasets, order, k)
+        out = vol[z]
+        data = _getTimedPixelData(datasets[z], out, rows, cols, stats)
+        _fillSlice(out, data, slopes, offsets, z)
+
+    if executor is None and (not workers or workers < 2):
+        for k in range(len(order)):
+            fill(k)
+            showProgress(float(start + k) / ll)
+        return
+
+    # Decode concurrently, the workers write straight into the volume
+    ownExecutor = executor is None
+    if ownExecutor:
+        executor = ThreadPoolExecutor(workers)
+    futures = [executor.submit(fill, k) for k in range(len(order))]
+    try:
+        for count, future in enumerate(as_completed(futures)):
+            future.result()
+            showProgress(float(start + count) / ll)
+    finally:
+        for future in futures:
+            future.cancel()
+        if ownExecutor:
+            executor.shutdown()
+
+
+def _getTimedPixelData(ds, out=None, rows=None, cols=None, stats=None):
+    """ _getTimedPixelData(ds, out=None, rows=None, cols=None, stats=None)
+    Get the pixel data as _getPixelDataFromDataset does, and add the
+    slice to stats if it is given.
+    """
+    if stats is None:
+        return _getPixelDataFromDataset(ds, out, rows, cols)
+    t0 = time.perf_counter()
+    data = _getPixelDataFromDataset(ds, out, rows, cols)
+    stats.add(ds, time.perf_counter() - t0)
+    return data
 
-        # Apply slope and offset
-        data *= slope
-        data += offset
 
-    # Done
+def _applyTimedRescale(data, slopes, offsets, dtype):
+    """ _applyTimedRescale(data, slopes, offsets, dtype)
+    Apply the rescale as _applyRescale does, and send a rescale event to
+    the metrics hooks, if there are any.
+    """
+    if not _metricsHooks:
+        return _applyRescale(data, slopes, offsets, dtype)
+    t0 = time.perf_counter()
+    data = _applyRescale(data, slopes, offsets, dtype)
+    _emitEvent('rescale', time.perf_counter() - t0, dtype=str(data.dtype),
+               arrayBytes=data.nbytes)
     return data
 
 
+def _fillSlice(out, data, slopes=None, offsets=None, z=0):
+    """ _fillSlice(out, data, slopes=None, offsets=None, z=0)
+    Put the stored values in out (which may be data itself), rescaled
+    in place with the z-th slope and offset if these are given. As in
+    _applyRescale, the slope and offset are floats of the same dtype if
+    out is a float array.
+    """
+    if data is not out:
+        out[...] = data
+    if slopes is not None and (slopes[z] != 1 or offsets[z] != 0):
+        slope, offset = slopes[z], offsets[z]
+        if out.dtype.kind == 'f':
+            slope, offset = out.dtype.type(slope), out.dtype.type(offset)
+        np.multiply(out, slope, out=out, casting='unsafe')
+        np.add(out, offset, out=out, casting='unsafe')
+
+
+def _prepareOutput(out, shape, dtype):
+    """ _prepareOutput(out, shape, dtype)
+    Get the array to load data of the given shape in. If out is None, a
+    new array is created. If out is a filename, a np.memmap is created in
+    that file. Otherwise out should be an array (or np.memmap) of the
+    given shape, its dtype is kept.
+    """
+    shape = tuple(shape)
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    elif isinstance(out, compat.string_types):
+        return np.memmap(out, dtype=dtype, mode='w+', shape=shape)
+    elif tuple(out.shape) != shape:
+        raise ValueError('The out array must have shape %s.' % (shape,))
+    return out
+
+
+class VolumeCache(object):
+    """ VolumeCache(maxBytes, copy=True)
+    A process-wide cache of the arrays returned by
+    DicomSeries.get_pixel_array(), keyed by series UID, slice files and
+    region of interest. The least recently used arrays are evicted when
+    the total size exceeds maxBytes; larger arrays are not cached.
+
+    If copy is True, a copy of the cached array is returned, so that the
+    caller can change it. Otherwise the cached (read-only) array itself
+    is returned, which makes a hit free.
+    """
+
+    def __init__(self, maxBytes, copy=True):
+        self.maxBytes = int(maxBytes)
+        self.copy = copy
+        self.hits = 0
+        self.misses = 0
+        self._nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        """ The total size of the cached arrays. """
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return "<VolumeCache with %i items (%i/%i bytes), %i hits, " \
+               "%i misses>" % (len(self._items), self._nbytes,
+                               self.maxBytes, self.hits, self.misses)
+
+    def get(self, key):
+        """ get(key)
+        Get the cached value for the key, or None if it is not cached.
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            value = item[0]
+            self.hits += 1
+        if self.copy:
+            value = _copyValue(value)
+        return value
+
+    def put(self, key, value):
+        """ put(key, value)
+        Cache the value (an array, or a tuple of arrays) for the key, and
+        evict the least recently used values to stay within maxBytes.
+        The value is copied if copy is True, and made read-only.
+        """
+        arrays = value if isinstance(value, tuple) else (value,)
+        nbytes = sum(a.nbytes for a in arrays)
+        if nbytes > self.maxBytes:
+            return
+        if self.copy:
+            value = _copyValue(value)
+            arrays = value if isinstance(value, tuple) else (value,)
+        for a in arrays:
+            a.setflags(write=False)
+        with self._lock:
+            if key in self._items:
+                self._nbytes -= self._items.pop(key)[1]
+            self._items[key] = value, nbytes
+            self._nbytes += nbytes
+            while self._nbytes > self.maxBytes:
+                self._nbytes -= self._items.popitem(last=False)[1][1]
+
+    def clear(self):
+        """ clear()
+        Remove all cached values and reset the counters.
+        """
+        with self._lock:
+            self._items.clear()
+            self._nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+def _copyValue(value):
+    """ _copyValue(value)
+    Copy the array, or each array of a tuple of arrays.
+    """
+    if isinstance(value, tuple):
+        return tuple(np.array(a) for a in value)
+    return np.array(value)
+
+
+_volumeCache = None
+
+
+def set_volume_cache(maxBytes, copy=True):
+    """ set_volume_cache(maxBytes, copy=True)
+
+    Enable the process-wide volume cache, with the given byte budget (see
+    VolumeCache), so that repeated calls of get_pixel_array() on the same
+    series do not read and decode the files again. If maxBytes is None or
+    0, the cache is disabled. maxBytes can also be a VolumeCache (as
+    returned by get_volume_cache), which is then reinstated as it is.
+    Returns the cache (or None).
+    """
+    global _volumeCache
+    _volumeCache = None
+    if isinstance(maxBytes, VolumeCache):
+        _volumeCache = maxBytes
+    elif maxBytes:
+        _volumeCache = VolumeCache(maxBytes, copy)
+    return _volumeCache
+
+
+def get_volume_cache():
+    """ get_volume_cache()
+
+    Get the process-wide VolumeCache, or None if it is not enabled.
+    """
+    return _volumeCache
+
+
+def _checkRegion(**axes):
+    """ _checkRegion(**axes)
+    Check that the region of interest for get_pixel_array is given as
+    slice objects (or None) for each axis.
+    """
+    for name in sorted(axes):
+        if axes[name] is not None and not isinstance(axes[name], slice):
+            raise TypeError('%s must be a slice or None, e.g. slice(i, i + 1)'
+                            ' for a single index, not %s'
+                            % (name, type(axes[name]).__name__))
+
+
+def _sliceKey(s):
+    """ _sliceKey(s)
+    Get a hashable key for a slice object (or None).
+    """
+    if s is None:
+        return None
+    return s.start, s.stop, s.step
+
+
 # The public functions and classes
 
 
-def read_files(path, showProgress=False, readPixelData=False, force=False):
-    """ read_files(path, showProgress=False, readPixelData=False)
+def read_files(path, showProgress=False, readPixelData=False, force=False,
+               workers=None, backend='thread', headerOnly=False, tags=None,
+               index=None, compact=False, temporal=False):
+    """ read_files(path, showProgress=False, readPixelData=False,
+                   force=False, workers=None, backend='thread',
+                   headerOnly=False, tags=None, index=None, compact=False,
+                   temporal=False)
 
     Reads dicom files and returns a list of DicomSeries objects, which
     contain information about the data, and can be used to load the
@@ -327,103 +2495,483 @@ def read_files(path, showProgress=False, readPixelData=False, force=False):
     default the loading of pixeldata is deferred until it is requested
     using the DicomSeries.get_pixel_array() method. In general, both
     methods should be equally fast.
+
+    If workers is an integer larger than one, the files are parsed
+    concurrently by that many workers. The backend is 'thread' (default)
+    or 'process'; the latter helps when parsing is CPU bound, at the cost
+    of sending the parsed datasets back to this process. The resulting
+    list of series is the same as when reading sequentially.
+
+    If headerOnly is True, only the tags in discoveryTags, plus the
+    optional list of extra tags, are read from each file, and reading
+    stops before the pixel data. This is much faster and uses much less
+    memory for large directories. The full header of the first file is
+    then read when the info attribute is first used, and the pixel data
+    is read by get_pixel_array(). The readPixelData option is ignored
+    in this mode.
+
+    If index is given (a filename or a SeriesIndexUtils.SeriesIndex),
+    the header-only datasets are stored in that persistent index, keyed
+    by path, size and modification time. Files that did not change since
+    a previous call are then not read again. Using an index implies
+    headerOnly=True.
+
+    If compact is True, each slice is kept as a SliceRecord instead of a
+    dataset, which saves a lot of memory for large archives. The extra
+    tags are then not kept. This implies headerOnly=True.
+
+    Enhanced multi-frame files are split into their frames (as
+    FrameRecords), which are the slices of the series. Their geometry
+    is read from the functional groups, and get_pixel_array() decodes
+    only the frames that it needs, from the file, optionally in parallel.
+
+    If temporal is True, gated and dynamic data is read as 4D series,
+    instead of being split in a series per time frame. The slices of a
+    series are grouped in time frames by TemporalPositionIndex, TriggerTime
+    or FrameReferenceTime (the first that all slices have); if all time
+    frames have the same number of slices, a single series with shape
+    (t, z, y, x) and a timing table is made (see DicomSeries.timing).
     """
 
-    # Init list of files
-    files = []
+    collection = SeriesCollection(showProgress, readPixelData, force,
+                                  workers, backend, headerOnly, tags, index,
+                                  compact, temporal)
+    try:
+        collection.update(path)
+    finally:
+        collection.close()
+    return collection.series
 
-    # Obtain data from the given path
+
+def iter_files(path):
+    """ iter_files(path)
+
+    Generator that yields the files in the given path, which is a
+    directory or a list of files or directories. Directories are walked
+    lazily and recursively, the files in a directory are yielded before
+    those in its subdirectories.
+    """
     if isinstance(path, compat.string_types):
-        # Make dir nice
         basedir = os.path.abspath(path)
-        # Check whether it exists
         if not os.path.isdir(basedir):
             raise ValueError('The given path is not a valid directory.')
-        # Find files recursively
-        _listFiles(files, basedir)
+        for filename in _iterFiles(basedir):
+            yield filename
 
     elif isinstance(path, (tuple, list)):
-        # Iterate over all elements, which can be files or directories
         for p in path:
             if os.path.isdir(p):
-                _listFiles(files, os.path.abspath(p))
+                for filename in _iterFiles(os.path.abspath(p)):
+                    yield filename
             elif os.path.isfile(p):
-                files.append(p)
+                yield p
             else:
                 print("Warning, the path '%s' is not valid." % p)
     else:
         raise ValueError('The path argument must be a string or list.')
 
-    # Set default progress callback?
-    if showProgress is True:
-        showProgress = _progressCallback
-    if not hasattr(showProgress, '__call__'):
-        showProgress = _dummyProgressCallback
 
-    # Set defer size
-    deferSize = 16383  # 128**2-1
-    if readPixelData:
-        deferSize = None
+def list_files(path):
+    """ list_files(path)
 
-    # Gather file data and put in DicomSeries
-    series = {}
-    count = 0
-    showProgress('Loading series information:')
-    for filename in files:
+    Get the list of dicom files in the given path, which is a directory
+    or a list of files or directories, in the order in which read_files
+    reads them. DICOMDIR files are left out.
+    """
+    return [filename for filename in _gatherFiles(path)
+            if not filename.count("DICOMDIR")]
 
-        # Skip DICOMDIR files
-        if filename.count("DICOMDIR"):
-            continue
 
-        # Try loading dicom ...
-        try:
-            dcm = pydicom.read_file(filename, deferSize, force=force)
-        except pydicom.filereader.InvalidDicomError:
-            continue  # skip non-dicom file
-        except Exception as why:
-            if showProgress is _progressCallback:
-                _progressBar.PrintMessage(str(why))
-            else:
-                print('Warning:', why)
-            continue
+def read_headers(files, force=False, workers=None, backend='thread',
+                 tags=None):
+    """ read_headers(files, force=False, workers=None, backend='thread',
+                     tags=None)
 
-        # Get SUID and register the file with an existing or new series object
-        try:
-            suid = dcm.SeriesInstanceUID
-        except AttributeError:
-            continue  # some other kind of dicom file
-        if suid not in series:
-            series[suid] = DicomSeries(suid, showProgress)
-        series[suid]._append(dcm)
+    Generator that reads the header-only dataset of each of the given
+    files, as read_files does with headerOnly=True, and yields a
+    (dcm, message) tuple for each file, in the order of the files. dcm
+    is None if the file could not be read, and message then tells why.
+    The other arguments are as for read_files.
+    """
+    tags = discoveryTags + list(tags or [])
+    return _iterReadFiles(list(files), None, force, workers, backend, tags)
+
+
+def iter_series(path, showProgress=False, readPixelData=False, force=False,
+                workers=None, backend='thread', headerOnly=False, tags=None,
+                index=None, boundary=None, compact=False, temporal=False):
+    """ iter_series(path, showProgress=False, readPixelData=False,
+                    force=False, workers=None, backend='thread',
+                    headerOnly=False, tags=None, index=None, boundary=None,
+                    compact=False, temporal=False)
+
+    Generator variant of read_files, that yields the DicomSeries while the
+    path is walked. The files are grouped by the callable boundary, which
+    gets a filename and returns a key; the series in a group of files are
+    yielded as soon as a file with another key is found. By default the
+    key is the directory of the file, so the series in a directory are
+    yielded as soon as that directory has been walked. Only the datasets
+    of one group are kept in memory by this generator.
+
+    It is assumed that the files of a series do not span several groups;
+    if they do, a DicomSeries is yielded for each group. The other
+    arguments are as for read_files, the progress is shown per group.
+    """
+    if boundary is None:
+        boundary = os.path.dirname
+
+    # Open the index once for all groups
+    close = isinstance(index, compat.string_types)
+    if close:
+        from pydicom_ext.SeriesIndexUtils import SeriesIndex
+        index = SeriesIndex(index)
+
+    def readGroup(files):
+        collection = SeriesCollection(showProgress, readPixelData, force,
+                                      workers, backend, headerOnly, tags,
+                                      index, compact, temporal)
+        collection.update(files)
+        return collection.series
+
+    try:
+        files = []
+        key = None
+        for filename in iter_files(path):
+            newKey = boundary(filename)
+            if files and newKey != key:
+                for serie in readGroup(files):
+                    yield serie
+                files = []
+            key = newKey
+            files.append(filename)
+        if files:
+            for serie in readGroup(files):
+                yield serie
+    finally:
+        if close:
+            index.close()
+
+
+def read_dicomdir(filename, showProgress=False, force=False, workers=None,
+                  backend='thread', tags=None, compact=False):
+    """ read_dicomdir(filename, showProgress=False, force=False,
+                      workers=None, backend='thread', tags=None,
+                      compact=False)
+
+    Get the list of DicomSeries from the directory records of a DICOMDIR
+    file, instead of reading all files. The series are in header-only
+    mode (see read_files): the files are only read when the info or the
+    pixel data is needed.
+
+    The image records are used as header-only datasets. Records usually
+    hold only a few of the discoveryTags though. If the records of a
+    series identify and position the slices (InstanceNumber and
+    ImagePositionPatient), the tags in seriesTags that they lack are
+    taken from the header of one of its files; otherwise the header-only
+    datasets are read from all referenced files instead. The other
+    arguments are as for read_files; "force" also applies to the
+    DICOMDIR file itself.
+    """
+    from pydicom.dicomdir import DicomDir
+
+    # Like pydicom's read_dicomdir, which does not take force
+    dicomdir = pydicom.dcmread(filename, force=force)
+    if not isinstance(dicomdir, DicomDir):
+        raise pydicom.filereader.InvalidDicomError(
+            'File is not a DICOMDIR: %s' % filename)
+    basedir = os.path.dirname(os.path.abspath(filename))
+    tags = discoveryTags + list(tags or [])
+
+    # Get the datasets of each series from the directory records
+    records = {}
+    stack = list(dicomdir.patient_records)
+    while stack:
+        record = stack.pop(0)
+        if record.DirectoryRecordType == 'SERIES':
+            datasets = []
+            for child in record.children:
+                if 'ReferencedFileID' not in child:
+                    continue
+                fileID = child.ReferencedFileID
+                if isinstance(fileID, compat.string_types):
+                    fileID = [fileID]
+                ds = pydicom.dataset.Dataset()
+                for tag in tags:
+                    if tag in child:
+                        setattr(ds, tag, getattr(child, tag))
+                ds.SeriesInstanceUID = record.SeriesInstanceUID
+                ds.filename = os.path.join(basedir, *fileID)
+                datasets.append(ds)
+            # (a series without image records is skipped)
+            if datasets:
+                records.setdefault(record.SeriesInstanceUID,
+                                   []).extend(datasets)
+        else:
+            stack.extend(record.children)
+
+    collection = SeriesCollection(showProgress, force=force, workers=workers,
+                                  backend=backend, headerOnly=True, tags=tags,
+                                  compact=compact)
+    showProgress = collection._showProgress
+    changed = set()
+    count = 0
+    nfiles = sum(len(datasets) for datasets in records.values())
+    showProgress('Loading series information:')
+    for suid in sorted(records):
+        datasets = records[suid]
 
         # Show progress (note that we always start with a 0.0)
-        showProgress(float(count) / len(files))
-        count += 1
+        showProgress(float(count) / nfiles)
+        count += len(datasets)
+
+        # Read the files if the records are not sufficient
+        required = ['InstanceNumber']
+        if len(datasets) > 1:
+            required.append('ImagePositionPatient')
+        if all(tag in ds for ds in datasets for tag in required):
+            datasets = _completeRecords(datasets, force, tags)
+        else:
+            datasets = None
+        if datasets is None:
+            files = [ds.filename for ds in records[suid]]
+            datasets = _iterReadFiles(files, None, force, workers, backend,
+                                      tags)
+            datasets = [dcm for dcm, why in datasets if dcm is not None]
+
+        # Only the series that got datasets are assembled
+        for ds in datasets:
+            appended = collection._append(ds)
+            if appended is not None:
+                changed.add(appended)
 
     # Finish progress
     showProgress(None)
+    return collection._assemble(changed)
+
 
-    # Make a list and sort, so that the order is deterministic
-    series = list(series.values())
-    series.sort(key=lambda x: x.suid)
+def _completeRecords(datasets, force, tags):
+    """ _completeRecords(datasets, force, tags)
+    Add the tags in seriesTags that the datasets of a DICOMDIR series
+    lack, from the header of its first file. Returns the datasets, or
+    None if that file cannot be read.
+    """
+    missing = [tag for tag in seriesTags
+               if not all(tag in ds for ds in datasets)]
+    if not missing:
+        return datasets
+    dcm, why = _readFile(datasets[0].filename, None, force, tags)
+    if dcm is None:
+        return None
+    for tag in missing:
+        if tag in dcm:
+            value = dcm.get(tag)
+            for ds in datasets:
+                if tag not in ds:
+                    setattr(ds, tag, value)
+    return datasets
+
+
+def async_read_files(path, readPixelData=False, force=False, workers=4,
+                     executor=None, concurrency=None, headerOnly=False,
+                     tags=None, compact=False, temporal=False):
+    """ async_read_files(path, readPixelData=False, force=False, workers=4,
+                         executor=None, concurrency=None, headerOnly=False,
+                         tags=None, compact=False, temporal=False)
+
+    Asynchronous variant of read_files, for use in asyncio code. Returns
+    an AsyncJob: await it to get the list of DicomSeries, or iterate over
+    it with "async for" to get (phase, fraction) progress tuples while the
+    files are read.
+
+    The files are read by the given executor, or by a ThreadPoolExecutor
+    with the given number of workers. At most concurrency files (by
+    default workers) are read at the same time, so that a large directory
+    does not flood the executor. When the job is cancelled, the reads
+    that did not start yet are cancelled. The other arguments are as for
+    read_files; a persistent index is not supported.
+    """
+    import asyncio
+    if concurrency is None:
+        concurrency = workers
+
+    async def run(report):
+        loop = _getRunningLoop()
+        cancelled = threading.Event()
+        showProgress = _asyncProgressCallback(loop, report, cancelled)
+        collection = SeriesCollection(showProgress, readPixelData, force,
+                                      headerOnly=headerOnly, tags=tags,
+                                      compact=compact, temporal=temporal)
+        ownExecutor = executor is None
+        pool = ThreadPoolExecutor(workers) if ownExecutor else executor
+        pending = deque()
+        try:
+            files, nfiles = await loop.run_in_executor(
+                pool, collection._getNewFiles, path)
+
+            def submit(filename):
+                pending.append((filename, loop.run_in_executor(
+                    pool, _readFile, filename, collection._deferSize,
+                    collection._force, collection._tags)))
+
+            # Read the files, keeping at most concurrency reads pending,
+            # and add the results in the order of the files
+            files = iter(files)
+            for filename in files:
+                submit(filename)
+                if len(pending) >= concurrency:
+                    break
+            changed = set()
+            count = 0
+            bytesRead = 0
+            t0 = time.perf_counter()
+            showProgress('Loading series information:')
+            while pending:
+                filename, future = pending.popleft()
+                dcm, why = await future
+                nextFile = next(files, None)
+                if nextFile is not None:
+                    submit(nextFile)
+                if _metricsHooks:
+                    bytesRead += _getHeaderSize(dcm)
+                suid = collection._add(filename, dcm, why)
+                if suid is not None:
+                    changed.add(suid)
+                count += 1
+                showProgress(float(count) / max(nfiles, 1))
+            showProgress(None)
+            if _metricsHooks:
+                _emitScanEvent(t0, count, bytesRead)
+
+            # Split and finish the series
+            return await loop.run_in_executor(pool, collection._assemble,
+                                              changed)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        finally:
+            for filename, future in pending:
+                future.cancel()
+            if ownExecutor:
+                pool.shutdown(wait=False)
+
+    return AsyncJob(run)
+
+
+class AsyncJob(object):
+    """ AsyncJob(func)
+    A job of the asyncio API (see async_read_files and
+    DicomSeries.aget_pixel_array). Await the job to get its result, or
+    iterate over it with "async for" to get (phase, fraction) progress
+    tuples while it runs; the iteration ends when the job is done. The
+    job is started when it is first awaited or iterated over, and can be
+    cancelled with cancel() or by cancelling the task that awaits it.
+
+    The func is a coroutine function that is called with a callback
+    to report progress tuples.
+    """
+
+    def __init__(self, func):
+        self._func = func
+        self._task = None
+        self._queue = None
+
+    def _start(self):
+        """ _start()
+        Start the job, if it was not started yet, and return its task.
+        """
+        if self._task is None:
+            import asyncio
+            self._queue = asyncio.Queue()
+            self._task = asyncio.ensure_future(
+                self._func(self._queue.put_nowait))
+            self._task.add_done_callback(
+                lambda task: self._queue.put_nowait(None))
+        return self._task
+
+    def __await__(self):
+        return self._start().__await__()
+
+    def __aiter__(self):
+        self._start()
+        return self
+
+    async def __anext__(self):
+        progress = await self._queue.get()
+        if progress is None:
+            # Done, raise the error of the job, if any
+            self._queue.put_nowait(None)
+            self._task.result()
+            raise StopAsyncIteration
+        return progress
+
+    def cancel(self):
+        """ cancel()
+        Cancel the job. Returns False if it was not started or is done.
+        """
+        if self._task is None:
+            return False
+        return self._task.cancel()
+
+    def done(self):
+        """ done()
+        Whether the job is done (or cancelled).
+        """
+        return self._task is not None and self._task.done()
+
+
+def _asyncProgressCallback(loop, report, cancelled):
+    """ _asyncProgressCallback(loop, report, cancelled)
+    Get a progress callback (as for read_files) that can be called from
+    any thread, and reports (phase, fraction) tuples in the event loop.
+    The callback raises CancelledError once the cancelled event is set,
+    to stop the work that calls it.
+    """
+    phase = ['']
+
+    def showProgress(progress):
+        if cancelled.is_set():
+            raise CancelledError()
+        if isinstance(progress, compat.string_types):
+            phase[0] = progress
+            progress = 0.0
+        elif progress is None:
+            progress = 1.0
+        loop.call_soon_threadsafe(report, (phase[0], float(progress)))
+
+    return showProgress
+
+
+def _getRunningLoop():
+    """ _getRunningLoop()
+    Get the event loop of the running coroutine. Inside a coroutine,
+    get_event_loop() returns that loop on Python 3.6, which lacks
+    get_running_loop().
+    """
+    import asyncio
+    if sys.version_info < (3, 7):
+        return asyncio.get_event_loop()
+    return asyncio.get_running_loop()
 
-    # Split series if necessary
-    for serie in reversed([serie for serie in series]):
-        _splitSerieIfRequired(serie, series)
 
-    # Finish all series
-    showProgress('Analysing series')
-    series_ = []
-    for i in range(len(series)):
+def _runBlocking(func):
+    """ _runBlocking(func)
+    Get a coroutine function for AsyncJob, that calls func with a
+    progress callback (see _asyncProgressCallback) in the default
+    executor of the event loop.
+    """
+    import asyncio
+
+    async def run(report):
+        loop = _getRunningLoop()
+        cancelled = threading.Event()
+        showProgress = _asyncProgressCallback(loop, report, cancelled)
         try:
-            series[i]._finish()
-            series_.append(series[i])
-        except Exception:
-            pass  # Skip serie (probably report-like file without pixels)
-        showProgress(float(i + 1) / len(series))
-    showProgress(None)
+            return await loop.run_in_executor(None, func, showProgress)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
 
-    return series_
+    return run
 
 
 class DicomSeries(object):
@@ -442,7 +2990,7 @@ class DicomSeries(object):
 
     def __init__(self, suid, showProgress):
         # Init dataset list and the callback
-        self._datasets = Sequence()
+        self._datasets = []
         self._showProgress = showProgress
 
         # Init props
@@ -450,6 +2998,7 @@ class DicomSeries(object):
         self._info = None
         self._shape = None
         self._sampling = None
+        self._timing = None
 
     @property
     def suid(self):
@@ -465,13 +3014,33 @@ class DicomSeries(object):
     @property
     def sampling(self):
         """ The sampling (voxel distances) of the data (dz, dy, dx).
-        If None, the serie contains a single dicom file. """
+        If None, the serie contains a single dicom file. For a 4D
+        series, this is the spatial sampling (see timing). """
         return self._sampling
 
+    @property
+    def timing(self):
+        """ For a 4D series (t, z, y, x), a structured array with the
+        timing of each time frame, taken from its first slice: the field
+        Time holds the value by which the slices were grouped, the fields
+        TemporalPositionIndex, TriggerTime, FrameReferenceTime and
+        ActualFrameDuration the tags of that slice (NaN if absent).
+        None for other series. """
+        return self._timing
+
+    @property
+    def filenames(self):
+        """ The files of the serie, in slice order. The frames of a
+        multi-frame file share their file, which is listed once. """
+        return list(dict.fromkeys(ds.filename for ds in self._datasets))
+
     @property
     def info(self):
         """ A DataSet instance containing the information as present in the
         first dicomfile of this serie. """
+        if self._info is None and self._shape is not None:
+            # The series was read in header-only mode, load the info now
+            self._info = _readHeader(self._datasets[0])
         return self._info
 
     @property
@@ -512,17 +3081,93 @@ class DicomSeries(object):
         data_len = len(self._datasets)
         return "<DicomSeries with %i images at %s>" % (data_len, adr)
 
-    def get_pixel_array(self):
-        """ get_pixel_array()
+    def get_pixel_array(self, workers=None, executor=None, out=None,
+                        z=None, y=None, x=None, rescale=True, t=None):
+        """ get_pixel_array(workers=None, executor=None, out=None,
+                            z=None, y=None, x=None, rescale=True, t=None)
 
         Get (load) the data that this DicomSeries represents, and return
         it as a numpy array. If this serie contains multiple images, the
-        resulting array is 3D, otherwise it's 2D.
+        resulting array is 3D, otherwise it's 2D. For a 4D series (see
+        read_files) the array is 4D (t, z, y, x); it is allocated at once
+        and all slices of all time frames are loaded in it, and t can be
+        given as a slice object to load only some time frames. The rescale
+        parameters of a lazy result then have the shape (t, z).
 
         If RescaleSlope and RescaleIntercept are present in the dicom info,
         the data is rescaled using these parameters. The data type is chosen
-        depending on the range of the (rescaled) data.
+        for the whole series, depending on the range of the stored values
+        (BitsStored) and the rescale parameters of all slices. The volume
+        is allocated in that dtype and each slice is rescaled as it is
+        loaded, so the volume is never copied. If rescale is False,
+        the stored values are returned. If rescale is 'lazy', a tuple
+        (data, slopes, intercepts) is returned, with the stored values and
+        float arrays with the RescaleSlope and RescaleIntercept of each
+        slice, so that the data is kept at its stored bit depth.
+
+        The slices can be decoded concurrently by giving the number of
+        worker threads, or an executor to use (which is not shut down).
+        The slices are decoded straight into the volume, so the executor
+        must run in this process (e.g. a ThreadPoolExecutor). This scales
+        with the number of cores for compressed transfer syntaxes, because
+        their decoders release the GIL.
+
+        To load series that do not fit in memory, give an array (which can
+        be a np.memmap) of the right shape as out, to load the data in; the
+        data is then converted to the dtype of out, and each slice is
+        rescaled on its own. If out is a filename, a np.memmap is created
+        in that file. Alternatively, iter_slabs() loads the volume in parts.
+
+        To load a region of interest, give slice objects for z, y and/or x.
+        Only the slices in the z range are read and decoded, and they are
+        cropped to the y and x ranges. For native (uncompressed) data,
+        only the rows in the y range are read from the files. Steps can
+        be negative. A single slice is given as slice(i, i + 1); other
+        values than slice objects raise a TypeError.
+
+        If the volume cache is enabled (see set_volume_cache), the result
+        is taken from the cache when the same series and region were
+        loaded before, unless out is given.
+
+        """
 
+        _checkRegion(z=z, y=y, x=x, t=t)
+        return self._getPixelArray(workers, executor, out, z, y, x, rescale,
+                                   t, self._showProgress)
+
+    def aget_pixel_array(self, workers=4, executor=None, out=None, z=None,
+                         y=None, x=None, rescale=True, t=None):
+        """ aget_pixel_array(workers=4, executor=None, out=None, z=None,
+                             y=None, x=None, rescale=True, t=None)
+
+        Asynchronous variant of get_pixel_array, for use in asyncio code.
+        Returns an AsyncJob: await it to get the array, or iterate over it
+        with "async for" to get (phase, fraction) progress tuples while
+        the data is loaded. The slices are decoded by the given executor,
+        or by a ThreadPoolExecutor with the given number of workers, which
+        limits the number of concurrent reads. When the job is cancelled,
+        no more slices are decoded. The other arguments are as for
+        get_pixel_array.
+        """
+        _checkRegion(z=z, y=y, x=x, t=t)
+
+        def load(showProgress):
+            ownExecutor = executor is None
+            pool = ThreadPoolExecutor(workers) if ownExecutor else executor
+            try:
+                return self._getPixelArray(None, pool, out, z, y, x, rescale,
+                                           t, showProgress)
+            finally:
+                if ownExecutor:
+                    pool.shutdown()
+
+        return AsyncJob(_runBlocking(load))
+
+    def _getPixelArray(self, workers, executor, out, z, y, x, rescale, t,
+                       showProgress):
+        """ _getPixelArray(workers, executor, out, z, y, x, rescale, t,
+                           showProgress)
+        Get the data for get_pixel_array(), using the volume cache.
         """
 
         # Can we do this?
@@ -530,54 +3175,216 @@ class DicomSeries(object):
             msg = "The Numpy package is required to use get_pixel_array.\n"
             raise ImportError(msg)
 
+        # Use the volume cache? (not when loading into a given array)
+        cache = _volumeCache
+        if cache is None or out is not None or len(self._datasets) == 0:
+            return self._loadPixelArray(workers, executor, out, z, y, x,
+                                        rescale, t, showProgress)
+        key = (self._suid, tuple((ds.filename, _getFrameIndex(ds))
+                                 for ds in self._datasets),
+               _sliceKey(z), _sliceKey(y), _sliceKey(x), rescale,
+               _sliceKey(t))
+        t0 = time.perf_counter() if _metricsHooks else 0.0
+        vol = cache.get(key)
+        if _metricsHooks:
+            _emitEvent('cache', time.perf_counter() - t0,
+                       hit=vol is not None, hits=cache.hits,
+                       misses=cache.misses, nbytes=cache.nbytes)
+        if vol is None:
+            vol = self._loadPixelArray(workers, executor, None, z, y, x,
+                                       rescale, t, showProgress)
+            cache.put(key, vol)
+        return vol
+
+    def _getSliceIndices(self, z=None, t=None):
+        """ _getSliceIndices(z=None, t=None)
+        Get the indices of the datasets in the region of interest, and the
+        shape of the leading (t, z) or (z,) dimensions of the volume.
+        """
+        if self._timing is None:
+            indices = range(len(self._datasets))
+            if z is not None:
+                indices = indices[z]
+            return list(indices), (len(indices),)
+        nt, nz = self._shape[:2]
+        ts, zs = range(nt), range(nz)
+        if t is not None:
+            ts = ts[t]
+        if z is not None:
+            zs = zs[z]
+        return [ti * nz + zi for ti in ts for zi in zs], (len(ts), len(zs))
+
+    def _loadPixelArray(self, workers, executor, out, z, y, x, rescale,
+                        t=None, showProgress=None):
+        """ _loadPixelArray(workers, executor, out, z, y, x, rescale,
+                            t=None, showProgress=None)
+        Load the data for get_pixel_array(), without using the cache.
+        The progress is shown with the callback of the series, unless
+        another callback is given.
+        """
+
         # It's easy if no file or if just a single file
         if len(self._datasets) == 0:
             raise ValueError('Serie does not contain any files.')
         elif len(self._datasets) == 1:
-            ds = self._datasets[0]
-            slice = _getPixelDataFromDataset(ds)
-            return slice
+            stats = _DecodeStats() if _metricsHooks else None
+            ds = _completeDataset(self._datasets[0])
+            slopes, offsets = _getRescale([ds])
+            slice = _getTimedPixelData(ds, None, y, x, stats)
+            if stats is not None:
+                stats.emit(slice)
+            if rescale == 'lazy' or not rescale:
+                vol = slice
+                if out is not None:
+                    vol = _prepareOutput(out, slice.shape, slice.dtype)
+                    vol[...] = slice
+                return (vol, slopes, offsets) if rescale == 'lazy' else vol
+            elif out is None:
+                dtype = _getRescaleDtype(ds, slice.dtype, slopes, offsets)
+                return _applyTimedRescale(slice, slopes, offsets, dtype)
+            vol = _prepareOutput(out, slice.shape, slice.dtype)
+            _fillSlice(vol, slice, slopes, offsets)
+            return vol
 
         # Check info
-        if self.info is None:
+        if self._shape is None:
             raise RuntimeError("Cannot return volume if series not finished.")
 
         # Set callback to update progress
-        showProgress = self._showProgress
+        if showProgress is None:
+            showProgress = self._showProgress
+
+        # Get the slices in the region of interest
+        indices, leadingShape = self._getSliceIndices(z, t)
+        if len(indices) == 0:
+            raise ValueError('The region of interest is empty.')
+        stats = _DecodeStats() if _metricsHooks else None
+        datasets = [_completeDataset(self._datasets[i]) for i in indices]
+        slopes, offsets = _getRescale(datasets)
 
         # Init data (using what the dicom packaged produces as a reference)
-        ds = self._datasets[0]
-        slice = _getPixelDataFromDataset(ds)
+        ds = datasets[0]
+        slice = _getTimedPixelData(ds, None, y, x, stats)
+        shape = (len(datasets),) + slice.shape
         # vol = Aarray(self.shape, self.sampling, fill=0, dtype=slice.dtype)
-        vol = np.zeros(self.shape, dtype=slice.dtype)
-        vol[0] = slice
+        # (all slices are filled, so there is no need to zero the volume)
+        dtype = _getRescaleDtype(ds, slice.dtype, slopes, offsets)
+        rescaleSlices = rescale is True and (out is not None or
+                                             dtype != slice.dtype)
+        if rescaleSlices:
+            # Rescale each slice in the dtype of out (or the rescale
+            # dtype), so that the volume needs no second copy
+            vol = _prepareOutput(out, leadingShape + slice.shape, dtype)
+            fillRescale = slopes, offsets
+        else:
+            # Load the stored values, these are rescaled afterwards in
+            # place, as the dtype does not change
+            vol = _prepareOutput(out, leadingShape + slice.shape,
+                                 slice.dtype)
+            fillRescale = None, None
+        volume = vol
+        if vol.ndim != len(shape):
+            # A 4D volume is filled as a 3D volume of all its slices
+            if not vol.flags.c_contiguous:
+                raise ValueError('The out array must be C-contiguous.')
+            vol = vol.reshape(shape)
+        _fillSlice(vol[0], slice, *fillRescale)
 
         # Fill volume
         showProgress('Loading data:')
-        ll = self.shape[0]
-        for z in range(1, ll):
-            ds = self._datasets[z]
-            vol[z] = _getPixelDataFromDataset(ds)
-            showProgress(float(z) / ll)
+        _fillVolume(vol, datasets, showProgress, workers, executor, 1, y, x,
+                    *fillRescale, stats=stats)
 
         # Finish
         showProgress(None)
+        if stats is not None:
+            stats.emit(vol)
+
+        # Rescale
+        if rescale and rescale != 'lazy' and not rescaleSlices:
+            vol = _applyTimedRescale(vol, slopes, offsets, dtype)
+
+        # Make a 4D volume
+        if len(leadingShape) > 1:
+            if out is not None:
+                vol = volume
+            else:
+                vol = vol.reshape(leadingShape + slice.shape)
+            slopes = slopes.reshape(leadingShape)
+            offsets = offsets.reshape(leadingShape)
+        if rescale == 'lazy':
+            vol = vol, slopes, offsets
 
         # Done
         gc.collect()
         return vol
 
+    def iter_slabs(self, n, workers=None, executor=None, rescale=True):
+        """ iter_slabs(n, workers=None, executor=None, rescale=True)
+
+        Generator that loads the data in slabs of (at most) n slices, and
+        yields (z, slab) tuples, with z the index of the first slice of
+        the slab. This allows processing series that do not fit in memory.
+        The slabs have the dtype of the array returned by get_pixel_array.
+        For a single image, a single slab of one slice is yielded. The
+        workers, executor and rescale are as for get_pixel_array; with
+        rescale='lazy' the slab is a (data, slopes, intercepts) tuple.
+        For a 4D series, the slabs are taken from the slices of all time
+        frames, one time frame after the other.
+
+        """
+
+        # Can we do this?
+        if not have_numpy:
+            msg = "The Numpy package is required to use iter_slabs.\n"
+            raise ImportError(msg)
+        if len(self._datasets) == 0:
+            raise ValueError('Serie does not contain any files.')
+        elif len(self._datasets) > 1 and self._shape is None:
+            raise RuntimeError("Cannot return volume if series not finished.")
+        n = max(1, int(n))
+
+        # The first slice and the rescale parameters determine the dtype
+        datasets = [_completeDataset(ds) for ds in self._datasets]
+        slopes, offsets = _getRescale(datasets)
+        stats = _DecodeStats() if _metricsHooks else None
+        slice = _getTimedPixelData(datasets[0], stats=stats)
+        dtype = _getRescaleDtype(datasets[0], slice.dtype, slopes, offsets)
+
+        ll = len(datasets)
+        for z in range(0, ll, n):
+            slab = np.empty((len(datasets[z:z + n]),) + slice.shape,
+                            slice.dtype)
+            start = 0
+            if z == 0:
+                slab[0] = slice
+                start = 1
+            elif stats is not None:
+                stats = _DecodeStats()
+            _fillVolume(slab, datasets[z:z + n], _dummyProgressCallback,
+                        workers, executor, start, stats=stats)
+            if stats is not None:
+                stats.emit(slab)
+            if rescale == 'lazy':
+                slab = slab, slopes[z:z + n], offsets[z:z + n]
+            elif rescale:
+                slab = _applyTimedRescale(
+                    slab, slopes[z:z + n], offsets[z:z + n], dtype)
+            yield z, slab
+
     def _append(self, dcm):
         """ _append(dcm)
-        Append a dicomfile (as a pydicom.dataset.FileDataset) to the series.
+        Append a dicomfile (as a pydicom.dataset.FileDataset, or as a
+        SliceRecord) to the series.
         """
         self._datasets.append(dcm)
 
     def _sort(self):
         """ sort()
-        Sort the datasets by instance number.
+        Sort the datasets by instance number (and frame index).
         """
-        self._datasets._list.sort(key=lambda k: k.InstanceNumber)
+        self._datasets.sort(key=lambda k: (k.InstanceNumber,
+                                           _getFrameIndex(k)))
 
     def _finish(self):
         """ _finish()
@@ -593,88 +3400,359 @@ class DicomSeries(object):
           * that the dimensions of all images match
           * that the pixel spacing of all images match
 
+        The slice distance is measured along the normal of the image plane.
+
         """
 
-        # The datasets list should be sorted by instance number
+        # The datasets list should be sorted (see _splitSerieIfRequired)
         L = self._datasets
         if len(L) == 0:
             return
         elif len(L) < 2:
             # Set attributes
             ds = self._datasets[0]
-            self._info = self._datasets[0]
+            if not _isHeaderOnly(ds):
+                self._info = ds
             self._shape = [ds.Rows, ds.Columns]
             self._sampling = [
                 float(ds.PixelSpacing[0]), float(ds.PixelSpacing[1])
             ]
             return
 
-        # Get previous
-        ds1 = L[0]
+        # Get the sizes and samplings of all slices at once
+        dimensions = np.array([(ds.Rows, ds.Columns) for ds in L])
+        samplings = np.array([[float(v) for v in ds.PixelSpacing[:2]]
+                              for ds in L])
+        if np.any(dimensions != dimensions[0]):
+            # We cannot produce a volume if the dimensions match
+            raise ValueError('Dimensions of slices does not match.')
+        if np.any(samplings != samplings[0]):
+            # We can still produce a volume, but we should notify the user
+            msg = 'Warning: sampling does not match.'
+            if self._showProgress is _progressCallback:
+                _progressBar.PrintMessage(msg)
+            else:
+                print(msg)
+
+        # Get the distances between the slices along the normal (of the
+        # first time frame of a 4D series)
+        nz = len(L)
+        if self._timing is not None:
+            nz = len(L) // len(self._timing)
+        positions = _getPositions(L[:nz])
+        if positions is None:
+            raise ValueError('Slices do not have ImagePositionPatient.')
+        projections = positions.dot(_getSliceNormal(L[0]))
+        distances = np.abs(np.diff(projections))
 
-        # Init measures to calculate average of
-        distance_sum = 0.0
+        # Create new dataset by making a deep copy of the first
+        # (in header-only mode, the info is read when it is needed)
+        info = None
+        firstDs = self._datasets[0]
+        if not _isHeaderOnly(firstDs):
+            info = pydicom.dataset.Dataset()
+            for key in firstDs.keys():
+                if key != (0x7fe0, 0x0010):
+                    el = firstDs[key]
+                    info.add_new(el.tag, el.VR, el.value)
 
-        # Init measures to check (these are in 2D)
-        dimensions = ds1.Rows, ds1.Columns
+        # Calculate average distance
+        # (Note that there are nz-1 distances)
+        distance_mean = float(distances.mean()) if nz > 1 else 0.0
 
-        # row, column
-        sampling = float(ds1.PixelSpacing[0]), float(ds1.PixelSpacing[1])
+        # Store information that is specific for the serie
+        ds = L[-1]
+        self._shape = [nz, ds.Rows, ds.Columns]
+        if self._timing is not None:
+            self._shape.insert(0, len(self._timing))
+        self._sampling = [distance_mean, float(ds.PixelSpacing[0]),
+                          float(ds.PixelSpacing[1])]
+
+        # Store
+        self._info = info
 
-        for index in range(len(L)):
-            # The first round ds1 and ds2 will be the same, for the
-            # distance calculation this does not matter
 
-            # Get current
-            ds2 = L[index]
+class SeriesCollection(object):
+    """ SeriesCollection(showProgress=False, readPixelData=False,
+                         force=False, workers=None, backend='thread',
+                         headerOnly=False, tags=None, index=None,
+                         compact=False, temporal=False)
 
-            # Get positions
-            pos1 = float(ds1.ImagePositionPatient[2])
-            pos2 = float(ds2.ImagePositionPatient[2])
+    A collection of DicomSeries that can be updated incrementally, for
+    example while files are being added to a directory. New files are
+    appended to the existing series, and only the series that changed
+    are split and evaluated again. The arguments are as for read_files.
+    Call close() when done, to close the index (if it was given as a
+    filename).
+    """
 
-            # Update distance_sum to calculate distance later
-            distance_sum += abs(pos1 - pos2)
+    def __init__(self, showProgress=False, readPixelData=False, force=False,
+                 workers=None, backend='thread', headerOnly=False, tags=None,
+                 index=None, compact=False, temporal=False):
 
-            # Test measures
-            dimensions2 = ds2.Rows, ds2.Columns
-            sampling2 = float(ds2.PixelSpacing[0]), float(ds2.PixelSpacing[1])
-            if dimensions != dimensions2:
-                # We cannot produce a volume if the dimensions match
-                raise ValueError('Dimensions of slices does not match.')
-            if sampling != sampling2:
-                # We can still produce a volume, but we should notify the user
-                msg = 'Warning: sampling does not match.'
-                if self._showProgress is _progressCallback:
-                    _progressBar.PrintMessage(msg)
-                else:
-                    print(msg)
-            # Store previous
-            ds1 = ds2
+        # Set default progress callback?
+        if showProgress is True:
+            showProgress = _progressCallback
+        if not hasattr(showProgress, '__call__'):
+            showProgress = _dummyProgressCallback
+        self._showProgress = showProgress
 
-        # Create new dataset by making a deep copy of the first
-        info = pydicom.dataset.Dataset()
-        firstDs = self._datasets[0]
-        for key in firstDs.keys():
-            if key != (0x7fe0, 0x0010):
-                el = firstDs[key]
-                info.add_new(el.tag, el.VR, el.value)
+        # Set defer size
+        self._deferSize = 16383  # 128**2-1
+        if readPixelData:
+            self._deferSize = None
+
+        # Set the tags to read in header-only mode
+        self._tags = None
+        if headerOnly or index is not None or compact:
+            self._tags = discoveryTags + list(tags or [])
+
+        # Open the persistent index?
+        self._closeIndex = isinstance(index, compat.string_types)
+        if self._closeIndex:
+            from pydicom_ext.SeriesIndexUtils import SeriesIndex
+            index = SeriesIndex(index)
+        self._index = index
+
+        self._force = force
+        self._workers = workers
+        self._backend = backend
+        self._compact = compact
+        self._temporal = temporal
+
+        # All files of a suid are gathered in a single DicomSeries, which
+        # is split in one or more finished series
+        self._files = set()
+        self._groups = {}
+
+        # The directories that were listed (see _listFiles), and the files
+        # that could not be read, which are tried again on the next update
+        self._listed = {}
+        self._retry = set()
+        self._series = {}
 
-        # Finish calculating average distance
-        # (Note that there are len(L)-1 distances)
-        distance_mean = distance_sum / (len(L) - 1)
+    @property
+    def series(self):
+        """ The list of finished DicomSeries, sorted by suid. """
+        series = []
+        for suid in sorted(self._series):
+            series.extend(self._series[suid])
+        return series
 
-        # Store information that is specific for the serie
-        self._shape = [len(L), ds2.Rows, ds2.Columns]
-        self._sampling = [distance_mean, float(ds2.PixelSpacing[0]),
-                          float(ds2.PixelSpacing[1])]
+    @property
+    def files(self):
+        """ The set of files (absolute paths) that have been processed. """
+        return self._files
 
-        # Store
-        self._info = info
+    def close(self):
+        """ close()
+        Close the index, if it was opened by this collection.
+        """
+        if self._closeIndex and self._index is not None:
+            self._index.close()
+            self._index = None
 
+    def update(self, path):
+        """ update(path)
 
-if __name__ == '__main__':
-    import sys
+        Add the dicom files in path (a directory or a list of files or
+        directories) to the collection. Files that were added before are
+        skipped, files that could not be read are tried again on the next
+        update. Returns the list of new or changed series, sorted by suid.
+        """
+        showProgress = self._showProgress
 
+        # Get the new files
+        files, nfiles = self._getNewFiles(path)
+
+        # Use the persistent index?
+        if self._index is None:
+            results = _iterReadFiles(files, self._deferSize, self._force,
+                                     self._workers, self._backend, self._tags)
+        else:
+            results = _iterIndexedReadFiles(files, self._index, self._force,
+                                            self._workers, self._backend,
+                                            self._tags)
+
+        # Gather file data and put in DicomSeries
+        changed = set()
+        count = 0
+        bytesRead = 0
+        t0 = time.perf_counter()
+        showProgress('Loading series information:')
+        for filename, (dcm, why) in zip(files, results):
+            if _metricsHooks:
+                bytesRead += _getHeaderSize(dcm)
+
+            # Register the file with an existing or new series object
+            suid = self._add(filename, dcm, why)
+            if suid is None:
+                continue  # skipped or some other kind of dicom file
+            changed.add(suid)
+
+            # Show progress (note that we always start with a 0.0)
+            showProgress(float(count) / nfiles)
+            count += 1
+
+        # Finish progress
+        showProgress(None)
+        if _metricsHooks:
+            _emitScanEvent(t0, len(files), bytesRead)
+
+        return self._assemble(changed)
+
+    def add_results(self, results):
+        """ add_results(results)
+
+        Add the results of reading files elsewhere, for example in other
+        processes or on other machines (see ScanUtils.merge_shards): an
+        iterable of (filename, dcm, message) tuples, with dcm and message
+        as obtained for a file by update() (dcm is None for a skipped
+        file). Files that were added before are skipped. To get the same
+        series as update(), the results should be in the order in which
+        update() would read the files. Returns the list of new or changed
+        series, sorted by suid.
+        """
+        changed = set()
+        for filename, dcm, why in results:
+            path = os.path.abspath(filename)
+            if path in self._files:
+                continue
+            self._files.add(path)
+            suid = self._add(filename, dcm, why)
+            if suid is not None:
+                changed.add(suid)
+        return self._assemble(changed)
+
+    def _getNewFiles(self, path):
+        """ _getNewFiles(path)
+        Get the files in path that were not added before, and register
+        them as added. Returns the list of these files, without DICOMDIR
+        files, and the number of new files (including DICOMDIR files).
+        Only the directories that changed since the previous update are
+        listed again.
+        """
+        files = _gatherFiles(path, self._listed)
+        retry = self._retry.difference(os.path.abspath(filename)
+                                       for filename in files)
+        files.extend(sorted(filename for filename in retry
+                            if os.path.isfile(filename)))
+        self._retry.clear()
+        files = [filename for filename in files
+                 if os.path.abspath(filename) not in self._files]
+        self._files.update(os.path.abspath(filename) for filename in files)
+        nfiles = len(files)
+        files = [filename for filename in files
+                 if not filename.count("DICOMDIR")]
+        return files, nfiles
+
+    def _add(self, filename, dcm, why):
+        """ _add(filename, dcm, why)
+        Add the result (dcm, why) of reading the file (see _readFile).
+        Returns the SUID of the series the dataset was appended to, or
+        None if the file was skipped.
+        """
+
+        # A handle of a previous version of the file reads stale data
+        if _fileHandles is not None:
+            _fileHandles.discard(filename)
+
+        # Skip files that could not be loaded
+        if dcm is None:
+            if why is None:
+                return None  # skip non-dicom file
+            # Try again on the next update (the file may be incomplete)
+            self._files.discard(os.path.abspath(filename))
+            self._retry.add(os.path.abspath(filename))
+            if self._showProgress is _progressCallback:
+                _progressBar.PrintMessage(why)
+            else:
+                print('Warning:', why)
+            return None
+
+        return self._append(dcm)
+
+    def _append(self, dcm):
+        """ _append(dcm)
+        Append the dataset to the series object of its SUID, or a
+        FrameRecord for each frame of an enhanced multi-frame dataset.
+        Returns the SUID, or None if the dataset has no SUID.
+        """
+        try:
+            suid = dcm.SeriesInstanceUID
+        except AttributeError:
+            return None
+        if suid not in self._groups:
+            self._groups[suid] = DicomSeries(suid, self._showProgress)
+
+        # Enhanced multi-frame datasets are split into their frames
+        records = _getFrameRecords(dcm)
+        if records is not None:
+            for record in records:
+                self._groups[suid]._append(record)
+            return suid
+
+        if self._compact:
+            dcm = SliceRecord(dcm)
+        self._groups[suid]._append(dcm)
+        return suid
+
+    def _assemble(self, changed):
+        """ _assemble(changed)
+        Split and finish the series with the given SUIDs. Returns the
+        list of resulting series, sorted by suid.
+        """
+        showProgress = self._showProgress
+
+        # Split the changed series if necessary, sort so that the
+        # order is deterministic
+        t0 = time.perf_counter()
+        series = []
+        for suid in sorted(changed):
+            group = self._groups[suid]
+            serie = _getTemporalSerie(group) if self._temporal else None
+            if serie is not None:
+                self._series[suid] = [serie]
+            else:
+                self._series[suid] = _splitSerieIfRequired(group)
+            series.extend(self._series[suid])
+        if _metricsHooks:
+            _emitEvent('split', time.perf_counter() - t0,
+                       groups=len(changed), series=len(series))
+
+        # Finish the changed series
+        t0 = time.perf_counter()
+        showProgress('Analysing series')
+        series_ = []
+        for i in range(len(series)):
+            try:
+                series[i]._finish()
+                series_.append(series[i])
+            except Exception:
+                # Skip serie (probably report-like file without pixels)
+                self._series[series[i].suid].remove(series[i])
+            showProgress(float(i + 1) / len(series))
+        showProgress(None)
+        if _metricsHooks:
+            _emitEvent('finish', time.perf_counter() - t0,
+                       series=len(series_))
+
+        return series_
+
+    def watch(self, path, interval=1.0):
+        """ watch(path, interval=1.0)
+        Generator that polls the directory path every interval seconds,
+        and yields the list of new or changed series whenever new files
+        have been added.
+        """
+        while True:
+            series = self.update(path)
+            if series:
+                yield series
+            time.sleep(interval)
+
+
+if __name__ == '__main__':
     if len(sys.argv) != 2:
         print("Expected a single argument: a directory with dicom files in it")
     else:
@@ -26,5 +26,10 @@ setup(
     keywords='dicom python medical imaging',
     packages=find_packages(),
     install_requires=REQUIRES,
+    entry_points={
+        'console_scripts': [
+            'pydicom_ext_scan = pydicom_ext.ScanUtils:main',
+        ],
+    },
     classifiers=CLASSIFIERS,
 )
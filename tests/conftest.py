@@ -0,0 +1,34 @@
+import pytest
+from pydicom_ext import BenchmarkUtils
+
+SHAPE = (6, 16, 16)
+
+
+def _generate(tmp_path_factory, layout, **kwargs):
+    root = str(tmp_path_factory.mktemp(layout))
+    BenchmarkUtils.generate_series(root, layout, shape=SHAPE, **kwargs)
+    return root
+
+
+@pytest.fixture(scope='session')
+def multi_file(tmp_path_factory):
+    """ a directory with a series of a file per slice """
+    return _generate(tmp_path_factory, 'multi_file')
+
+
+@pytest.fixture(scope='session')
+def multi_series(tmp_path_factory):
+    """ a directory with three series of a file per slice """
+    return _generate(tmp_path_factory, 'multi_series', n_series=3)
+
+
+@pytest.fixture(scope='session')
+def gated(tmp_path_factory):
+    """ a directory with a series of four time frames of a file per slice """
+    return _generate(tmp_path_factory, 'gated', n_frames=4)
+
+
+@pytest.fixture(scope='session')
+def multi_file_rle(tmp_path_factory):
+    """ the multi_file series, with RLE Lossless pixel data """
+    return _generate(tmp_path_factory, 'multi_file', rle_lossless=True)
@@ -0,0 +1,791 @@
+import os
+import shutil
+import struct
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pydicom
+import pytest
+from pydicom.dataset import Dataset, FileDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import ExplicitVRLittleEndian, RLELossless, generate_uid
+from pydicom_ext import pydicom_series
+
+
+def _assert_same_series(series, expected):
+    assert [s.suid for s in series] == [s.suid for s in expected]
+    for s, e in zip(series, expected):
+        assert s.shape == e.shape
+        assert s.sampling == e.sampling
+        assert s.filenames == e.filenames
+        np.testing.assert_array_equal(s.get_pixel_array(),
+                                      e.get_pixel_array())
+
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_workers_match_sequential(multi_series, backend):
+    expected = pydicom_series.read_files(multi_series)
+    assert len(expected) == 3
+    series = pydicom_series.read_files(multi_series, workers=3,
+                                       backend=backend)
+    _assert_same_series(series, expected)
+
+
+def test_workers_match_sequential_header_only(multi_series):
+    expected = pydicom_series.read_files(multi_series, headerOnly=True)
+    series = pydicom_series.read_files(multi_series, workers=3,
+                                       headerOnly=True)
+    _assert_same_series(series, expected)
+
+
+def test_workers_report_progress(multi_series):
+    progress = []
+    pydicom_series.read_files(multi_series, progress.append, workers=3)
+    # Each phase starts with a string and ends with None
+    assert isinstance(progress[0], str)
+    assert progress[-1] is None
+    phase = []
+    for p in progress[1:]:
+        if isinstance(p, float):
+            phase.append(p)
+        else:
+            assert phase == sorted(phase)
+            phase = []
+
+
+def test_workers_read_a_window_of_files(multi_series, monkeypatch):
+    files = pydicom_series.list_files(multi_series)
+    reads = []
+    read_file = pydicom_series._readFile
+
+    def counting_read_file(filename, *args, **kwargs):
+        reads.append(filename)
+        return read_file(filename, *args, **kwargs)
+
+    monkeypatch.setattr(pydicom_series, '_readFile', counting_read_file)
+    results = pydicom_series.read_headers(files, workers=2)
+    # At most two files per worker are read before the first is consumed
+    dcm, why = next(results)
+    assert dcm.filename == files[0]
+    assert len(reads) <= 4
+    assert [dcm.filename for dcm, why in results] == files[1:]
+    assert sorted(reads) == sorted(files)
+
+
+def _copy(files, root):
+    for filename in files:
+        shutil.copy(filename, root)
+
+
+def test_update_is_incremental(multi_series, tmp_path):
+    files = pydicom_series.list_files(multi_series)
+    first = sorted(f for f in files if '_000_' in os.path.basename(f))
+    second = sorted(f for f in files if '_001_' in os.path.basename(f))
+    inbox = str(tmp_path)
+    collection = pydicom_series.SeriesCollection(headerOnly=True)
+
+    # A partial series
+    _copy(first[:3], inbox)
+    changed = collection.update(inbox)
+    assert len(changed) == 1
+    assert changed[0].shape[0] == 3
+    serie = changed[0]
+
+    # Another series does not change the first one
+    _copy(second, inbox)
+    changed = collection.update(inbox)
+    assert len(changed) == 1
+    assert changed[0].suid != serie.suid
+    assert serie in collection.series
+    assert len(collection.series) == 2
+
+    # The rest of the first series is appended to it, in a new series
+    # object (the one handed out before does not change)
+    _copy(first[3:], inbox)
+    changed = collection.update(inbox)
+    assert [s.suid for s in changed] == [serie.suid]
+    assert changed[0].shape[0] == len(first)
+    assert len(serie.filenames) == 3
+    assert serie.get_pixel_array().shape[0] == 3
+
+    # Nothing new
+    assert collection.update(inbox) == []
+    _assert_same_series(collection.series,
+                        pydicom_series.read_files(inbox, headerOnly=True))
+
+
+def _record(kind, children=(), **tags):
+    record = Dataset()
+    record.OffsetOfTheNextDirectoryRecord = 0
+    record.OffsetOfReferencedLowerLevelDirectoryEntity = 0
+    record.DirectoryRecordType = kind
+    for tag, value in tags.items():
+        setattr(record, tag, value)
+    return record, list(children)
+
+
+def _write_dicomdir(root, positions=True, preamble=b'\0' * 128):
+    """ write a DICOMDIR in root for the files in its subdirectories, with
+    or without the ImagePositionPatient in the image records. The records
+    are written twice, the second time with the offsets of the first. """
+    images = {}
+    files = pydicom_series.list_files(root)
+    for filename, (dcm, why) in zip(files,
+                                    pydicom_series.read_headers(files)):
+        tags = {'ReferencedFileID': os.path.relpath(filename,
+                                                    root).split(os.sep),
+                'InstanceNumber': dcm.InstanceNumber}
+        if positions:
+            tags['ImagePositionPatient'] = dcm.ImagePositionPatient
+        images.setdefault(dcm.SeriesInstanceUID,
+                          []).append(_record('IMAGE', **tags))
+    study = _record('STUDY', [_record('SERIES', images[suid],
+                                      SeriesInstanceUID=suid)
+                              for suid in sorted(images)],
+                    StudyInstanceUID=generate_uid())
+    patient = _record('PATIENT', [study], PatientID='1')
+
+    # Flatten the tree, with the links to the next and the first child
+    records = []
+    links = []
+
+    def add(siblings):
+        indices = []
+        for record, children in siblings:
+            indices.append(len(records))
+            records.append(record)
+            links.append(None)
+            links[indices[-1]] = [None, add(children)]
+        for index, next_ in zip(indices, indices[1:]):
+            links[index][0] = next_
+        return indices[0] if indices else None
+
+    add([patient])
+    file_meta = Dataset()
+    file_meta.MediaStorageSOPClassUID = '1.2.840.10008.1.3.10'
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    filename = os.path.join(root, 'DICOMDIR')
+    dcm = FileDataset(filename, {}, file_meta=file_meta, preamble=preamble)
+    dcm.is_little_endian = True
+    dcm.is_implicit_VR = False
+    dcm.DirectoryRecordSequence = Sequence(records)
+    dcm.save_as(filename)
+
+    # The offsets are fixed size, so the records stay in place
+    written = pydicom.dcmread(filename, force=True).DirectoryRecordSequence
+    for record, (next_, child) in zip(records, links):
+        if next_ is not None:
+            record.OffsetOfTheNextDirectoryRecord = \
+                written[next_].seq_item_tell
+        if child is not None:
+            record.OffsetOfReferencedLowerLevelDirectoryEntity = \
+                written[child].seq_item_tell
+    dcm.save_as(filename)
+    return filename
+
+
+@pytest.fixture
+def dicomdir_root(multi_series, tmp_path):
+    """ a copy of the multi_series tree, in a subdirectory of root """
+    root = str(tmp_path / 'root')
+    shutil.copytree(multi_series, os.path.join(root, 'IMAGES'))
+    return root
+
+
+@pytest.mark.parametrize('positions', [False, True])
+def test_dicomdir_matches_read_files(dicomdir_root, positions):
+    expected = pydicom_series.read_files(
+        os.path.join(dicomdir_root, 'IMAGES'), headerOnly=True)
+    filename = _write_dicomdir(dicomdir_root, positions)
+    progress = []
+    series = pydicom_series.read_dicomdir(filename, progress.append)
+    _assert_same_series(series, expected)
+    assert 'Loading series information:' in progress
+    assert progress[-1] is None
+
+
+def test_dicomdir_force(dicomdir_root):
+    expected = pydicom_series.read_files(
+        os.path.join(dicomdir_root, 'IMAGES'), headerOnly=True)
+    filename = _write_dicomdir(dicomdir_root, preamble=None)
+    with pytest.raises(pydicom.filereader.InvalidDicomError):
+        pydicom_series.read_dicomdir(filename)
+    series = pydicom_series.read_dicomdir(filename, force=True)
+    _assert_same_series(series, expected)
+
+    # Other dicom files are no DICOMDIR
+    with pytest.raises(pydicom.filereader.InvalidDicomError):
+        pydicom_series.read_dicomdir(expected[0].filenames[0])
+
+
+def test_update_lists_changed_directories(multi_series, tmp_path,
+                                          monkeypatch):
+    files = pydicom_series.list_files(multi_series)
+    inbox = str(tmp_path / 'inbox')
+    os.makedirs(os.path.join(inbox, 'a'))
+    os.makedirs(os.path.join(inbox, 'b'))
+    _copy(files[:6], os.path.join(inbox, 'a'))
+
+    def age(path):
+        # Directories that changed just now are always listed again
+        t = os.stat(path).st_mtime - 60
+        os.utime(path, (t, t))
+
+    listed = []
+    scan_dir = pydicom_series._scanDir
+
+    def counting_scan_dir(path):
+        listed.append(os.path.relpath(path, inbox))
+        return scan_dir(path)
+
+    monkeypatch.setattr(pydicom_series, '_scanDir', counting_scan_dir)
+    for path in (inbox, os.path.join(inbox, 'a'), os.path.join(inbox, 'b')):
+        age(path)
+    collection = pydicom_series.SeriesCollection(headerOnly=True)
+    assert len(collection.update(inbox)) == 1
+    assert sorted(listed) == ['.', 'a', 'b']
+
+    # Only the directory with new files is listed again
+    del listed[:]
+    assert collection.update(inbox) == []
+    assert listed == []
+    _copy(files[6:12], os.path.join(inbox, 'b'))
+    assert len(collection.update(inbox)) == 1
+    assert listed == ['b']
+
+    # A file that could not be read is tried again, although its
+    # directory did not change
+    age(os.path.join(inbox, 'b'))
+    _copy(files[12:13], os.path.join(inbox, 'b'))
+    age(os.path.join(inbox, 'b'))
+    read_file = pydicom_series._readFile
+    monkeypatch.setattr(pydicom_series, '_readFile',
+                        lambda *args: (None, 'incomplete'))
+    assert collection.update(inbox) == []
+    monkeypatch.setattr(pydicom_series, '_readFile', read_file)
+    del listed[:]
+    changed = collection.update(inbox)
+    assert listed == []
+    assert [len(s.filenames) for s in changed] == [1]
+
+
+def _copy_renumbered(files, root, numbers):
+    for filename, number in zip(files, numbers):
+        dcm = pydicom.read_file(filename)
+        dcm.InstanceNumber = number
+        dcm.save_as(os.path.join(root, os.path.basename(filename)))
+
+
+def test_slices_are_sorted_along_the_normal(multi_file, tmp_path):
+    files = sorted(pydicom_series.list_files(multi_file))
+    expected = pydicom_series.read_files(multi_file)[0].get_pixel_array()
+
+    # The position decides the order, not the instance number
+    numbers = list(range(1, len(files) + 1))
+    numbers[1], numbers[4] = numbers[4], numbers[1]
+    _copy_renumbered(files, str(tmp_path), numbers)
+    series = pydicom_series.read_files(str(tmp_path))
+    assert len(series) == 1
+    assert series[0].sampling == [1.0, 1.0, 1.0]
+    np.testing.assert_array_equal(series[0].get_pixel_array(), expected)
+
+
+def test_slices_follow_the_instance_numbers(multi_file, tmp_path):
+    files = sorted(pydicom_series.list_files(multi_file))
+    expected = pydicom_series.read_files(multi_file)[0].get_pixel_array()
+
+    _copy_renumbered(files, str(tmp_path), range(len(files), 0, -1))
+    series = pydicom_series.read_files(str(tmp_path))
+    np.testing.assert_array_equal(series[0].get_pixel_array(),
+                                  expected[::-1])
+
+
+def test_large_gap_splits_series(multi_file, tmp_path):
+    files = sorted(pydicom_series.list_files(multi_file))
+    _copy(files[:2] + files[4:], str(tmp_path))
+    series = pydicom_series.read_files(str(tmp_path))
+    assert [s.shape for s in series] == [[2, 16, 16], [2, 16, 16]]
+    assert [os.path.basename(f) for s in series for f in s.filenames] == \
+        [os.path.basename(f) for f in files[:2] + files[4:]]
+
+
+def test_missing_slice_does_not_split_series(multi_file, tmp_path, capsys):
+    files = sorted(pydicom_series.list_files(multi_file))
+    _copy(files[:2] + files[3:], str(tmp_path))
+    series = pydicom_series.read_files(str(tmp_path))
+    assert [s.shape for s in series] == [[5, 16, 16]]
+    assert 'Warning' in capsys.readouterr().out
+
+
+def test_gated_series_is_split_per_phase(gated):
+    series = pydicom_series.read_files(gated)
+    assert [s.shape for s in series] == [[6, 16, 16]] * 4
+    volumes = [s.get_pixel_array() for s in series]
+
+    series = pydicom_series.read_files(gated, temporal=True)
+    assert [s.shape for s in series] == [[4, 6, 16, 16]]
+    np.testing.assert_array_equal(series[0].get_pixel_array(),
+                                  np.stack(volumes))
+
+
+@pytest.mark.parametrize('header_only', [False, True])
+def test_gated_series_time_frames(gated, header_only):
+    serie = pydicom_series.read_files(gated, temporal=True,
+                                      headerOnly=header_only)[0]
+    volume = serie.get_pixel_array()
+    np.testing.assert_array_equal(serie.get_pixel_array(t=slice(1, None)),
+                                  volume[1:])
+    np.testing.assert_array_equal(serie.get_pixel_array(t=slice(2, 3)),
+                                  volume[2:3])
+
+    # The time frames are grouped by TemporalPositionIndex, the tags that
+    # the slices lack are NaN (the generated slices have a
+    # FrameReferenceTime of 0)
+    timing = serie.timing
+    assert timing.dtype.names == ('Time', 'TemporalPositionIndex',
+                                  'TriggerTime', 'FrameReferenceTime',
+                                  'ActualFrameDuration')
+    np.testing.assert_array_equal(timing['Time'], [1, 2, 3, 4])
+    np.testing.assert_array_equal(timing['TemporalPositionIndex'],
+                                  [1, 2, 3, 4])
+    np.testing.assert_array_equal(timing['TriggerTime'], [0, 100, 200, 300])
+    np.testing.assert_array_equal(timing['FrameReferenceTime'], [0] * 4)
+    assert np.isnan(timing['ActualFrameDuration']).all()
+
+
+def test_rescale_changes_dtype(multi_file, tmp_path):
+    files = sorted(pydicom_series.list_files(multi_file))
+    expected = []
+    for i, filename in enumerate(files):
+        dcm = pydicom.read_file(filename)
+        dcm.RescaleSlope = 1 + i % 3
+        dcm.RescaleIntercept = -1024
+        dcm.save_as(str(tmp_path / os.path.basename(filename)))
+        expected.append(dcm.pixel_array.astype(np.int64) * (1 + i % 3) -
+                        1024)
+
+    serie = pydicom_series.read_files(str(tmp_path))[0]
+    for workers in (None, 3):
+        volume = serie.get_pixel_array(workers=workers)
+        assert volume.dtype == np.int32
+        np.testing.assert_array_equal(volume, expected)
+    volume = serie.get_pixel_array(z=slice(None, None, -2))
+    np.testing.assert_array_equal(volume, expected[::-2])
+
+
+@pytest.fixture
+def metrics():
+    recorder = pydicom_series.MetricsRecorder()
+    pydicom_series.add_metrics_hook(recorder)
+    yield recorder
+    pydicom_series.remove_metrics_hook(recorder)
+
+
+@pytest.mark.parametrize('header_only', [False, True])
+def test_decode_metrics(multi_file, multi_file_rle, metrics, header_only):
+    # The stored size of the native pixel data is known
+    serie = pydicom_series.read_files(multi_file, headerOnly=header_only)[0]
+    serie.get_pixel_array()
+    decode = metrics.events[-1]
+    assert decode['phase'] == 'decode'
+    assert decode['slices'] == 6
+    assert decode['bytesRead'] == serie.get_pixel_array(rescale=False).nbytes
+
+    # That of encapsulated pixel data of undefined length is only known
+    # once it is read
+    serie = pydicom_series.read_files(multi_file_rle,
+                                      headerOnly=header_only)[0]
+    serie.get_pixel_array()
+    decode = metrics.events[-1]
+    assert decode['slices'] == 6
+    if header_only:
+        assert decode['bytesRead'] == 0
+    else:
+        assert decode['bytesRead'] == sum(len(pydicom.dcmread(f).PixelData)
+                                          for f in serie.filenames)
+
+
+def _rle_test_data(dtype, shape):
+    """ random data with runs of equal values and literal runs """
+    rng = np.random.RandomState(0)
+    info = np.iinfo(dtype)
+    data = rng.randint(info.min, info.max, size=shape, dtype=dtype)
+    data[:, ::3, 20:200] = data[:, ::3, 20:21]
+    return data
+
+
+def _write_rle_file(filename, data, samples=1):
+    """ write the frames of data as an RLE Lossless multi-frame file """
+    file_meta = Dataset()
+    file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.7'
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    file_meta.TransferSyntaxUID = RLELossless
+    dcm = FileDataset(filename, {}, file_meta=file_meta,
+                      preamble=b'\0' * 128)
+    dcm.is_little_endian = True
+    dcm.is_implicit_VR = False
+    dcm.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    dcm.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    dcm.SeriesInstanceUID = generate_uid()
+    dcm.Modality = 'OT'
+    dcm.InstanceNumber = 1
+    dcm.NumberOfFrames = len(data)
+    dcm.PixelSpacing = [1, 1]
+    dcm.ImagePositionPatient = [0, 0, 0]
+    dcm.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    dcm.Rows, dcm.Columns = data.shape[1:3]
+    dcm.SamplesPerPixel = samples
+    if samples == 1:
+        dcm.PhotometricInterpretation = 'MONOCHROME2'
+    else:
+        dcm.PhotometricInterpretation = 'RGB'
+        dcm.PlanarConfiguration = 0
+    dcm.BitsAllocated = dcm.BitsStored = data.dtype.itemsize * 8
+    dcm.HighBit = dcm.BitsStored - 1
+    dcm.PixelRepresentation = int(data.dtype.kind == 'i')
+    frames = pydicom_series.encode_rle(data, samples)
+    dcm.add_new(0x7fe00010, 'OB', pydicom_series.encapsulate_frames(frames))
+    dcm[0x7fe00010].is_undefined_length = True
+    dcm.save_as(filename)
+
+
+@pytest.mark.parametrize('dtype, shape, samples', [
+    (np.uint8, (3, 7, 261), 1),
+    (np.int16, (3, 7, 261), 1),
+    (np.uint16, (3, 7, 261), 1),
+    (np.int32, (3, 7, 261), 1),
+    (np.uint8, (2, 5, 150, 3), 3),
+])
+def test_rle_round_trip(dtype, shape, samples, tmp_path):
+    data = _rle_test_data(dtype, shape)
+    frames = pydicom_series.encode_rle(data, samplesPerPixel=samples)
+    assert len(frames) == len(data)
+    decoded = pydicom_series.decode_rle(frames, shape[1], shape[2],
+                                        data.dtype.itemsize * 8, samples,
+                                        signed=data.dtype.kind == 'i')
+    np.testing.assert_array_equal(decoded, data)
+
+    # The encoded file is valid for pydicom, and for get_pixel_array
+    filename = str(tmp_path / 'rle.dcm')
+    _write_rle_file(filename, data, samples)
+    np.testing.assert_array_equal(pydicom.dcmread(filename).pixel_array,
+                                  data)
+    serie = pydicom_series.read_files([filename])[0]
+    np.testing.assert_array_equal(serie.get_pixel_array(rescale=False),
+                                  data)
+
+
+def test_rle_series_matches_pydicom(multi_file, multi_file_rle):
+    serie = pydicom_series.read_files(multi_file_rle, headerOnly=True)[0]
+    volume = serie.get_pixel_array(rescale=False)
+    for filename, expected in zip(serie.filenames, volume):
+        np.testing.assert_array_equal(pydicom.read_file(filename).pixel_array,
+                                      expected)
+
+    # The same data as without compression
+    np.testing.assert_array_equal(
+        serie.get_pixel_array(),
+        pydicom_series.read_files(multi_file)[0].get_pixel_array())
+
+
+def _item(data):
+    return struct.pack('<HHL', 0xfffe, 0xe000, len(data)) + data
+
+
+def _write_enhanced(filename, data, positions, encoding, per_frame):
+    """ write the frames of data as an enhanced multi-frame file, with the
+    pixel data 'native' or encoded with RLE Lossless ('rle'), without a
+    Basic Offset Table ('rle_no_table') or in two fragments per frame
+    ('rle_fragments'). The pixel measures and plane orientation are in
+    the per-frame or the shared functional groups. """
+    file_meta = Dataset()
+    file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.2.1'
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    file_meta.TransferSyntaxUID = (ExplicitVRLittleEndian
+                                   if encoding == 'native' else RLELossless)
+    dcm = FileDataset(filename, {}, file_meta=file_meta,
+                      preamble=b'\0' * 128)
+    dcm.is_little_endian = True
+    dcm.is_implicit_VR = False
+    dcm.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    dcm.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    dcm.SeriesInstanceUID = generate_uid()
+    dcm.Modality = 'CT'
+    dcm.InstanceNumber = 1
+    dcm.NumberOfFrames = len(data)
+    dcm.Rows, dcm.Columns = data.shape[1:]
+    dcm.SamplesPerPixel = 1
+    dcm.PhotometricInterpretation = 'MONOCHROME2'
+    dcm.BitsAllocated = 16
+    dcm.BitsStored = 12
+    dcm.HighBit = 11
+    dcm.PixelRepresentation = 0
+
+    measures = Dataset()
+    measures.PixelSpacing = [0.5, 0.6]
+    orientation = Dataset()
+    orientation.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    shared = Dataset()
+    if per_frame:
+        # The per-frame groups take precedence over the shared ones
+        other = Dataset()
+        other.PixelSpacing = [1.0, 1.0]
+        shared.PixelMeasuresSequence = Sequence([other])
+    else:
+        shared.PixelMeasuresSequence = Sequence([measures])
+        shared.PlaneOrientationSequence = Sequence([orientation])
+    groups = []
+    for z in positions:
+        group = Dataset()
+        position = Dataset()
+        position.ImagePositionPatient = [0, 0, z]
+        group.PlanePositionSequence = Sequence([position])
+        if per_frame:
+            group.PixelMeasuresSequence = Sequence([measures])
+            group.PlaneOrientationSequence = Sequence([orientation])
+        groups.append(group)
+    dcm.SharedFunctionalGroupsSequence = Sequence([shared])
+    dcm.PerFrameFunctionalGroupsSequence = Sequence(groups)
+
+    if encoding == 'native':
+        dcm.PixelData = data.astype('<u2').tobytes()
+    else:
+        frames = pydicom_series.encode_rle(data)
+        if encoding == 'rle_fragments':
+            frames = [_item(frame[:64]) + _item(frame[64:])
+                      for frame in frames]
+        else:
+            frames = [_item(frame) for frame in frames]
+        table = b''
+        if encoding != 'rle_no_table':
+            table = np.cumsum([0] + [len(frame) for frame in frames[:-1]])
+            table = table.astype('<u4').tobytes()
+        dcm.add_new(0x7fe00010, 'OB', _item(table) + b''.join(frames))
+        dcm[0x7fe00010].is_undefined_length = True
+    dcm.save_as(filename)
+
+
+@pytest.mark.parametrize('encoding', ['native', 'rle', 'rle_no_table',
+                                      'rle_fragments'])
+@pytest.mark.parametrize('per_frame', [False, True])
+@pytest.mark.parametrize('positions', [[0.0, 2.0, 4.0, 6.0, 8.0],
+                                       [8.0, 6.0, 4.0, 2.0, 0.0]])
+def test_enhanced_multi_frame(encoding, per_frame, positions, tmp_path):
+    rng = np.random.RandomState(0)
+    data = rng.randint(0, 4096, (5, 10, 9)).astype(np.uint16)
+    filename = str(tmp_path / 'enhanced.dcm')
+    _write_enhanced(filename, data, positions, encoding, per_frame)
+
+    # pydicom does not decode RLE frames of more than one fragment
+    if encoding != 'rle_fragments':
+        np.testing.assert_array_equal(pydicom.dcmread(filename).pixel_array,
+                                      data)
+
+    # The frames are the slices, in the order of the file
+    for header_only in (False, True):
+        series = pydicom_series.read_files([filename],
+                                           headerOnly=header_only)
+        assert len(series) == 1
+        assert series[0].shape == [5, 10, 9]
+        assert series[0].sampling == [2.0, 0.5, 0.6]
+        np.testing.assert_array_equal(
+            series[0].get_pixel_array(rescale=False), data)
+        np.testing.assert_array_equal(
+            series[0].get_pixel_array(z=slice(3, 0, -2), rescale=False),
+            data[3:0:-2])
+
+
+def _open_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+
+@pytest.fixture
+def handle_pool():
+    """ a file handle pool of two handles, the default is restored """
+    if not os.path.isdir('/proc/self/fd'):
+        pytest.skip('the open file descriptors cannot be counted')
+    yield pydicom_series.set_file_handle_pool(2)
+    pydicom_series.set_file_handle_pool(16)
+
+
+def test_file_handle_pool_with_workers(multi_series, handle_pool):
+    pydicom_series.set_file_handle_pool(None)
+    series = pydicom_series.read_files(multi_series, headerOnly=True)
+    expected = [s.get_pixel_array() for s in series]
+
+    fds = _open_fds()
+    pool = pydicom_series.set_file_handle_pool(2)
+    for s, volume in zip(series, expected):
+        for workers in (None, 4):
+            np.testing.assert_array_equal(s.get_pixel_array(workers=workers),
+                                          volume)
+    assert len(pool) <= 2
+    assert pool.opens > 2
+    assert _open_fds() - fds == len(pool)
+
+    # Setting another pool closes the handles
+    pydicom_series.set_file_handle_pool(16)
+    assert _open_fds() == fds
+
+
+def test_file_handle_pool_reads_with_threads(multi_series, handle_pool):
+    files = pydicom_series.list_files(multi_series)
+    contents = {}
+    for filename in files:
+        with open(filename, 'rb') as f:
+            contents[filename] = f.read()
+    fds = _open_fds()
+    pool = pydicom_series.FileHandlePool(2)
+    reads = [(filename, offset, 97) for filename in files
+             for offset in range(0, len(contents[filename]), 61)]
+
+    def read(args):
+        return pool.read(*args)
+
+    with ThreadPoolExecutor(6) as executor:
+        for (filename, offset, size), data in zip(reads,
+                                                  executor.map(read, reads)):
+            assert data == contents[filename][offset:offset + size]
+    assert len(pool) <= 2
+    pool.clear()
+    assert _open_fds() == fds
+
+
+def test_file_handle_pool_evicts_handles_not_in_use(multi_series,
+                                                    handle_pool):
+    first, second = pydicom_series.list_files(multi_series)[:2]
+    fds = _open_fds()
+    pool = pydicom_series.FileHandlePool(1)
+
+    # A handle that is in use is not evicted
+    entry = pool._acquire(first)
+    assert len(pool.read(second, 0, 16)) == 16
+    assert len(pool) == 1
+    assert _open_fds() == fds + 1
+
+    # A discarded handle is closed when it is released
+    pool.discard(first)
+    assert _open_fds() == fds + 1
+    pool._release(entry)
+    assert len(pool) == 0
+    assert _open_fds() == fds
+
+
+REGIONS = [
+    dict(z=slice(None, None, -1)),
+    dict(z=slice(4, 0, -2), y=slice(None, None, -1)),
+    dict(z=slice(1, None, 2), y=slice(2, 14, 3), x=slice(15, 1, -4)),
+    dict(y=slice(-3, None), x=slice(None, None, -3)),
+    dict(z=slice(2, 3)),
+]
+
+
+@pytest.mark.parametrize('region', REGIONS)
+@pytest.mark.parametrize('header_only', [False, True])
+def test_region_of_interest(multi_file, multi_file_rle, region,
+                            header_only):
+    for root in (multi_file, multi_file_rle):
+        serie = pydicom_series.read_files(root, headerOnly=header_only)[0]
+        volume = serie.get_pixel_array()
+        index = tuple(region.get(axis, slice(None)) for axis in 'zyx')
+        for workers in (None, 3):
+            np.testing.assert_array_equal(
+                serie.get_pixel_array(workers=workers, **region),
+                volume[index])
+
+
+def test_region_of_interest_4d(gated):
+    serie = pydicom_series.read_files(gated, temporal=True)[0]
+    volume = serie.get_pixel_array()
+    np.testing.assert_array_equal(
+        serie.get_pixel_array(t=slice(None, None, -2), z=slice(4, 0, -1),
+                              x=slice(None, None, 2)),
+        volume[::-2, 4:0:-1, :, ::2])
+
+
+@pytest.mark.parametrize('axis', ['z', 'y', 'x', 't'])
+def test_region_of_interest_needs_slices(multi_file, axis):
+    serie = pydicom_series.read_files(multi_file)[0]
+    with pytest.raises(TypeError, match='%s must be a slice' % axis):
+        serie.get_pixel_array(**{axis: 1})
+    with pytest.raises(TypeError, match='%s must be a slice' % axis):
+        serie.aget_pixel_array(**{axis: [0, 1]})
+
+
+@pytest.fixture
+def volume_cache():
+    """ set_volume_cache, the previous cache is restored """
+    previous = pydicom_series.get_volume_cache()
+    yield pydicom_series.set_volume_cache
+    pydicom_series.set_volume_cache(previous)
+
+
+def test_volume_cache_keys(multi_file, volume_cache):
+    cache = volume_cache(1 << 24)
+    serie = pydicom_series.read_files(multi_file)[0]
+    volume = serie.get_pixel_array()
+    assert (cache.hits, cache.misses) == (0, 1)
+    np.testing.assert_array_equal(serie.get_pixel_array(), volume)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Another region or rescale is another entry
+    np.testing.assert_array_equal(serie.get_pixel_array(z=slice(1, 3)),
+                                  volume[1:3])
+    stored = serie.get_pixel_array(rescale=False)
+    assert (cache.hits, cache.misses) == (1, 3)
+    np.testing.assert_array_equal(serie.get_pixel_array(z=slice(1, 3)),
+                                  volume[1:3])
+    np.testing.assert_array_equal(serie.get_pixel_array(rescale=False),
+                                  stored)
+    assert (cache.hits, cache.misses) == (3, 3)
+    assert len(cache) == 3
+    assert cache.nbytes == volume.nbytes + volume[1:3].nbytes + stored.nbytes
+
+    # A series read again has the same key
+    serie = pydicom_series.read_files(multi_file)[0]
+    serie.get_pixel_array()
+    assert (cache.hits, cache.misses) == (4, 3)
+
+
+def test_volume_cache_eviction(multi_series, volume_cache):
+    series = pydicom_series.read_files(multi_series)
+    nbytes = series[0].get_pixel_array().nbytes
+    cache = volume_cache(int(2.5 * nbytes))
+    for s in series:
+        s.get_pixel_array()
+    assert len(cache) == 2
+    assert cache.nbytes == 2 * nbytes
+
+    # The least recently used volume was evicted
+    series[2].get_pixel_array()
+    assert (cache.hits, cache.misses) == (1, 3)
+    series[0].get_pixel_array()
+    assert (cache.hits, cache.misses) == (1, 4)
+
+    # Volumes larger than the budget are not cached
+    cache = volume_cache(nbytes - 1)
+    series[0].get_pixel_array()
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+def test_volume_cache_isolation(multi_file, volume_cache):
+    serie = pydicom_series.read_files(multi_file)[0]
+    expected = serie.get_pixel_array()
+
+    # A copy is returned, which the caller may change
+    volume_cache(1 << 24)
+    for i in range(2):
+        volume = serie.get_pixel_array()
+        np.testing.assert_array_equal(volume, expected)
+        volume[...] = 0
+
+    # Or the cached array itself, which cannot be changed
+    volume_cache(1 << 24, copy=False)
+    for i in range(2):
+        volume = serie.get_pixel_array()
+        np.testing.assert_array_equal(volume, expected)
+        with pytest.raises(ValueError):
+            volume[...] = 0
+    data, slopes, offsets = serie.get_pixel_array(rescale='lazy')
+    for array in (data, slopes, offsets):
+        assert not array.flags.writeable
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from pydicom_ext import ScanUtils
+
+
+def _save_and_load(shard, filename):
+    ScanUtils.save_shard(shard, filename)
+    return ScanUtils.load_shard(filename)
+
+
+@pytest.mark.parametrize('n_shards', [1, 2, 4, 5])
+def test_merged_shards_match_scan(multi_series, tmp_path, n_shards):
+    expected, stats = ScanUtils.scan([multi_series], workers=2)
+    assert len(expected) == 3
+
+    # The shards may be loaded in any order, and cut through the series
+    suffixes = ['.json', '.json.gz']
+    shards = []
+    for i in reversed(range(n_shards)):
+        shard = ScanUtils.scan_shard([multi_series], i, n_shards, workers=2)
+        filename = str(tmp_path / ('shard%d' % i + suffixes[i % 2]))
+        shards.append(_save_and_load(shard, filename))
+    series = ScanUtils.merge_shards(shards)
+
+    assert [s.suid for s in series] == [s.suid for s in expected]
+    for s, e in zip(series, expected):
+        assert s.shape == e.shape
+        assert s.sampling == e.sampling
+        assert s.filenames == e.filenames
+        for key in ('InstanceNumber', 'ImagePositionPatient'):
+            assert [ds.get(key) for ds in s._datasets] == \
+                [ds.get(key) for ds in e._datasets]
+        np.testing.assert_array_equal(s.get_pixel_array(),
+                                      e.get_pixel_array())
+
+
+def test_merged_shards_match_scan_temporal(gated, tmp_path):
+    expected, stats = ScanUtils.scan([gated], workers=2, temporal=True)
+    shards = [_save_and_load(ScanUtils.scan_shard([gated], i, 3),
+                             str(tmp_path / ('shard%d.json' % i)))
+              for i in range(3)]
+    series = ScanUtils.merge_shards(shards, temporal=True)
+    assert [s.shape for s in series] == [s.shape for s in expected]
+    for name in expected[0].timing.dtype.names:
+        np.testing.assert_array_equal(series[0].timing[name],
+                                      expected[0].timing[name])
+    np.testing.assert_array_equal(series[0].get_pixel_array(),
+                                  expected[0].get_pixel_array())
+
+
+def test_load_shard_rejects_other_files(tmp_path):
+    filename = str(tmp_path / 'other.json')
+    with open(filename, 'w') as f:
+        f.write('{}')
+    with pytest.raises(ValueError):
+        ScanUtils.load_shard(filename)
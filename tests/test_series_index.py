@@ -0,0 +1,170 @@
+import os
+import json
+import shutil
+import sqlite3
+import numpy as np
+import pytest
+from pydicom.dataset import Dataset
+from pydicom.sequence import Sequence
+from pydicom_ext import pydicom_series
+from pydicom_ext.SeriesIndexUtils import (SeriesIndex, dataset_from_json,
+                                          dataset_to_json)
+
+
+@pytest.fixture
+def series_dir(multi_file, tmp_path):
+    """ a copy of the multi_file series, which the tests may change """
+    root = str(tmp_path / 'series')
+    shutil.copytree(multi_file, root)
+    return root
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """ the files that are parsed by pydicom_series """
+    files = []
+    read_file = pydicom_series._readFile
+
+    def counting_read_file(filename, *args, **kwargs):
+        files.append(filename)
+        return read_file(filename, *args, **kwargs)
+
+    monkeypatch.setattr(pydicom_series, '_readFile', counting_read_file)
+    return files
+
+
+def _store_all(index, files):
+    index.set_tags(pydicom_series.discoveryTags)
+    for filename, (dcm, why) in zip(files,
+                                    pydicom_series.read_headers(files)):
+        index.store(filename, dcm)
+    index.commit()
+
+
+def test_lookup_hit_and_miss(series_dir, tmp_path):
+    files = pydicom_series.list_files(series_dir)
+    with SeriesIndex(str(tmp_path / 'index.db')) as index:
+        _store_all(index, files[1:])
+        found = index.lookup(files)
+    assert files[0] not in found
+    assert sorted(found) == sorted(files[1:])
+    for filename in files[1:]:
+        dcm = found[filename]
+        assert dcm.filename == filename
+        expected, why = next(pydicom_series.read_headers([filename]))
+        assert dcm.SeriesInstanceUID == expected.SeriesInstanceUID
+        assert dcm.InstanceNumber == expected.InstanceNumber
+        assert list(dcm.ImagePositionPatient) == \
+            list(expected.ImagePositionPatient)
+
+
+def test_lookup_invalidated_by_size(series_dir, tmp_path):
+    files = pydicom_series.list_files(series_dir)
+    with SeriesIndex(str(tmp_path / 'index.db')) as index:
+        _store_all(index, files)
+        st = os.stat(files[0])
+        with open(files[0], 'ab') as f:
+            f.write(b'\x00\x00')
+        os.utime(files[0], ns=(st.st_atime_ns, st.st_mtime_ns))
+        found = index.lookup(files)
+    assert files[0] not in found
+    assert len(found) == len(files) - 1
+
+
+def test_lookup_invalidated_by_mtime(series_dir, tmp_path):
+    files = pydicom_series.list_files(series_dir)
+    with SeriesIndex(str(tmp_path / 'index.db')) as index:
+        _store_all(index, files)
+        st = os.stat(files[0])
+        os.utime(files[0], ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        found = index.lookup(files)
+    assert files[0] not in found
+    assert len(found) == len(files) - 1
+
+
+def test_set_tags_clears_entries(series_dir, tmp_path):
+    files = pydicom_series.list_files(series_dir)
+    with SeriesIndex(str(tmp_path / 'index.db')) as index:
+        _store_all(index, files)
+        index.set_tags(pydicom_series.discoveryTags + ['PatientName'])
+        assert index.lookup(files) == {}
+
+
+def test_read_files_parses_only_changed_files(series_dir, tmp_path, reads):
+    filename = str(tmp_path / 'index.db')
+    expected = pydicom_series.read_files(series_dir, headerOnly=True)
+    files = pydicom_series.list_files(series_dir)
+
+    del reads[:]
+    pydicom_series.read_files(series_dir, index=filename)
+    assert sorted(reads) == sorted(files)
+
+    del reads[:]
+    series = pydicom_series.read_files(series_dir, index=filename)
+    assert reads == []
+    assert [s.suid for s in series] == [s.suid for s in expected]
+    assert series[0].shape == expected[0].shape
+    np.testing.assert_array_equal(series[0].get_pixel_array(),
+                                  expected[0].get_pixel_array())
+
+    st = os.stat(files[2])
+    os.utime(files[2], ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    pydicom_series.read_files(series_dir, index=filename)
+    assert reads == [files[2]]
+
+
+def _add_binary_values(dcm):
+    """ add OB, OW and UN values, also in a sequence item """
+    dcm.add_new(0x00420011, 'OB', b'%PDF\x00\xff\x80')
+    dcm.add_new(0x00281201, 'OW', b'\x00\x01\xfe\xff')
+    dcm.add_new(0x00110010, 'LO', 'PRIVATE')
+    dcm.add_new(0x00111010, 'UN', b"b'\x00'")
+    item = Dataset()
+    item.add_new(0x00420011, 'OB', b'\x01\x02')
+    item.ReferencedSOPInstanceUID = '1.2.3'
+    dcm.ReferencedImageSequence = Sequence([item])
+
+
+def _assert_same_elements(dcm, expected):
+    assert [elem.tag for elem in dcm] == [elem.tag for elem in expected]
+    for elem, other in zip(dcm, expected):
+        assert elem.VR == other.VR
+        if elem.VR == 'SQ':
+            for item, other_item in zip(elem.value, other.value):
+                _assert_same_elements(item, other_item)
+        else:
+            assert elem.value == other.value
+            assert type(elem.value) is type(other.value)
+
+
+def test_binary_values_round_trip(series_dir, tmp_path):
+    files = pydicom_series.list_files(series_dir)
+    dcm, why = next(pydicom_series.read_headers(files))
+    _add_binary_values(dcm)
+
+    data = json.loads(json.dumps(dataset_to_json(dcm)))
+    loaded = dataset_from_json(data, files[0])
+    _assert_same_elements(loaded, dcm)
+    assert loaded[0x00420011].value == b'%PDF\x00\xff\x80'
+
+    with SeriesIndex(str(tmp_path / 'index.db')) as index:
+        index.set_tags(pydicom_series.discoveryTags)
+        index.store(files[0], dcm)
+        index.commit()
+        _assert_same_elements(index.lookup(files[:1])[files[0]], dcm)
+
+
+def test_entries_of_another_version_are_removed(series_dir, tmp_path):
+    files = pydicom_series.list_files(series_dir)
+    filename = str(tmp_path / 'index.db')
+    with SeriesIndex(filename) as index:
+        _store_all(index, files)
+    # an index without JSON_VERSION, which stored bytes as "b'...'"
+    connection = sqlite3.connect(filename)
+    connection.execute("UPDATE meta SET value = ? WHERE key = 'tags'",
+                       (json.dumps(pydicom_series.discoveryTags),))
+    connection.commit()
+    connection.close()
+    with SeriesIndex(filename) as index:
+        index.set_tags(pydicom_series.discoveryTags)
+        assert index.lookup(files) == {}